@@ -0,0 +1,92 @@
+"""
+Aggregate decode throughput: continuous batching vs the per-request path.
+
+Needs a local GGUF model:
+
+    python -m benchmarks.bench_batching --model model.gguf --requests 16 --concurrency 8
+
+The per-request path is today's default (one Llama context, requests
+serialized on it). The batched path multiplexes ``--concurrency`` requests
+into one llama.cpp context with that many sequence slots. EOS is
+suppressed in both so every request decodes exactly ``--max-tokens``.
+"""
+from __future__ import annotations
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.inference.batching import BatchedLlama, BatchScheduler, LlamaCppBatchBackend
+
+PROMPTS = [
+    "[system]\nYou are a helpful assistant.\n\n[user]\n日本の四季について説明してください。\n\n[assistant]\n",
+    "[system]\nYou are a helpful assistant.\n\n[user]\nExplain how a CPU cache works.\n\n[assistant]\n",
+    "[system]\nYou are a helpful assistant.\n\n[user]\n週末のおすすめの過ごし方を教えて。\n\n[assistant]\n",
+    "[system]\nYou are a helpful assistant.\n\n[user]\nWrite a short story about a lighthouse.\n\n[assistant]\n",
+]
+
+
+def _run(completion_fn, n_requests: int, concurrency: int, max_tokens: int, eos: int) -> float:
+    def no_eos(_ids, scores):
+        scores[eos] = -np.inf
+        return scores
+
+    def one(i: int) -> int:
+        stream = completion_fn(
+            prompt=PROMPTS[i % len(PROMPTS)],
+            max_tokens=max_tokens,
+            temperature=0.7,
+            top_p=0.95,
+            logits_processor=[no_eos],
+            stream=True,
+        )
+        return sum(1 for _ in stream)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(one, range(n_requests)))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--ctx-size", type=int, default=2048)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    from llama_cpp import Llama  # type: ignore
+
+    total_tokens = args.requests * args.max_tokens
+
+    # Per-request path: one context, one request at a time
+    llama = Llama(model_path=args.model, n_ctx=args.ctx_size, n_threads=args.threads, verbose=False)
+    lock = threading.Lock()
+
+    def serialized(**kwargs):
+        with lock:
+            yield from llama.create_completion(**kwargs)
+
+    seq_s = _run(serialized, args.requests, args.concurrency, args.max_tokens, llama.token_eos())
+    print(f"per-request : {seq_s:7.2f}s  {total_tokens / seq_s:8.1f} tok/s")
+
+    backend = LlamaCppBatchBackend(
+        llama,
+        n_seq=args.concurrency,
+        n_ctx_per_seq=args.ctx_size,
+        n_batch=512,
+        n_threads=args.threads,
+    )
+    facade = BatchedLlama(BatchScheduler(backend, args.concurrency, model_path=args.model), llama)
+    batch_s = _run(facade.create_completion, args.requests, args.concurrency, args.max_tokens, llama.token_eos())
+    print(f"batched     : {batch_s:7.2f}s  {total_tokens / batch_s:8.1f} tok/s  ({seq_s / batch_s:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
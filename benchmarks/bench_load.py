@@ -0,0 +1,186 @@
+"""
+Load test of each pattern's FastAPI app against a deterministic fake Llama.
+
+    SYSTEM_PROMPT_FILE=prompts/system_prompt.md python -m benchmarks.bench_load \\
+        --pattern all --requests 200 --concurrency 8 --tokens-per-s 200 --mix ja=0.7,en=0.3 --stream 0.5
+
+Requests go through the real routing, prompt building, pool, decode loop,
+counting and post-processing (in-process over ASGI, no sockets). Only
+llama.cpp is replaced, by benchmarks.fake_llama.FakeLlama emitting tokens at
+``--tokens-per-s``. With the default rate of 0 the numbers are pure service
+overhead, which is what a CPU-only CI job should track.
+
+Latency is measured client-side; TTFT comes from the server's
+meta.timings.ttft_ms (it includes queue wait) because the in-process
+transport delivers a streamed body only once it is complete.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from common.config import reload_settings
+
+from .fake_llama import FakeLlama
+
+PATTERNS = {"a": "a_ignore_eos", "b": "b_logit_bias", "c": "c_logits_processor"}
+
+PROMPTS = {
+    "ja": [
+        "日本の四季について説明してください。",
+        "週末のおすすめの過ごし方を教えて。",
+        "東京で人気の観光地はどこですか？",
+        "健康的な朝ごはんのアイデアをください。",
+    ],
+    "en": [
+        "Explain how a CPU cache works.",
+        "Write a short story about a lighthouse.",
+        "What are good habits for remote work?",
+        "Summarize the history of the bicycle.",
+    ],
+}
+
+
+def _parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        lang, _, weight = part.partition("=")
+        if lang not in PROMPTS:
+            raise SystemExit(f"unknown language in --mix: {lang}")
+        mix.append((lang, float(weight or 1)))
+    return mix
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _done_meta(resp: httpx.Response, streamed: bool) -> Dict[str, Any]:
+    if not streamed:
+        return resp.json()["meta"]
+    event = None
+    for line in resp.text.splitlines():
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: ") and event == "done":
+            return json.loads(line[len("data: "):])["meta"]
+    raise RuntimeError("stream ended without a done event")
+
+
+async def _run_pattern(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    engine = importlib.import_module(f"src.{PATTERNS[name]}.app.engine")
+    main_mod = importlib.import_module(f"src.{PATTERNS[name]}.app.main")
+    fake_kwargs = dict(
+        tokens_per_s=args.tokens_per_s,
+        prompt_tokens_per_s=args.prompt_tokens_per_s,
+        natural_tokens=args.natural_tokens,
+        n_vocab=args.n_vocab,
+        seed=args.seed,
+        usage_in_stream=True,
+    )
+    engine.engine.load_llama = lambda model_path=None: FakeLlama(**fake_kwargs)
+    engine.engine._registry = None
+    app = main_mod.create_app()
+
+    rng = random.Random(args.seed)
+    mix = _parse_mix(args.mix)
+    plan = []
+    for i in range(args.requests):
+        lang = rng.choices([m[0] for m in mix], weights=[m[1] for m in mix])[0]
+        plan.append((rng.choice(PROMPTS[lang]), rng.random() < args.stream))
+
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def worker() -> None:
+            nonlocal errors
+            while not queue.empty():
+                content, streamed = queue.get_nowait()
+                body = {"messages": [{"role": "user", "content": content}], "stream": streamed}
+                t0 = time.perf_counter()
+                resp = await client.post("/chat", json=body)
+                elapsed = time.perf_counter() - t0
+                if resp.status_code != 200:
+                    errors += 1
+                    continue
+                latencies.append(elapsed)
+                ttft = (_done_meta(resp, streamed).get("timings") or {}).get("ttft_ms")
+                if ttft is not None:
+                    ttfts.append(ttft / 1000)
+
+        # Warm-up request: pool/context creation is not part of the steady state
+        await client.post("/chat", json={"messages": [{"role": "user", "content": "warm up"}]})
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+
+    return {
+        "pattern": PATTERNS[name],
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / wall if wall > 0 else 0.0,
+        "latency_ms": {q: _percentile(latencies, p) * 1000 for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "ttft_ms": {q: _percentile(ttfts, p) * 1000 for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "mean_latency_ms": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pattern", default="all", help="a, b, c or all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=None, help="POOL_SIZE for the run (default: --concurrency)")
+    parser.add_argument("--mix", default="ja=0.5,en=0.5", help="language weights, e.g. ja=0.7,en=0.3")
+    parser.add_argument("--stream", type=float, default=0.0, help="fraction of requests using SSE streaming")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0, help="fake decode rate (0 = instant)")
+    parser.add_argument("--prompt-tokens-per-s", type=float, default=0.0, help="fake prompt eval rate (0 = instant)")
+    parser.add_argument("--natural-tokens", type=int, default=10**9, help="fake EOS after this many tokens unless suppressed")
+    parser.add_argument("--n-vocab", type=int, default=32000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", default=None, help="also write results to this file")
+    args = parser.parse_args()
+
+    os.environ["POOL_SIZE"] = str(args.pool_size or args.concurrency)
+    os.environ.setdefault("VOCAB_CACHE_DIR", "")
+    reload_settings()
+
+    names = list(PATTERNS) if args.pattern == "all" else [args.pattern]
+    results = [asyncio.run(_run_pattern(n, args)) for n in names]
+
+    print(f"{'pattern':<18} {'req':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft p50':>9} {'ttft p99':>9}")
+    for r in results:
+        lat, ttft = r["latency_ms"], r["ttft_ms"]
+        print(
+            f"{r['pattern']:<18} {r['requests']:>5} {r['errors']:>4} {r['rps']:>8.1f} "
+            f"{lat['p50']:>8.2f} {lat['p95']:>8.2f} {lat['p99']:>8.2f} {ttft['p50']:>9.2f} {ttft['p99']:>9.2f}"
+        )
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
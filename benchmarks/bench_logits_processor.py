@@ -0,0 +1,58 @@
+"""
+Per-token overhead of the pattern C logits processor.
+
+    python -m benchmarks.bench_logits_processor
+
+Compares the previous per-id Python loop with the fused NumPy processor at
+32k/128k/256k vocab sizes, before and after the EOS release.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from src.c_logits_processor.app.processors import MinCharLengthProcessor
+
+
+def _legacy_call(released: bool, eos_id: int, punct_ids: set, bias: float, logits):
+    # The processor body before vectorization, kept for comparison
+    if not released:
+        if 0 <= eos_id < len(logits):
+            logits[eos_id] = float("-inf")
+    else:
+        for tid in punct_ids:
+            if 0 <= tid < len(logits):
+                logits[tid] = float(logits[tid]) + bias
+    return logits
+
+
+def _per_call_us(fn, logits, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn([], logits)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iters", type=int, default=5000)
+    parser.add_argument("--punct", type=int, default=300, help="number of punctuation token ids")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'vocab':>7} {'phase':>9} {'legacy us':>10} {'fused us':>9}")
+    for n_vocab in (32_000, 128_000, 256_000):
+        punct = set(rng.choice(n_vocab, size=args.punct, replace=False).tolist())
+        logits = rng.standard_normal(n_vocab).astype(np.float32)
+        for released in (False, True):
+            proc = MinCharLengthProcessor(eos_token_id=2, min_len=0 if released else 10**9, punctuation_token_ids=punct)
+            legacy = _per_call_us(lambda ids, lg: _legacy_call(released, 2, punct, 0.5, lg), logits.copy(), args.iters)
+            fused = _per_call_us(proc, logits.copy(), args.iters)
+            phase = "released" if released else "suppress"
+            print(f"{n_vocab:>7} {phase:>9} {legacy:>10.2f} {fused:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Cost of the /metrics instrumentation without a model.
+
+    SYSTEM_PROMPT_FILE=prompts/system_prompt.md python -m benchmarks.bench_metrics_overhead
+
+Runs pattern C's generate() against an instant fake Llama with METRICS on
+and off, and times observe_request() and a full /metrics render. The token
+loop itself only stores two timestamps per request.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+from common import metrics
+from common.config import reload_settings
+from src.c_logits_processor.app import engine
+
+from .fake_llama import FakeLlama
+
+
+def _per_call_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--tokens", type=int, default=256, help="streamed chunks per request")
+    args = parser.parse_args()
+
+    fake = FakeLlama(text="あ" * args.tokens, piece_chars=1)
+    engine.engine.load_llama = lambda model_path=None: fake
+    messages = [{"role": "user", "content": "こんにちは"}]
+    run = lambda: engine.generate(messages, min_len=args.tokens // 2, max_len=args.tokens)  # noqa: E731
+
+    results = {}
+    for flag in ("false", "true", "false", "true"):
+        os.environ["METRICS"] = flag
+        reload_settings()
+        run()
+        results[flag] = _per_call_us(run, args.requests)
+    off, on = results["false"], results["true"]
+    print(f"generate() {args.tokens} tokens, METRICS=off: {off:9.1f} us/request")
+    print(f"generate() {args.tokens} tokens, METRICS=on : {on:9.1f} us/request ({(on - off) / off * 100:+.2f}%)")
+
+    meta = run()["meta"]
+    print(f"observe_request                    : {_per_call_us(lambda: metrics.observe_request('bench', meta), 10_000):9.2f} us")
+    print(f"/metrics render                    : {_per_call_us(metrics.REGISTRY.render, 500):9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
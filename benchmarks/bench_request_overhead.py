@@ -0,0 +1,55 @@
+"""
+Per-request service overhead without a model.
+
+    SYSTEM_PROMPT_FILE=prompts/system_prompt.md python -m benchmarks.bench_request_overhead
+
+Times get_settings() against a full reload (what every call used to cost:
+env parsing plus reading SYSTEM_PROMPT_FILE), then POST /chat end to end
+through each pattern's app with an instant fake Llama.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import time
+
+from fastapi.testclient import TestClient
+
+from common.config import get_settings, reload_settings
+
+from .fake_llama import FakeLlama
+
+PATTERNS = ["a_ignore_eos", "b_logit_bias", "c_logits_processor"]
+
+
+def _per_call_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    reload_settings()
+    print(f"get_settings (cached) : {_per_call_us(get_settings, 100_000):8.2f} us/call")
+    print(f"reload_settings       : {_per_call_us(reload_settings, 2_000):8.2f} us/call")
+
+    body = {"messages": [{"role": "user", "content": "こんにちは"}]}
+    for pattern in PATTERNS:
+        engine = importlib.import_module(f"src.{pattern}.app.engine")
+        main_mod = importlib.import_module(f"src.{pattern}.app.main")
+        fake = FakeLlama()
+        engine.engine.load_llama = lambda model_path=None, _fake=fake: _fake
+        engine.engine._registry = None
+        client = TestClient(main_mod.create_app())
+        client.post("/chat", json=body)  # warm up
+        us = _per_call_us(lambda: client.post("/chat", json=body), args.requests)
+        print(f"POST /chat {pattern:<20}: {us:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Speculative decoding gain per pattern, against a deterministic fake Llama.
+
+    SYSTEM_PROMPT_FILE=prompts/system_prompt.md python -m benchmarks.bench_speculative \\
+        --tokens-per-s 20 --verify-cost 0.1 --draft-tokens 8
+
+The fake model "writes" house-style prose: sentences from a small fixed set,
+of which the prompt carries an example. Each pattern runs the same requests
+with and without the prompt-lookup drafter through engine.generate(), so
+its EOS handling (ignore_eos, EOS logit_bias, MinCharLengthProcessor) is in
+the loop. Outputs must be identical; the table shows acceptance, tokens per
+forward pass and the decode tokens/sec gain. ``--verify-cost`` is the cost
+of each drafted token in a verification pass, relative to one decode step.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import random
+import statistics
+from typing import Any, Dict, List
+
+from common.config import reload_settings
+from common.inference.speculative import DraftStats, PromptLookupDraft
+
+from .fake_llama import FakeLlama
+
+PATTERNS = {"a": "a_ignore_eos", "b": "b_logit_bias", "c": "c_logits_processor"}
+
+SENTENCES = [
+    "今日は天気が良いですね。",
+    "私の考えでは、それはとても大切なことだと思います。",
+    "東京に行きました。",
+    "それから友達と一緒に食事をしました。",
+    "とても楽しかったです。",
+    "日本の四季はそれぞれ美しいです。",
+]
+
+
+def _house_text(rng: random.Random, n: int) -> str:
+    return "".join(rng.choice(SENTENCES) for _ in range(n))
+
+
+def _run(engine: Any, texts: List[str], prompt: str, args: argparse.Namespace, speculative: bool) -> List[Dict[str, Any]]:
+    results = []
+    for text in texts:
+        draft = DraftStats(PromptLookupDraft(args.ngram, args.draft_tokens), "prompt_lookup") if speculative else None
+        fake = FakeLlama(text=text, piece_chars=0, tokens_per_s=args.tokens_per_s, draft_model=draft, verify_cost=args.verify_cost)
+        engine.engine.load_llama = lambda model_path=None, fake=fake: fake
+        engine.engine._registry = None
+        messages = [{"role": "user", "content": f"次の文体で日記を書いてください。\n{prompt}"}]
+        results.append(engine.generate(messages, min_len=args.min_len, max_len=args.max_len))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pattern", default="all", help="a, b, c or all")
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--tokens-per-s", type=float, default=20.0, help="fake decode rate (one forward pass)")
+    parser.add_argument("--verify-cost", type=float, default=0.1)
+    parser.add_argument("--draft-tokens", type=int, default=8)
+    parser.add_argument("--ngram", type=int, default=2)
+    parser.add_argument("--min-len", type=int, default=120)
+    parser.add_argument("--max-len", type=int, default=240)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("VOCAB_CACHE_DIR", "")
+    os.environ["TEMPERATURE"] = "0"
+    os.environ["EARLY_STOP"] = "off"
+    reload_settings()
+
+    rng = random.Random(args.seed)
+    prompt = _house_text(rng, 6)
+    texts = [_house_text(rng, 40) for _ in range(args.requests)]
+
+    names = list(PATTERNS) if args.pattern == "all" else [args.pattern]
+    print(f"{'pattern':<18} {'base tok/s':>10} {'spec tok/s':>10} {'gain':>6} {'accept':>7} {'tok/pass':>8} {'same':>5}")
+    for name in names:
+        engine = importlib.import_module(f"src.{PATTERNS[name]}.app.engine")
+        base = _run(engine, texts, prompt, args, speculative=False)
+        spec = _run(engine, texts, prompt, args, speculative=True)
+        same = all(b["text"] == s["text"] for b, s in zip(base, spec))
+        base_rate = statistics.fmean(r["meta"]["timings"]["decode_tokens_per_s"] or 0 for r in base)
+        spec_rate = statistics.fmean(r["meta"]["timings"]["decode_tokens_per_s"] or 0 for r in spec)
+        accept = statistics.fmean(r["meta"]["speculative"]["acceptance_rate"] or 0 for r in spec)
+        per_pass = statistics.fmean(r["meta"]["speculative"]["tokens_per_step"] or 0 for r in spec)
+        gain = spec_rate / base_rate if base_rate else float("nan")
+        print(
+            f"{PATTERNS[name]:<18} {base_rate:>10.1f} {spec_rate:>10.1f} {gain:>5.2f}x "
+            f"{accept:>7.2f} {per_pass:>8.2f} {str(same):>5}"
+        )
+        if not same:
+            raise SystemExit(f"{PATTERNS[name]}: speculative output differs from plain decoding")
+
+
+if __name__ == "__main__":
+    main()
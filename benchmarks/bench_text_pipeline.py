@@ -0,0 +1,87 @@
+"""
+Post-processing cost on long outputs: the previous separate passes against
+the single-pass StreamingSanitizer pipeline.
+
+    python -m benchmarks.bench_text_pipeline --chars 100000
+
+"legacy" is today's batch path as the engines used it: safe_trim (with the
+full finditer list), auto_close_pairs, then count_chars over the result.
+"pipeline" feeds the same text through StreamingSanitizer, whole and in
+token-sized deltas, and reads the char count from its counting stage.
+Outputs must match. "us/delta" is the streaming cost per decoded token.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable, List, Tuple
+
+from common.inference.tokenizer import count_chars
+from common.utils.text_sanitize import SENTENCE_END, StreamingSanitizer, auto_close_pairs
+
+PIECES = ["今日は", "天気が", "良いですね。", "「東京", "に行きました」", "(see", " notes).", " Hello", " world!", "\n"]
+
+
+def _legacy_safe_trim(text: str, max_len: int) -> str:
+    # safe_trim before the pipeline, kept for comparison
+    if len(text) <= max_len:
+        return text
+    snippet = text[:max_len]
+    m = list(SENTENCE_END.finditer(snippet))
+    if m:
+        return snippet[: m[-1].end()]
+    return snippet.rstrip()
+
+
+def _legacy(text: str, max_len: int) -> Tuple[str, int]:
+    out = auto_close_pairs(_legacy_safe_trim(text, max_len))
+    return out, count_chars(out)
+
+
+def _pipeline(deltas: List[str], max_len: int) -> Tuple[str, int]:
+    san = StreamingSanitizer(max_len)
+    for d in deltas:
+        san.feed(d)
+    san.finish()
+    return san.text, san.chars
+
+
+def _best_ms(fn: Callable[[], Tuple[str, int]], repeat: int) -> Tuple[float, Tuple[str, int]]:
+    best, out = float("inf"), ("", 0)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chars", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pieces: List[str] = []
+    size = 0
+    while size < args.chars:
+        pieces.append(rng.choice(PIECES))
+        size += len(pieces[-1])
+    text = "".join(pieces)
+
+    print(f"{'max_len':>8} {'legacy ms':>10} {'whole ms':>9} {'deltas ms':>10} {'us/delta':>9} {'same':>5}")
+    for max_len in (args.chars // 2, args.chars - 7, args.chars * 2):
+        legacy_ms, expected = _best_ms(lambda: _legacy(text, max_len), args.repeat)
+        whole_ms, whole = _best_ms(lambda: _pipeline([text], max_len), args.repeat)
+        deltas_ms, streamed = _best_ms(lambda: _pipeline(pieces, max_len), args.repeat)
+        same = whole == expected == streamed
+        per_delta = deltas_ms * 1e3 / len(pieces)
+        print(f"{max_len:>8} {legacy_ms:>10.2f} {whole_ms:>9.2f} {deltas_ms:>10.2f} {per_delta:>9.2f} {str(same):>5}")
+        if not same:
+            raise SystemExit(f"max_len={max_len}: pipeline output differs from the batch functions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import random
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from common.inference.budget import detect_language
+
+# Token-sized pieces in the shape real BPE vocabularies produce: Japanese
+# runs of 1-3 characters with 。/、 as separate or merged tokens, English
+# words with a leading space and merged punctuation.
+JA_PIECES = [
+    "今日", "は", "天気", "が", "良い", "です", "ね", "。", "、", "私", "の", "考え", "では",
+    "東京", "に", "行き", "ました", "。", "それ", "から", "友達", "と", "一緒", "に", "食事",
+    "を", "しました", "楽しかった", "です。", "とても", "大切", "な", "こと", "だと", "思い",
+    "ます", "。", "日本", "の", "四季", "春", "夏", "秋", "冬", "それぞれ", "美しい", "「", "」",
+]
+EN_PIECES = [
+    " The", " weather", " is", " nice", " today", ".", " I", " think", " that", " we",
+    " should", " go", " to", " the", " park", ",", " and", " then", " have", " lunch",
+    " together", ".", " It", " was", " a", " great", " day", " for", " everyone", ".",
+    " However", " there", " are", " many", " reasons", " why", " this", " matters", "!",
+    " (", "see", " above", ")", " So", " let", "'s", " start", ".\n",
+]
+
+
+class FakeLlama:
+    """
+    Deterministic stand-in for llama_cpp.Llama, no model file needed.
+
+    With ``text`` it replays that text in ``piece_chars`` chunks (0 = split
+    into the vocabulary pieces below). Otherwise it samples Japanese or
+    English pieces (``language="auto"`` follows the script of the user turn),
+    seeded by the prompt so runs are repeatable. ``tokens_per_s`` /
+    ``prompt_tokens_per_s`` add decode / prompt-eval latency (0 = instant).
+    Logits processors and ``logit_bias`` are applied to a ``n_vocab`` array
+    each step, so their cost is part of the timing, and EOS is emitted after
+    ``natural_tokens`` unless suppressed.
+
+    A ``draft_model`` is used like llama.cpp does: each forward pass verifies
+    its proposal and emits the accepted prefix plus one sampled token, and
+    costs ``1 + verify_cost * len(proposal)`` token intervals. The output is
+    the same as without it.
+    """
+
+    def __init__(
+        self,
+        text: Optional[str] = None,
+        piece_chars: int = 2,
+        language: str = "auto",
+        tokens_per_s: float = 0.0,
+        prompt_tokens_per_s: float = 0.0,
+        natural_tokens: int = 10**9,
+        n_vocab: int = 32000,
+        seed: int = 0,
+        usage_in_stream: bool = False,
+        draft_model: Any = None,
+        verify_cost: float = 0.1,
+    ) -> None:
+        self.model_path = "fake"
+        self.text = text
+        self.piece_chars = piece_chars
+        self.language = language
+        self.tokens_per_s = tokens_per_s
+        self.prompt_tokens_per_s = prompt_tokens_per_s
+        self.natural_tokens = natural_tokens
+        self._n_vocab = n_vocab
+        self.seed = seed
+        self.usage_in_stream = usage_in_stream
+        self.draft_model = draft_model
+        self.verify_cost = verify_cost
+        self._vocab = ["", "<s>", "</s>"] + sorted(set(JA_PIECES + EN_PIECES))
+        self._ids = {piece: i for i, piece in enumerate(self._vocab) if piece}
+        self._longest = max(len(p) for p in self._ids)
+
+    def token_eos(self) -> int:
+        return 2
+
+    def n_vocab(self) -> int:
+        return self._n_vocab
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return "".join(self._vocab[t] if t < len(self._vocab) else "" for t in tokens).encode("utf-8")
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        # ~1 token per 3 UTF-8 bytes is close to real tokenizers on mixed text
+        n = len(text if isinstance(text, bytes) else str(text).encode("utf-8"))
+        return [1] * (n // 3 + int(add_bos))
+
+    def _split(self, text: str) -> List[str]:
+        # Greedy longest match over the vocabulary; unknown characters are single pieces
+        pieces, i = [], 0
+        while i < len(text):
+            for size in range(min(self._longest, len(text) - i), 0, -1):
+                if text[i:i + size] in self._ids or size == 1:
+                    pieces.append(text[i:i + size])
+                    i += size
+                    break
+        return pieces
+
+    def _piece_id(self, piece: str) -> int:
+        return self._ids.setdefault(piece, len(self._vocab) + len(self._ids))
+
+    def _pieces(self, prompt: str) -> Iterator[str]:
+        if self.text is not None and self.piece_chars <= 0:
+            yield from self._split(self.text)
+            return
+        if self.text is not None:
+            step = self.piece_chars
+            for i in range(0, len(self.text), step):
+                yield self.text[i:i + step]
+            return
+        language = self.language
+        if language == "auto":
+            user = prompt.rsplit("[user]", 1)[-1]
+            language = detect_language(user)
+        pieces = JA_PIECES if language == "ja" else EN_PIECES
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")) ^ self.seed)
+        while True:
+            yield rng.choice(pieces)
+
+    def _stream(self, prompt: str, max_tokens: int, kwargs: Dict[str, Any], usage: bool = False) -> Iterator[Dict[str, Any]]:
+        prompt_tokens = len(self.tokenize(prompt.encode("utf-8")))
+        if self.prompt_tokens_per_s > 0:
+            time.sleep(prompt_tokens / self.prompt_tokens_per_s)
+        processors = kwargs.get("logits_processor") or []
+        bias = kwargs.get("logit_bias") or {}
+        ignore_eos = kwargs.get("ignore_eos", False)
+        eos = self.token_eos()
+        interval = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        next_at = time.perf_counter()
+        ids = np.zeros(0, dtype=np.intc)
+        n = 0
+        draft = self.draft_model
+        history = [self._piece_id(p) for p in self._split(prompt)] if draft is not None else []
+        proposal = np.zeros(0, dtype=np.intc)
+        verified = 0  # tokens of the current forward pass already emitted
+        for piece in self._pieces(prompt):
+            if n >= max_tokens:
+                break
+            eos_score = 0.0
+            if processors or bias:
+                scores = np.zeros(self._n_vocab, dtype=np.float32)
+                for tid, b in bias.items():
+                    scores[int(tid)] += b
+                for proc in processors:
+                    scores = proc(ids, scores)
+                eos_score = float(scores[eos])
+            if n >= self.natural_tokens and not ignore_eos and eos_score > -10:
+                break
+            if verified == 0:
+                # A new forward pass, verifying a fresh proposal if drafting
+                if draft is not None:
+                    proposal = np.asarray(draft(np.asarray(history, dtype=np.intc)), dtype=np.intc)
+                if interval:
+                    next_at += interval * (1 + self.verify_cost * len(proposal))
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+            n += 1
+            yield {"choices": [{"text": piece, "index": 0, "finish_reason": None}]}
+            if draft is not None:
+                tid = self._piece_id(piece)
+                history.append(tid)
+                # Accepted draft tokens come out of the same pass
+                if verified < len(proposal) and tid == int(proposal[verified]):
+                    verified += 1
+                else:
+                    verified = 0
+        if usage:
+            record = {"prompt_tokens": prompt_tokens, "completion_tokens": n, "total_tokens": prompt_tokens + n}
+            yield {"choices": [{"text": "", "index": 0, "finish_reason": "length"}], "usage": record}
+
+    def create_completion(self, prompt: str, max_tokens: int = 16, stream: bool = False, **kwargs: Any) -> Any:
+        events = self._stream(prompt, max_tokens, kwargs, usage=stream and self.usage_in_stream)
+        if stream:
+            return events
+        chunks = [ev["choices"][0]["text"] for ev in events]
+        prompt_tokens = len(self.tokenize(prompt.encode("utf-8")))
+        return {
+            "choices": [{"text": "".join(chunks), "index": 0, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(chunks), "total_tokens": prompt_tokens + len(chunks)},
+        }
@@ -0,0 +1,251 @@
+"""
+Sweep llama.cpp runtime settings against the local model and write the
+fastest combination as this host's tuned profile.
+
+    python -m common.autotune --threads 4,8 --batch 256,512 --ubatch 128,512 \\
+        --flash-attn off,on --kv f16,q8_0
+
+Every combination loads MODEL_PATH with CTX_SIZE, runs a fixed prompt set
+(the configured system prompt plus a few user turns) and measures prompt
+eval and decode tokens/sec. ``--objective`` picks the winner: ``latency``
+(default) minimises the time of a typical request (the prompt set plus
+``--decode-tokens`` each), ``prompt`` and ``decode`` maximise one rate.
+The result is written as ``KEY=VALUE`` lines to TUNED_PROFILE (default
+``.cache/tuned/<hostname>.env``), which settings load at startup; env vars
+still override it. ``--dry-run`` prints the table without writing.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import os
+import socket
+import statistics
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from common.config import Settings, get_settings, profile_path
+from common.inference.runtime import kv_cache_type, llama_params
+
+USER_TURNS = [
+    "こんにちは。自己紹介をしてください。",
+    "日本の四季について、それぞれの魅力を説明してください。",
+    "最近読んだ本の感想を教えてください。",
+]
+
+
+@dataclass
+class Trial:
+    profile: Dict[str, str]
+    prompt_tps: float = 0.0
+    decode_tps: float = 0.0
+    latency_s: float = float("inf")
+    error: Optional[str] = None
+    runs: List[Dict[str, float]] = field(default_factory=list)
+
+
+def _bool(value: str) -> str:
+    return "true" if value.lower() in ("1", "true", "yes", "on") else "false"
+
+
+def _ints(spec: str) -> List[int]:
+    return [int(v) for v in spec.split(",") if v.strip()]
+
+
+def _words(spec: str) -> List[str]:
+    return [v.strip() for v in spec.split(",") if v.strip()]
+
+
+def candidates(args: argparse.Namespace) -> List[Dict[str, str]]:
+    """Profiles to try; a quantized V cache is only tried with flash attention (llama.cpp requires it)."""
+    threads = _ints(args.threads) if args.threads else sorted({max(1, (os.cpu_count() or 2) // 2), os.cpu_count() or 1})
+    grid = itertools.product(
+        threads,
+        _ints(args.batch),
+        _ints(args.ubatch),
+        [_bool(v) for v in _words(args.flash_attn)],
+        _words(args.kv),
+    )
+    profiles: List[Dict[str, str]] = []
+    for n_threads, n_batch, n_ubatch, flash, kv in grid:
+        if n_ubatch > n_batch:
+            continue
+        if kv != "f16" and flash != "true":
+            continue
+        profiles.append(
+            {
+                "N_THREADS": str(n_threads),
+                "N_THREADS_BATCH": str(n_threads),
+                "N_BATCH": str(n_batch),
+                "N_UBATCH": str(n_ubatch),
+                "USE_MMAP": _bool(args.mmap),
+                "USE_MLOCK": _bool(args.mlock),
+                "FLASH_ATTN": flash,
+                "TYPE_K": kv,
+                "TYPE_V": kv,
+            }
+        )
+    return profiles
+
+
+def _apply(settings: Settings, profile: Dict[str, str]) -> Dict[str, Any]:
+    # Llama kwargs for ``settings`` with the profile's knobs in place
+    return llama_params(
+        settings,
+        n_threads=int(profile["N_THREADS"]),
+        n_threads_batch=int(profile["N_THREADS_BATCH"]),
+        n_batch=int(profile["N_BATCH"]),
+        n_ubatch=int(profile["N_UBATCH"]),
+        use_mmap=profile["USE_MMAP"] == "true",
+        use_mlock=profile["USE_MLOCK"] == "true",
+        flash_attn=profile["FLASH_ATTN"] == "true",
+        type_k=kv_cache_type(profile["TYPE_K"]),
+        type_v=kv_cache_type(profile["TYPE_V"]),
+    )
+
+
+def prompt_set(settings: Settings) -> List[str]:
+    from common.inference.engine import _build_prompt
+
+    return [_build_prompt([{"role": "system", "content": settings.system_prompt}, {"role": "user", "content": u}]) for u in USER_TURNS]
+
+
+def measure(llama: Any, prompt: str, decode_tokens: int) -> Dict[str, float]:
+    """Prompt eval and decode rates of one greedy generation from a clean context."""
+    tokens = llama.tokenize(prompt.encode("utf-8"), special=True)
+    # generate() would otherwise reuse the previous prompt's shared prefix
+    llama.reset()
+    start = time.perf_counter()
+    first: Optional[float] = None
+    n = 0
+    for _ in llama.generate(tokens, temp=0.0, reset=True):
+        if first is None:
+            first = time.perf_counter()
+        n += 1
+        if n >= decode_tokens:
+            break
+    end = time.perf_counter()
+    first = first or end
+    return {
+        "prompt_tokens": len(tokens),
+        "prompt_s": first - start,
+        "decode_tokens": max(0, n - 1),
+        "decode_s": end - first,
+    }
+
+
+def run_trial(
+    factory: Callable[..., Any],
+    model_path: str,
+    settings: Settings,
+    profile: Dict[str, str],
+    prompts: Sequence[str],
+    decode_tokens: int,
+    repeat: int,
+) -> Trial:
+    trial = Trial(profile)
+    try:
+        llama = factory(model_path=model_path, verbose=False, **_apply(settings, profile))
+        # One untimed pass faults the weights in and sizes the compute buffers
+        measure(llama, prompts[0], 2)
+        for _ in range(repeat):
+            trial.runs.extend(measure(llama, p, decode_tokens) for p in prompts)
+    except Exception as e:
+        trial.error = f"{type(e).__name__}: {e}"
+        return trial
+    prompt_s = sum(r["prompt_s"] for r in trial.runs)
+    decode_s = sum(r["decode_s"] for r in trial.runs)
+    trial.prompt_tps = sum(r["prompt_tokens"] for r in trial.runs) / prompt_s if prompt_s else 0.0
+    trial.decode_tps = sum(r["decode_tokens"] for r in trial.runs) / decode_s if decode_s else 0.0
+    # Typical request: the mean prompt at the measured rate plus decode_tokens
+    mean_prompt = statistics.fmean(r["prompt_tokens"] for r in trial.runs)
+    if trial.prompt_tps and trial.decode_tps:
+        trial.latency_s = mean_prompt / trial.prompt_tps + decode_tokens / trial.decode_tps
+    return trial
+
+
+def best_trial(trials: Sequence[Trial], objective: str) -> Optional[Trial]:
+    ok = [t for t in trials if t.error is None and t.prompt_tps > 0 and t.decode_tps > 0]
+    if not ok:
+        return None
+    if objective == "prompt":
+        return max(ok, key=lambda t: t.prompt_tps)
+    if objective == "decode":
+        return max(ok, key=lambda t: t.decode_tps)
+    return min(ok, key=lambda t: t.latency_s)
+
+
+def write_profile(path: str, trial: Trial, model_path: str, objective: str) -> None:
+    lines = [
+        f"# Tuned by python -m common.autotune on {socket.gethostname()} at {time.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"# model={model_path} objective={objective} prompt_tps={trial.prompt_tps:.1f} "
+        f"decode_tps={trial.decode_tps:.1f} latency_s={trial.latency_s:.3f}",
+    ]
+    lines += [f"{k}={v}" for k, v in trial.profile.items()]
+    p = Path(path).expanduser()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(p.name + ".tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def _label(profile: Dict[str, str]) -> str:
+    return (
+        f"t={profile['N_THREADS']} b={profile['N_BATCH']} ub={profile['N_UBATCH']} "
+        f"fa={profile['FLASH_ATTN'][0]} kv={profile['TYPE_K']}"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None, factory: Optional[Callable[..., Any]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="GGUF to tune against (default: MODEL_PATH)")
+    parser.add_argument("--threads", default="", help="comma-separated (default: half and all cores)")
+    parser.add_argument("--batch", default="256,512")
+    parser.add_argument("--ubatch", default="128,256,512")
+    parser.add_argument("--flash-attn", default="off,on")
+    parser.add_argument("--kv", default="f16,q8_0", help="KV cache types, used for both K and V")
+    parser.add_argument("--mmap", default="on")
+    parser.add_argument("--mlock", default="off")
+    parser.add_argument("--decode-tokens", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--objective", choices=("latency", "prompt", "decode"), default="latency")
+    parser.add_argument("-o", "--output", default=None, help="profile path (default: TUNED_PROFILE)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    settings = get_settings()
+    model_path = args.model or settings.model_path
+    if factory is None:
+        from llama_cpp import Llama  # type: ignore
+
+        factory = Llama
+    profiles = candidates(args)
+    prompts = prompt_set(settings)
+    print(f"{len(profiles)} combinations on {model_path}")
+    print(f"{'profile':<42} {'prompt tok/s':>12} {'decode tok/s':>12} {'latency s':>10}")
+    trials: List[Trial] = []
+    for profile in profiles:
+        trial = run_trial(factory, model_path, settings, profile, prompts, args.decode_tokens, args.repeat)
+        trials.append(trial)
+        if trial.error:
+            print(f"{_label(profile):<42} failed: {trial.error}")
+        else:
+            print(f"{_label(profile):<42} {trial.prompt_tps:>12.1f} {trial.decode_tps:>12.1f} {trial.latency_s:>10.3f}")
+
+    best = best_trial(trials, args.objective)
+    if best is None:
+        print("no combination completed")
+        return 1
+    print(f"best ({args.objective}): {_label(best.profile)}")
+    path = args.output or profile_path()
+    if args.dry_run or not path:
+        return 0
+    write_profile(path, best, model_path, args.objective)
+    print(f"wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,256 @@
+"""
+Offline batch generation over a JSONL file of ChatRequest records.
+
+    python -m common.batch requests.jsonl -o results.jsonl --pattern c --workers 4
+
+Each input line is a ChatRequest (``messages``, optional ``min_len`` /
+``max_len`` / ``model``) plus an optional ``id``; the line number is used
+when ``id`` is missing. Every worker process loads its own Llama through
+the chosen engine. Results are appended to the output as they finish
+(completion order) as ``{"id", "line", "text", "meta"}`` or
+``{"id", "line", "error"}``. The output doubles as the checkpoint: rerunning
+the same command skips ids already written, and ``--retry-errors`` drops
+the error records before rerunning them, so every id has one record.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, Optional, Set, TextIO, Tuple
+
+from common.config import get_settings
+from common.models import ChatRequest
+
+ENGINES = {
+    "a": "src.a_ignore_eos.app.engine",
+    "b": "src.b_logit_bias.app.engine",
+    "c": "src.c_logits_processor.app.engine",
+    "ignore_eos": "src.a_ignore_eos.app.engine",
+    "logit_bias": "src.b_logit_bias.app.engine",
+    "logits_processor": "src.c_logits_processor.app.engine",
+    "d": "src.d_unified.app.engine",
+    "unified": "src.d_unified.app.engine",
+}
+
+_engine: Any = None
+
+
+def _init_worker(module: str) -> None:
+    global _engine
+    _engine = importlib.import_module(module)
+
+
+def _run_one(line_no: int, raw: str) -> Dict[str, Any]:
+    rid: Any = line_no
+    try:
+        data = json.loads(raw)
+        rid = data.pop("id", line_no)
+        req = ChatRequest.model_validate(data)
+        settings = get_settings()
+        # Same message policy as POST /chat: the configured system prompt only
+        messages = [{"role": "system", "content": settings.system_prompt}]
+        messages += [m.model_dump() for m in req.messages if m.role != "system"]
+        result = _engine.generate(
+            messages,
+            min_len=req.min_len if req.min_len is not None else settings.min_len,
+            max_len=req.max_len if req.max_len is not None else settings.max_len,
+            model_override=req.model,
+            seed=req.seed,
+            session_id=req.session_id,
+            # Only the unified engine takes a per-request strategy
+            **({"strategy": req.strategy} if req.strategy is not None else {}),
+        )
+        return {"id": rid, "line": line_no, "text": result["text"], "meta": result["meta"]}
+    except Exception as exc:
+        return {"id": rid, "line": line_no, "error": f"{type(exc).__name__}: {exc}"}
+
+
+def _record_id(line_no: int, raw: str) -> Any:
+    try:
+        return json.loads(raw).get("id", line_no)
+    except Exception:
+        return line_no
+
+
+def _iter_input(path: str) -> Iterator[Tuple[int, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, raw in enumerate(f, start=1):
+            if raw.strip():
+                yield line_no, raw
+
+
+def _count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def load_checkpoint(path: str, retry_errors: bool = False) -> Set[str]:
+    """
+    Ids already in ``path``; a torn last line from a crash is cut off.
+
+    With ``retry_errors`` the error records are left out of the returned ids
+    and removed from ``path`` (rewritten to a temp file, then swapped in), so
+    each id keeps a single record once its rerun is appended.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                f.seek(0)
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+    kept = []
+    dropped = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            try:
+                rec = json.loads(raw)
+            except ValueError:
+                kept.append(raw)
+                continue
+            if retry_errors and "error" in rec:
+                dropped += 1
+                continue
+            kept.append(raw)
+            done.add(json.dumps(rec.get("id")))
+    if dropped:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    return done
+
+
+class _Progress:
+    def __init__(self, total: Optional[int], skipped: int, out: TextIO, every_s: float) -> None:
+        self.total = total
+        self.skipped = skipped
+        self.out = out
+        self.every_s = every_s
+        self.started = time.perf_counter()
+        self._next = self.started + every_s
+        self.done = 0
+        self.errors = 0
+        self.tokens = 0
+
+    def add(self, rec: Dict[str, Any]) -> None:
+        self.done += 1
+        if "error" in rec:
+            self.errors += 1
+        else:
+            self.tokens += int((rec["meta"].get("token_budget") or {}).get("completion_tokens") or 0)
+        if time.perf_counter() >= self._next:
+            self.report()
+
+    def report(self, final: bool = False) -> None:
+        now = time.perf_counter()
+        self._next = now + self.every_s
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.done / elapsed
+        line = f"{self.done} done, {self.skipped} skipped, {self.errors} errors, {rate:.2f} req/s, {self.tokens / elapsed:.1f} tok/s"
+        if self.total is not None and not final:
+            remaining = self.total - self.skipped - self.done
+            line += f", {remaining} left"
+            if rate > 0:
+                line += f", eta {remaining / rate:.0f}s"
+        print(("done: " if final else "") + line, file=self.out, flush=True)
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    pattern: str = "c",
+    workers: int = 1,
+    window: Optional[int] = None,
+    retry_errors: bool = False,
+    progress_every_s: float = 10.0,
+    count_input: bool = True,
+    progress_out: TextIO = sys.stderr,
+) -> Dict[str, int]:
+    """
+    Stream ``input_path`` through an engine into ``output_path``.
+
+    ``workers`` processes run at most ``window`` records at a time (default
+    2x workers), so memory stays flat however large the input is;
+    ``workers=0`` runs inline in this process.
+    """
+    module = ENGINES.get(pattern, pattern)
+    done_ids = load_checkpoint(output_path, retry_errors)
+    total = _count_lines(input_path) if count_input else None
+    progress = _Progress(total, 0, progress_out, progress_every_s)
+
+    def pending() -> Iterator[Tuple[int, str]]:
+        for line_no, raw in _iter_input(input_path):
+            if done_ids and json.dumps(_record_id(line_no, raw)) in done_ids:
+                progress.skipped += 1
+                continue
+            yield line_no, raw
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def write(rec: Dict[str, Any]) -> None:
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            progress.add(rec)
+
+        if workers <= 0:
+            _init_worker(module)
+            for line_no, raw in pending():
+                write(_run_one(line_no, raw))
+        else:
+            limit = window or workers * 2
+            ctx = multiprocessing.get_context("spawn")  # never fork a process holding llama threads
+            with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker, initargs=(module,)) as pool:
+                inflight: Set[Future] = set()
+                for line_no, raw in pending():
+                    if len(inflight) >= limit:
+                        finished, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                        for fut in finished:
+                            write(fut.result())
+                    inflight.add(pool.submit(_run_one, line_no, raw))
+                for fut in wait(inflight).done:
+                    write(fut.result())
+    progress.report(final=True)
+    return {"done": progress.done, "skipped": progress.skipped, "errors": progress.errors}
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL of ChatRequest records")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results, appended to and used to resume")
+    parser.add_argument("--pattern", default="c", help="a|b|c|d, a pattern name, or an engine module path")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, each with its own Llama (0 = inline)")
+    parser.add_argument("--window", type=int, default=None, help="max records in flight (default 2x workers)")
+    parser.add_argument("--retry-errors", action="store_true", help="rerun records whose previous result was an error")
+    parser.add_argument("--progress", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--no-count", action="store_true", help="skip counting input lines (no ETA)")
+    args = parser.parse_args(argv)
+
+    stats = run_batch(
+        args.input,
+        args.output,
+        pattern=args.pattern,
+        workers=args.workers,
+        window=args.window,
+        retry_errors=args.retry_errors,
+        progress_every_s=args.progress,
+        count_input=not args.no_count,
+    )
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
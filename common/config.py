@@ -1,9 +1,15 @@
 from __future__ import annotations
 
 import os
+import signal
+import socket
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
 
+from common.utils.logging import get_logger
+
 try:
     from dotenv import load_dotenv  # type: ignore
     load_dotenv()
@@ -11,23 +17,55 @@ except Exception:
     # dotenv is optional; ignore if unavailable
     pass
 
+logger = get_logger(__name__)
+
+
+# Host profile written by ``python -m common.autotune``; only these keys are
+# read from it, and an env var of the same name always wins
+TUNED_KEYS = (
+    "N_THREADS",
+    "N_THREADS_BATCH",
+    "N_BATCH",
+    "N_UBATCH",
+    "USE_MMAP",
+    "USE_MLOCK",
+    "FLASH_ATTN",
+    "TYPE_K",
+    "TYPE_V",
+)
+_profile: dict[str, str] = {}
+
+
+def _getenv(key: str, default: str | None = None) -> str | None:
+    val = os.getenv(key)
+    if val is None:
+        val = _profile.get(key, default)
+    return val
+
 
 def _getenv_int(key: str, default: int) -> int:
     try:
-        return int(os.getenv(key, str(default)))
+        return int(_getenv(key, str(default)))  # type: ignore[arg-type]
     except Exception:
         return default
 
 
 def _getenv_float(key: str, default: float) -> float:
     try:
-        return float(os.getenv(key, str(default)))
+        return float(_getenv(key, str(default)))  # type: ignore[arg-type]
     except Exception:
         return default
 
 
+def _getenv_bool(key: str, default: bool) -> bool:
+    val = _getenv(key)
+    if val is None or val == "":
+        return default
+    return val.lower() in ("1", "true", "yes", "on")
+
+
 def _getenv_optional_int(key: str) -> int | None:
-    val = os.getenv(key)
+    val = _getenv(key)
     if val is None or val == "":
         return None
     try:
@@ -37,7 +75,7 @@ def _getenv_optional_int(key: str) -> int | None:
 
 
 def _getenv_optional_float(key: str) -> float | None:
-    val = os.getenv(key)
+    val = _getenv(key)
     if val is None or val == "":
         return None
     try:
@@ -46,6 +84,90 @@ def _getenv_optional_float(key: str) -> float | None:
         return None
 
 
+def _getenv_models(key: str) -> tuple[tuple[str, str], ...]:
+    # "name=path,name2=path2"; a bare path is named after its file
+    models: list[tuple[str, str]] = []
+    for item in (os.getenv(key) or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, path = item.partition("=")
+        if not sep:
+            name, path = Path(item).stem, item
+        models.append((name.strip(), path.strip()))
+    return tuple(models)
+
+
+def _parse_pairs(spec: str) -> tuple[tuple[str, str], ...]:
+    # "name=value,name2=value2"
+    pairs: list[tuple[str, str]] = []
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip():
+            pairs.append((name.strip(), value.strip()))
+    return tuple(pairs)
+
+
+def _getenv_classes(key: str, default: str) -> tuple[tuple[str, float], ...]:
+    # "name=deadline_s,...", most urgent first
+    def parse(spec: str) -> tuple[tuple[str, float], ...]:
+        classes: list[tuple[str, float]] = []
+        for name, value in _parse_pairs(spec):
+            try:
+                classes.append((name.lower(), float(value)))
+            except ValueError:
+                continue
+        return tuple(classes)
+
+    return parse(os.getenv(key) or "") or parse(default)
+
+
+def _admission_routing(
+    classes: tuple[tuple[str, float], ...], default: str, api_keys: tuple[tuple[str, str], ...]
+) -> tuple[str, tuple[tuple[str, str], ...]]:
+    # A class name that is not in ADMISSION_CLASSES would otherwise be
+    # treated as unknown at admission time; drop it here, loudly, so that
+    # traffic falls back to the least urgent class
+    names = {name for name, _ in classes}
+    if default and default not in names:
+        logger.warning("ADMISSION_DEFAULT_CLASS=%s is not in ADMISSION_CLASSES; using the least urgent class", default)
+        default = ""
+    keys: list[tuple[str, str]] = []
+    for key, name in api_keys:
+        if name in names:
+            keys.append((key, name))
+        else:
+            logger.warning("ADMISSION_API_KEYS maps a key to unknown class %s; ignoring that key", name)
+    return default, tuple(keys)
+
+
+def profile_path() -> str:
+    # TUNED_PROFILE= (empty) disables the profile
+    path = os.getenv("TUNED_PROFILE")
+    if path is None:
+        path = str(Path(".cache/tuned") / f"{socket.gethostname()}.env")
+    return path
+
+
+def read_profile(path: str) -> dict[str, str]:
+    """``KEY=VALUE`` lines of a tuned profile (TUNED_KEYS only); {} if missing."""
+    values: dict[str, str] = {}
+    if not path:
+        return values
+    try:
+        lines = Path(path).expanduser().read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return values
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, sep, value = line.partition("=")
+        if sep and key.strip() in TUNED_KEYS:
+            values[key.strip()] = value.strip()
+    return values
+
+
 def _resolve_system_prompt() -> str:
     path = os.getenv("SYSTEM_PROMPT_FILE")
     p = Path(path).expanduser()
@@ -53,11 +175,32 @@ def _resolve_system_prompt() -> str:
     return text.rstrip("\n")
 
 
+def _system_prompt_mtime() -> float | None:
+    path = os.getenv("SYSTEM_PROMPT_FILE")
+    if not path:
+        return None
+    try:
+        return Path(path).expanduser().stat().st_mtime
+    except OSError:
+        return None
+
+
 @dataclass(frozen=True)
 class Settings:
     model_path: str
     n_threads: int
     ctx_size: int
+    n_threads_batch: int | None
+    n_batch: int
+    n_ubatch: int
+    use_mmap: bool
+    use_mlock: bool
+    flash_attn: bool
+    type_k: str | None
+    type_v: str | None
+    tuned_profile: str
+    memory_budget_mb: int
+    memory_min_ctx: int
     min_len: int
     max_len: int
     host: str
@@ -68,19 +211,87 @@ class Settings:
     top_k: int | None
     min_p: float | None
     repeat_penalty: float | None
+    prefix_cache: bool
+    pool_size: int
+    pool_max_queue: int
+    pool_timeout: float
+    pool_busy_status: int
+    scheduler: str
+    batch_slots: int
+    batch_tokens: int
+    eos_bias: float
+    second_pass: bool
+    second_pass_tokens: int | None
+    settings_watch_interval: float
+    vocab_cache_dir: str
+    token_budget: bool
+    early_stop: str
+    banned_phrases: tuple[str, ...]
+    metrics: bool
+    decode_workers: int
+    models: tuple[tuple[str, str], ...]
+    max_models: int
+    model_memory_budget_mb: int
+    warmup: bool
+    warmup_tokens: int
+    response_cache: bool
+    response_cache_size: int
+    response_cache_ttl: float
+    response_cache_dir: str
+    response_cache_wait: float
+    admission: bool
+    admission_concurrency: int
+    admission_max_queue: int
+    admission_classes: tuple[tuple[str, float], ...]
+    admission_default_class: str
+    admission_api_keys: tuple[tuple[str, str], ...]
+    speculative: str
+    speculative_tokens: int
+    speculative_ngram: int
+    draft_model_path: str
+    default_strategy: str
+    session_memory_mb: int
+    session_max: int
+    session_max_turns: int
+    session_dir: str
+    session_ttl: float
 
 
-def get_settings() -> Settings:
+def _load_settings() -> Settings:
+    global _profile
+    tuned_path = profile_path()
+    _profile = read_profile(tuned_path)
     ctx_env = os.getenv("CTX_SIZE") or "4096"
     try:
         ctx_val = int(ctx_env)
     except Exception:
         ctx_val = 4096
+    admission_classes = _getenv_classes("ADMISSION_CLASSES", "interactive=10,batch=120")
+    admission_default_class, admission_api_keys = _admission_routing(
+        admission_classes,
+        (os.getenv("ADMISSION_DEFAULT_CLASS") or "").lower(),
+        tuple((k, c.lower()) for k, c in _parse_pairs(os.getenv("ADMISSION_API_KEYS") or "")),
+    )
 
     return Settings(
         model_path=os.getenv("MODEL_PATH", "model.gguf"),
         n_threads=_getenv_int("N_THREADS", 4),
         ctx_size=ctx_val,
+        # llama.cpp defaults; None = same as N_THREADS
+        n_threads_batch=_getenv_optional_int("N_THREADS_BATCH"),
+        n_batch=_getenv_int("N_BATCH", 512),
+        n_ubatch=_getenv_int("N_UBATCH", 512),
+        use_mmap=_getenv_bool("USE_MMAP", True),
+        use_mlock=_getenv_bool("USE_MLOCK", False),
+        flash_attn=_getenv_bool("FLASH_ATTN", False),
+        # KV cache element type: f16 | q8_0 | q4_0 (None = llama.cpp default, f16)
+        type_k=(_getenv("TYPE_K") or "").lower() or None,
+        type_v=(_getenv("TYPE_V") or "").lower() or None,
+        # Path of the tuned profile that was applied, "" when none
+        tuned_profile=tuned_path if _profile else "",
+        # > 0: KV cache type and CTX_SIZE (as a ceiling) are chosen to fit this
+        memory_budget_mb=_getenv_int("MEMORY_BUDGET_MB", 0),
+        memory_min_ctx=_getenv_int("MEMORY_MIN_CTX", 2048),
         min_len=_getenv_int("MIN_LEN", 120),
         max_len=_getenv_int("MAX_LEN", 240),
         host=os.getenv("HOST", "127.0.0.1"),
@@ -91,4 +302,100 @@ def get_settings() -> Settings:
         top_k=_getenv_optional_int("TOP_K"),
         min_p=_getenv_optional_float("MIN_P"),
         repeat_penalty=_getenv_optional_float("REPEAT_PENALTY"),
+        prefix_cache=_getenv_bool("PREFIX_CACHE", True),
+        pool_size=_getenv_int("POOL_SIZE", 1),
+        pool_max_queue=_getenv_int("POOL_MAX_QUEUE", 16),
+        pool_timeout=_getenv_float("POOL_TIMEOUT", 30.0),
+        pool_busy_status=_getenv_int("POOL_BUSY_STATUS", 429),
+        scheduler=(os.getenv("SCHEDULER") or "off").lower(),
+        batch_slots=_getenv_int("BATCH_SLOTS", 8),
+        batch_tokens=_getenv_int("BATCH_TOKENS", 512),
+        eos_bias=_getenv_float("EOS_BIAS", -10.0),
+        second_pass=_getenv_bool("SECOND_PASS", False),
+        # None lets each pattern apply its own default
+        second_pass_tokens=_getenv_optional_int("SECOND_PASS_TOKENS"),
+        settings_watch_interval=_getenv_float("SETTINGS_WATCH_INTERVAL", 0.0),
+        # Empty disables the on-disk vocab scan cache
+        vocab_cache_dir=os.getenv("VOCAB_CACHE_DIR", ".cache/vocab"),
+        token_budget=_getenv_bool("TOKEN_BUDGET", True),
+        # off | max_len | sentence
+        early_stop=(os.getenv("EARLY_STOP") or "max_len").lower(),
+        # Removed from the output before the max_len trim
+        banned_phrases=tuple(p.strip() for p in (os.getenv("BANNED_PHRASES") or "").split(",") if p.strip()),
+        metrics=_getenv_bool("METRICS", True),
+        decode_workers=_getenv_int("DECODE_WORKERS", 16),
+        # Allowlist for ChatRequest.model; MODEL_PATH is always allowed as "default"
+        models=_getenv_models("MODELS"),
+        max_models=_getenv_int("MAX_MODELS", 1),
+        model_memory_budget_mb=_getenv_int("MODEL_MEMORY_BUDGET_MB", 0),
+        warmup=_getenv_bool("WARMUP", True),
+        warmup_tokens=_getenv_int("WARMUP_TOKENS", 8),
+        response_cache=_getenv_bool("RESPONSE_CACHE", False),
+        response_cache_size=_getenv_int("RESPONSE_CACHE_SIZE", 256),
+        response_cache_ttl=_getenv_float("RESPONSE_CACHE_TTL", 600.0),
+        # Empty keeps the response cache in memory only
+        response_cache_dir=os.getenv("RESPONSE_CACHE_DIR", ""),
+        response_cache_wait=_getenv_float("RESPONSE_CACHE_WAIT", 30.0),
+        admission=_getenv_bool("ADMISSION", False),
+        # 0 = one slot per pool context (or batch slot)
+        admission_concurrency=_getenv_int("ADMISSION_CONCURRENCY", 0),
+        admission_max_queue=_getenv_int("ADMISSION_MAX_QUEUE", 64),
+        admission_classes=admission_classes,
+        admission_default_class=admission_default_class,
+        admission_api_keys=admission_api_keys,
+        # off | prompt_lookup | draft
+        speculative=(os.getenv("SPECULATIVE") or "off").lower(),
+        speculative_tokens=_getenv_int("SPECULATIVE_TOKENS", 10),
+        speculative_ngram=_getenv_int("SPECULATIVE_NGRAM", 2),
+        draft_model_path=os.getenv("DRAFT_MODEL_PATH", ""),
+        # Unified app: strategy for requests that do not name one
+        default_strategy=(os.getenv("DEFAULT_STRATEGY") or "logits_processor").lower(),
+        session_memory_mb=_getenv_int("SESSION_MEMORY_MB", 512),
+        session_max=_getenv_int("SESSION_MAX", 1024),
+        # User turns kept per conversation; older turns (and their replies) are dropped
+        session_max_turns=_getenv_int("SESSION_MAX_TURNS", 32),
+        # Empty drops evicted session states instead of spilling them to disk
+        session_dir=os.getenv("SESSION_DIR", ""),
+        session_ttl=_getenv_float("SESSION_TTL", 3600.0),
     )
+
+
+# Settings are read once and served as an immutable snapshot. The request
+# path only pays for an attribute lookup; reload_settings() (also bound to
+# SIGHUP) re-reads env vars and SYSTEM_PROMPT_FILE. With
+# SETTINGS_WATCH_INTERVAL > 0 the prompt file mtime is also polled at most
+# that often.
+_settings_lock = threading.Lock()
+_settings: Settings | None = None
+_prompt_mtime: float | None = None
+_next_check = 0.0
+
+
+def get_settings() -> Settings:
+    global _next_check
+    settings = _settings
+    if settings is None:
+        return reload_settings()
+    interval = settings.settings_watch_interval
+    if interval > 0:
+        now = time.monotonic()
+        if now >= _next_check:
+            _next_check = now + interval
+            if _system_prompt_mtime() != _prompt_mtime:
+                return reload_settings()
+    return settings
+
+
+def reload_settings() -> Settings:
+    global _settings, _prompt_mtime
+    with _settings_lock:
+        _prompt_mtime = _system_prompt_mtime()
+        _settings = _load_settings()
+        return _settings
+
+
+def install_reload_signal() -> None:
+    """Reload settings on SIGHUP (only possible from the main thread)."""
+    if not hasattr(signal, "SIGHUP") or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_settings())
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from common import metrics
+from common.config import Settings, get_settings
+from common.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """A request was shed: 429 when refused up front, 503 when its deadline passed in the queue."""
+
+    def __init__(self, message: str, status: int, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A running slot; release() hands it to the next waiter exactly once."""
+
+    def __init__(self, controller: Optional["AdmissionController"], cost: int) -> None:
+        self._controller = controller
+        self.cost = cost
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self._controller is not None:
+            self._controller._release(self.cost, time.monotonic() - self._started)
+
+    def __del__(self) -> None:
+        # release() takes the controller lock, which the collecting thread may hold
+        if not self._released and self._controller is not None:
+            logger.warning("admission ticket leaked: collected without release()")
+
+
+@dataclass(order=True)
+class _Waiter:
+    rank: int
+    cost: int
+    seq: int
+    priority: str = field(compare=False)
+    future: "asyncio.Future[Ticket]" = field(compare=False)
+    enqueued: float = field(compare=False)
+    granted: bool = field(default=False, compare=False)
+    gone: bool = field(default=False, compare=False)
+
+
+class AdmissionController:
+    """
+    Bounded priority queue in front of the engines.
+
+    At most ``capacity`` requests run at once. The rest wait, ordered by
+    priority class (first listed = most urgent) and then by cost, so short
+    jobs (low ``max_len``) go first within a class. A request is refused
+    with 429 when the queue is full or its expected wait already exceeds its
+    class deadline, and shed with 503 if it is still queued at the deadline.
+    The expected wait comes from the queued cost ahead of it and an average
+    of observed seconds per cost unit.
+
+    Waiters park on asyncio futures; grants are delivered with
+    ``call_soon_threadsafe`` so release() may run on any thread.
+    """
+
+    def __init__(self, capacity: int, max_queue: int, classes: Sequence[Tuple[str, float]]) -> None:
+        if not classes:
+            raise ValueError("at least one priority class is required")
+        self.capacity = max(1, int(capacity))
+        self.max_queue = max(0, int(max_queue))
+        self.classes = [name for name, _ in classes]
+        self._rank = {name: i for i, name in enumerate(self.classes)}
+        self._deadline = dict(classes)
+        self._lock = threading.Lock()
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._queued: Dict[str, int] = {name: 0 for name in self.classes}
+        self._s_per_cost = 0.0
+        self.admitted: Dict[str, int] = {name: 0 for name in self.classes}
+        self.shed: Dict[Tuple[str, str], int] = {}
+
+    async def admit(self, priority: str, cost: int) -> Ticket:
+        if priority not in self._rank:
+            # Never promote what we cannot classify
+            priority = self.classes[-1]
+        cost = max(1, int(cost))
+        deadline = self._deadline[priority]
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._running < self.capacity and not self._queued_total():
+                self._running += 1
+                self._admitted(priority, 0.0)
+                return Ticket(self, cost)
+            if self._queued_total() >= self.max_queue:
+                self._shed(priority, "queue_full")
+                raise AdmissionRejected("admission queue is full", 429, self._retry_after(self._backlog()))
+            waiter = _Waiter(self._rank[priority], cost, next(self._seq), priority, loop.create_future(), time.monotonic())
+            expected = self._expected_wait(waiter)
+            if expected > deadline:
+                self._shed(priority, "expected_wait")
+                raise AdmissionRejected(
+                    f"expected queue wait {expected:.1f}s exceeds the {priority} deadline", 429, self._retry_after(expected)
+                )
+            heapq.heappush(self._heap, waiter)
+            self._queued[priority] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout=deadline)
+        except asyncio.TimeoutError:
+            if self._leave(waiter):
+                with self._lock:
+                    self._shed(priority, "deadline")
+                raise AdmissionRejected(f"{priority} request waited past its {deadline:g}s deadline", 503, 1)
+            # Granted just as the deadline hit; the grant is on its way
+            return await waiter.future
+        except BaseException:
+            # Cancelled (client went away); give back a slot granted meanwhile
+            if not self._leave(waiter) and not waiter.future.cancel():
+                waiter.future.result().release()
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "running": self._running,
+                "queued": dict(self._queued),
+                "admitted": dict(self.admitted),
+                "shed": dict(self.shed),
+                "seconds_per_cost": self._s_per_cost,
+            }
+
+    def _leave(self, waiter: _Waiter) -> bool:
+        # True if the waiter left the queue; False if it was granted first
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.gone = True
+            self._queued[waiter.priority] -= 1
+            return True
+
+    def _release(self, cost: int, held_s: float) -> None:
+        with self._lock:
+            if cost > 0:
+                sample = held_s / cost
+                self._s_per_cost = sample if self._s_per_cost == 0 else 0.8 * self._s_per_cost + 0.2 * sample
+            self._running -= 1
+            while self._heap and self._running < self.capacity:
+                waiter = heapq.heappop(self._heap)
+                if waiter.gone:
+                    continue
+                waiter.granted = True
+                self._queued[waiter.priority] -= 1
+                self._running += 1
+                self._admitted(waiter.priority, time.monotonic() - waiter.enqueued)
+                ticket = Ticket(self, waiter.cost)
+                try:
+                    waiter.future.get_loop().call_soon_threadsafe(_grant, waiter.future, ticket)
+                except RuntimeError:  # loop closed
+                    waiter.gone = True
+                    ticket._released = True
+                    self._running -= 1
+
+    def _queued_total(self) -> int:
+        return sum(self._queued.values())
+
+    def _backlog(self) -> float:
+        return sum(w.cost for w in self._heap if not w.gone) * self._s_per_cost / self.capacity
+
+    def _expected_wait(self, waiter: _Waiter) -> float:
+        # Caller holds the lock. Cost queued ahead of this waiter, spread over
+        # the slots; unknown (no completed requests yet) counts as no wait.
+        ahead = sum(w.cost for w in self._heap if not w.gone and w < waiter)
+        return ahead * self._s_per_cost / self.capacity
+
+    def _retry_after(self, wait_s: float) -> int:
+        return max(1, math.ceil(wait_s))
+
+    def _admitted(self, priority: str, wait_s: float) -> None:
+        # Caller holds the lock
+        self.admitted[priority] += 1
+        metrics.ADMISSION_WAIT.observe(wait_s, priority=priority)
+
+    def _shed(self, priority: str, reason: str) -> None:
+        # Caller holds the lock
+        self.shed[(priority, reason)] = self.shed.get((priority, reason), 0) + 1
+        metrics.ADMISSION_SHED.inc(priority=priority, reason=reason)
+        logger.info("admission: shed %s request (%s)", priority, reason)
+
+
+def _grant(future: "asyncio.Future[Ticket]", ticket: Ticket) -> None:
+    if future.cancelled():
+        ticket.release()
+    else:
+        future.set_result(ticket)
+
+
+def request_priority(headers: Mapping[str, str], settings: Settings) -> str:
+    """Priority class for a request: API key mapping first, then X-Priority, else the least urgent class."""
+    keys = dict(settings.admission_api_keys)
+    auth = headers.get("authorization") or ""
+    api_key = headers.get("x-api-key") or (auth[7:].strip() if auth.lower().startswith("bearer ") else "")
+    if api_key and api_key in keys:
+        return keys[api_key]
+    priority = (headers.get("x-priority") or "").strip().lower()
+    classes = [name for name, _ in settings.admission_classes]
+    if priority in classes:
+        return priority
+    return settings.admission_default_class or classes[-1]
+
+
+_controller: Optional[AdmissionController] = None
+_controller_config: Optional[Tuple[Any, ...]] = None
+_controller_lock = threading.Lock()
+
+
+def admission_controller() -> Optional[AdmissionController]:
+    """The process-wide controller, or None when ADMISSION is off."""
+    global _controller, _controller_config
+    settings = get_settings()
+    if not settings.admission:
+        return None
+    capacity = settings.admission_concurrency
+    if capacity <= 0:
+        capacity = settings.batch_slots if settings.scheduler == "batch" else settings.pool_size
+    config = (capacity, settings.admission_max_queue, settings.admission_classes)
+    if _controller is None or _controller_config != config:
+        with _controller_lock:
+            if _controller is None or _controller_config != config:
+                # Tickets keep a reference to the controller that issued them
+                _controller = AdmissionController(capacity, settings.admission_max_queue, settings.admission_classes)
+                _controller_config = config
+    return _controller
+
+
+async def admit(headers: Mapping[str, str], cost: int) -> Ticket:
+    """Wait for a running slot; a no-op ticket when admission control is off."""
+    controller = admission_controller()
+    if controller is None:
+        return Ticket(None, cost)
+    return await controller.admit(request_priority(headers, get_settings()), cost)
+
+
+async def release_after(ticket: Ticket, events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    # A streamed response holds its slot until the last event
+    try:
+        async for ev in events:
+            yield ev
+    finally:
+        ticket.release()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+from common.config import get_settings
+from common.utils.logging import get_logger
+from .streaming import close_stream
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# llama.cpp decoding blocks for the whole generation, so it runs on its own
+# executor instead of Starlette's shared threadpool (which also serves sync
+# endpoints such as /health). Request setup, which may block in the pool
+# queue, gets a second executor: a waiter parked on a decode thread could
+# otherwise starve the lease holder it is waiting for.
+_executor: Optional[ThreadPoolExecutor] = None
+_acquire_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def decode_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_settings().decode_workers, thread_name_prefix="llama-decode"
+                )
+    return _executor
+
+
+def acquire_executor() -> ThreadPoolExecutor:
+    global _acquire_executor
+    if _acquire_executor is None:
+        with _executor_lock:
+            if _acquire_executor is None:
+                settings = get_settings()
+                # Every context holder plus a full wait queue, for each resident model
+                slots = max(settings.pool_size, settings.batch_slots)
+                _acquire_executor = ThreadPoolExecutor(
+                    max_workers=(slots + settings.pool_max_queue) * max(1, settings.max_models),
+                    thread_name_prefix="llama-acquire",
+                )
+    return _acquire_executor
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(decode_executor(), lambda: fn(*args))
+
+
+async def run_acquire(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Run ``fn`` (which may wait for a pool context) off both the loop and the
+    decode threads. If the caller is cancelled meanwhile (client gone while
+    queued), whatever ``fn`` returns is closed once it does, which releases
+    the lease and abandons an in-flight response cache entry.
+    """
+    future = acquire_executor().submit(fn, *args)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_close_result)
+        raise
+
+
+def _close_result(future: "Future[Any]") -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if close is not None:
+        close()
+
+
+class AsyncEvents:
+    """
+    Async iterator over a blocking engine event iterator (see ``_drive``).
+    ``aclose()`` ends it however far it got: a started stream stops at the
+    next token, and one that never started is closed right away, which
+    releases its context.
+    """
+
+    def __init__(self, events: Iterator[Dict[str, Any]]) -> None:
+        self._events = events
+        self._agen: Optional[AsyncGenerator[Dict[str, Any], None]] = None
+        self._closed = False
+
+    def __aiter__(self) -> "AsyncEvents":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._agen is None:
+            if self._closed:
+                raise StopAsyncIteration
+            self._agen = _drive(self._events)
+        return await self._agen.__anext__()
+
+    async def aclose(self) -> None:
+        self._closed = True
+        if self._agen is not None:
+            await self._agen.aclose()
+        else:
+            close_stream(self._events)
+
+
+def aiter_events(events: Iterator[Dict[str, Any]]) -> AsyncEvents:
+    return AsyncEvents(events)
+
+
+async def _drive(events: Iterator[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Drive a blocking engine event iterator on the decode executor and hand
+    events to the event loop through an asyncio queue. If the consumer goes
+    away (client disconnect cancels it) the worker stops at the next token
+    and closes ``events``, which ends the decode and releases the context.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item: tuple) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # loop closed
+            cancelled.set()
+
+    def worker() -> None:
+        try:
+            for ev in events:
+                if cancelled.is_set():
+                    break
+                put(("event", ev))
+            else:
+                put(("end", None))
+        except BaseException as exc:
+            put(("error", exc))
+        finally:
+            close_stream(events)
+
+    loop.run_in_executor(decode_executor(), worker)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "event":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        cancelled.set()
+
+
+async def acollect_result(events: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    try:
+        async for ev in events:
+            if ev.get("event") == "done":
+                result = {"text": ev["text"], "meta": ev["meta"]}
+    finally:
+        # Cancelled midway (client gone): stop the decode now
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return result
+
+
+async def cancel_on_disconnect(
+    awaitable: Awaitable[T], is_disconnected: Callable[[], Awaitable[bool]], poll_s: float = 0.25
+) -> T:
+    # Non-streaming responses never write before the end, so poll for the
+    # client going away and cancel the generation if it does.
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_s)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                logger.info("client disconnected; cancelling generation")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,501 @@
+from __future__ import annotations
+
+import codecs
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Protocol, Sequence
+
+import numpy as np
+
+from common.config import Settings
+from common.utils.logging import get_logger
+from .memory import llama_overrides
+from .runtime import context_params
+
+logger = get_logger(__name__)
+
+LogitsProcessorFn = Callable[[Any, Any], Any]
+
+
+@dataclass
+class SamplingParams:
+    # Defaults follow llama-cpp-python's create_completion
+    temperature: float = 0.8
+    top_p: float = 0.95
+    top_k: int = 40
+    min_p: float = 0.05
+    repeat_penalty: float = 1.0
+    repeat_last_n: int = 64
+    seed: Optional[int] = None
+
+
+def sample_token(logits: np.ndarray, params: SamplingParams, history: np.ndarray, rng: np.random.Generator) -> int:
+    if params.repeat_penalty != 1.0 and params.repeat_last_n > 0 and len(history):
+        ids = np.unique(history[-params.repeat_last_n:])
+        vals = logits[ids]
+        logits[ids] = np.where(vals > 0, vals / params.repeat_penalty, vals * params.repeat_penalty)
+    if params.temperature <= 0:
+        return int(np.argmax(logits))
+    n = logits.shape[0]
+    k = params.top_k if 0 < params.top_k < n else n
+    idx = np.argpartition(-logits, k - 1)[:k] if k < n else np.arange(n)
+    cand = logits[idx].astype(np.float64) / params.temperature
+    order = np.argsort(-cand)
+    idx, cand = idx[order], cand[order]
+    if not np.isfinite(cand[0]):
+        return int(idx[0])
+    probs = np.exp(cand - cand[0])
+    probs /= probs.sum()
+    keep = len(probs)
+    if params.min_p > 0:
+        keep = min(keep, int(np.count_nonzero(probs >= params.min_p * probs[0])))
+    if params.top_p < 1.0:
+        keep = min(keep, int(np.searchsorted(np.cumsum(probs), params.top_p)) + 1)
+    probs = probs[: max(1, keep)]
+    return int(idx[rng.choice(len(probs), p=probs / probs.sum())])
+
+
+class BatchBackend(Protocol):
+    """Minimal multi-sequence decode interface the scheduler runs on."""
+
+    n_vocab: int
+    n_batch: int
+    n_ctx_per_seq: int
+
+    def decode(
+        self,
+        tokens: Sequence[int],
+        positions: Sequence[int],
+        seq_ids: Sequence[int],
+        want_logits: Sequence[bool],
+    ) -> List[np.ndarray]: ...
+
+    def clear_sequence(self, seq_id: int) -> None: ...
+
+    def token_bytes(self, token: int) -> bytes: ...
+
+    def token_eos(self) -> int: ...
+
+
+class LlamaCppBatchBackend:
+    """
+    llama.cpp context with ``n_seq`` KV sequences, driven through the
+    low-level ``llama_decode`` API. The ``Llama`` object is only used for
+    its model weights and tokenizer; its own context is kept tiny.
+    """
+
+    def __init__(
+        self,
+        llama: Any,
+        n_seq: int,
+        n_ctx_per_seq: int,
+        n_batch: int,
+        n_threads: int,
+        n_ubatch: int = 512,
+        context: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        import llama_cpp  # type: ignore
+
+        self._lib = llama_cpp
+        self._llama = llama
+        self.n_vocab = int(llama.n_vocab())
+        self.n_batch = int(n_batch)
+        self.n_ctx_per_seq = int(n_ctx_per_seq)
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_ctx_per_seq * n_seq
+        params.n_batch = self.n_batch
+        params.n_ubatch = min(self.n_batch, n_ubatch)
+        params.n_seq_max = n_seq
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads
+        # Tuned knobs (runtime.context_params); fields differ across llama.cpp versions
+        for key, value in (context or {}).items():
+            if hasattr(params, key):
+                setattr(params, key, value)
+        new_ctx = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self._ctx = new_ctx(llama.model, params)
+        if not self._ctx:
+            raise RuntimeError("failed to create batched llama context")
+        self._batch = llama_cpp.llama_batch_init(self.n_batch, 0, n_seq)
+
+    def decode(self, tokens, positions, seq_ids, want_logits) -> List[np.ndarray]:
+        b = self._batch
+        n = len(tokens)
+        for i in range(n):
+            b.token[i] = tokens[i]
+            b.pos[i] = positions[i]
+            b.n_seq_id[i] = 1
+            b.seq_id[i][0] = seq_ids[i]
+            b.logits[i] = bool(want_logits[i])
+        b.n_tokens = n
+        rc = self._lib.llama_decode(self._ctx, b)
+        if rc != 0:
+            raise RuntimeError(f"llama_decode failed ({rc}); KV cache may be full")
+        rows: List[np.ndarray] = []
+        for i in range(n):
+            if want_logits[i]:
+                ptr = self._lib.llama_get_logits_ith(self._ctx, i)
+                rows.append(np.ctypeslib.as_array(ptr, shape=(self.n_vocab,)).copy())
+        return rows
+
+    def clear_sequence(self, seq_id: int) -> None:
+        lib = self._lib
+        # Renamed across llama.cpp versions
+        for name in ("llama_kv_cache_seq_rm", "llama_kv_self_seq_rm"):
+            fn = getattr(lib, name, None)
+            if fn is not None:
+                fn(self._ctx, seq_id, -1, -1)
+                return
+        lib.llama_memory_seq_rm(lib.llama_get_memory(self._ctx), seq_id, -1, -1)
+
+    def token_bytes(self, token: int) -> bytes:
+        return self._llama.detokenize([token])
+
+    def token_eos(self) -> int:
+        return int(self._llama.token_eos())
+
+
+@dataclass
+class _Sequence:
+    prompt: List[int]
+    max_tokens: int
+    params: SamplingParams
+    processors: List[LogitsProcessorFn]
+    events: "queue.Queue[tuple]" = field(default_factory=queue.Queue)
+    slot: int = -1
+    n_past: int = 0
+    generated: int = 0
+    next_token: Optional[int] = None
+    cancelled: bool = False
+    tokens: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.intc))
+    n_tokens: int = 0
+    rng: Any = None
+    decoder: Any = None
+
+
+class BatchScheduler:
+    """
+    Continuous batching over one multi-sequence llama.cpp context.
+
+    A single worker thread repeatedly builds a batch with one decode token
+    for every running sequence plus prompt chunks for newly admitted ones,
+    runs ``llama_decode`` once, and samples each sequence with its own
+    logits processors. Finished or cancelled sequences free their KV slot
+    immediately so queued requests join the next step.
+    """
+
+    def __init__(self, backend: BatchBackend, n_slots: int, model_path: Optional[str] = None) -> None:
+        self.backend = backend
+        self.n_slots = max(1, int(n_slots))
+        self.model_path = model_path
+        self._eos = backend.token_eos()
+        self._cond = threading.Condition()
+        self._pending: List[_Sequence] = []
+        self._active: Dict[int, _Sequence] = {}
+        self._free = list(range(self.n_slots - 1, -1, -1))
+        self.steps = 0
+        self.tokens_decoded = 0
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        prompt_tokens: Sequence[int],
+        max_tokens: int,
+        params: SamplingParams,
+        processors: Optional[List[LogitsProcessorFn]] = None,
+    ) -> "SequenceStream":
+        limit = self.backend.n_ctx_per_seq
+        if len(prompt_tokens) >= limit:
+            raise ValueError(f"prompt of {len(prompt_tokens)} tokens exceeds the per-sequence context ({limit})")
+        seq = _Sequence(
+            prompt=list(prompt_tokens),
+            max_tokens=max(1, min(int(max_tokens), limit - len(prompt_tokens))),
+            params=params,
+            processors=list(processors or []),
+        )
+        seq.tokens = np.empty(len(seq.prompt) + seq.max_tokens, dtype=np.intc)
+        seq.tokens[: len(seq.prompt)] = seq.prompt
+        seq.n_tokens = len(seq.prompt)
+        seq.rng = np.random.default_rng(params.seed)
+        seq.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        with self._cond:
+            self._pending.append(seq)
+            self._cond.notify()
+        return SequenceStream(self, seq)
+
+    def cancel(self, seq: _Sequence) -> None:
+        """Drop a queued sequence, or have the worker free a running one's slot and KV cells."""
+        with self._cond:
+            seq.cancelled = True
+            if seq in self._pending:
+                self._pending.remove(seq)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "slots": self.n_slots,
+                "active": len(self._active),
+                "pending": len(self._pending),
+                "steps": self.steps,
+                "tokens_decoded": self.tokens_decoded,
+            }
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._active:
+                    self._cond.wait()
+                while self._pending and self._free:
+                    seq = self._pending.pop(0)
+                    seq.slot = self._free.pop()
+                    self._active[seq.slot] = seq
+                batch = list(self._active.values())
+            try:
+                self._step(batch)
+            except Exception as exc:  # fail the whole step, keep serving
+                logger.exception("batch decode step failed")
+                for seq in batch:
+                    self._finish(seq, ("error", exc))
+
+    def _step(self, seqs: List[_Sequence]) -> None:
+        tokens: List[int] = []
+        positions: List[int] = []
+        seq_ids: List[int] = []
+        want: List[bool] = []
+        sampled: List[_Sequence] = []
+        for seq in seqs:
+            if seq.cancelled:
+                self._finish(seq, ("end", "cancelled"))
+        live = [s for s in seqs if not s.cancelled]
+        budget = self.backend.n_batch
+        # Decode tokens first so running sequences never stall behind prefill
+        for seq in live:
+            if seq.next_token is not None and budget > 0:
+                tokens.append(seq.next_token)
+                positions.append(seq.n_past)
+                seq_ids.append(seq.slot)
+                want.append(True)
+                sampled.append(seq)
+                seq.n_past += 1
+                budget -= 1
+        for seq in live:
+            if seq.next_token is None and seq.n_past < len(seq.prompt) and budget > 0:
+                chunk = seq.prompt[seq.n_past: seq.n_past + budget]
+                for j, tok in enumerate(chunk):
+                    tokens.append(tok)
+                    positions.append(seq.n_past + j)
+                    seq_ids.append(seq.slot)
+                    want.append(False)
+                seq.n_past += len(chunk)
+                budget -= len(chunk)
+                if seq.n_past == len(seq.prompt):
+                    want[-1] = True
+                    sampled.append(seq)
+        if not tokens:
+            return
+        rows = self.backend.decode(tokens, positions, seq_ids, want)
+        self.steps += 1
+        self.tokens_decoded += len(tokens)
+        for seq, logits in zip(sampled, rows):
+            self._sample(seq, logits)
+
+    def _sample(self, seq: _Sequence, logits: np.ndarray) -> None:
+        history = seq.tokens[: seq.n_tokens]
+        for proc in seq.processors:
+            logits = proc(history, logits)
+        token = sample_token(logits, seq.params, history, seq.rng)
+        if token == self._eos:
+            self._finish(seq, ("end", "stop"))
+            return
+        seq.tokens[seq.n_tokens] = token
+        seq.n_tokens += 1
+        seq.generated += 1
+        text = seq.decoder.decode(self.backend.token_bytes(token))
+        if text:
+            seq.events.put(("text", text))
+        if seq.generated >= seq.max_tokens:
+            self._finish(seq, ("end", "length"))
+            return
+        seq.next_token = token
+
+    def _finish(self, seq: _Sequence, event: tuple) -> None:
+        with self._cond:
+            if self._active.get(seq.slot) is not seq:
+                return
+            del self._active[seq.slot]
+        self.backend.clear_sequence(seq.slot)
+        seq.events.put(event)
+        with self._cond:
+            self._free.append(seq.slot)
+
+
+class SequenceStream:
+    """
+    Text pieces of one submitted sequence. ``close()`` cancels it; the
+    engines call it when they stop early, and it also runs on garbage
+    collection, so a stream that was never iterated still frees its slot.
+    """
+
+    def __init__(self, scheduler: BatchScheduler, seq: _Sequence) -> None:
+        self._scheduler = scheduler
+        self._seq = seq
+        self._done = False
+
+    def __iter__(self) -> "SequenceStream":
+        return self
+
+    def __next__(self) -> str:
+        if self._done:
+            raise StopIteration
+        kind, value = self._seq.events.get()
+        if kind == "text":
+            return value
+        self._done = True
+        if kind == "error":
+            raise value
+        raise StopIteration
+
+    def close(self) -> None:
+        if not self._done:
+            self._done = True
+            self._scheduler.cancel(self._seq)
+
+    def __del__(self) -> None:
+        # cancel() takes the scheduler lock, which the collecting thread may hold
+        if not self._done:
+            logger.warning("batch sequence stream leaked: collected without close()")
+
+
+class _CompletionChunks:
+    # create_completion(stream=True) chunks over a SequenceStream, closable like it
+    def __init__(self, pieces: SequenceStream) -> None:
+        self._pieces = pieces
+
+    def __iter__(self) -> "_CompletionChunks":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        return {"choices": [{"text": next(self._pieces), "index": 0}]}
+
+    def close(self) -> None:
+        self._pieces.close()
+
+
+class BatchedLlama:
+    """
+    Llama-shaped facade whose ``create_completion`` runs on a shared
+    BatchScheduler. The engines' generate loops use it unchanged: pool one
+    facade per scheduler slot and every request becomes one sequence.
+    """
+
+    def __init__(self, scheduler: BatchScheduler, llama: Any) -> None:
+        self._scheduler = scheduler
+        self._llama = llama
+        self.model_path = scheduler.model_path
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return self._llama.tokenize(text, add_bos=add_bos, special=special)
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return self._llama.detokenize(tokens)
+
+    def token_eos(self) -> int:
+        return self._llama.token_eos()
+
+    def n_vocab(self) -> int:
+        return self._llama.n_vocab()
+
+    def n_ctx(self) -> int:
+        # Per sequence: the scheduler's context is split across its slots
+        return self._scheduler.backend.n_ctx_per_seq
+
+    def create_completion(
+        self,
+        prompt: str,
+        max_tokens: int = 16,
+        temperature: float = 0.8,
+        top_p: float = 0.95,
+        top_k: int = 40,
+        min_p: float = 0.05,
+        repeat_penalty: float = 1.0,
+        logits_processor: Optional[List[LogitsProcessorFn]] = None,
+        logit_bias: Optional[Dict[int, float]] = None,
+        ignore_eos: bool = False,
+        seed: Optional[int] = None,
+        stream: bool = False,
+    ) -> Any:
+        processors = list(logits_processor or [])
+        eos = self._llama.token_eos()
+        if logit_bias:
+            ids = np.fromiter(logit_bias.keys(), dtype=np.intc)
+            vals = np.fromiter(logit_bias.values(), dtype=np.float32)
+
+            def _bias(_input_ids, scores):
+                scores[ids] += vals
+                return scores
+
+            processors.insert(0, _bias)
+        if ignore_eos:
+
+            def _no_eos(_input_ids, scores):
+                scores[eos] = -np.inf
+                return scores
+
+            processors.append(_no_eos)
+        params = SamplingParams(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            min_p=min_p,
+            repeat_penalty=repeat_penalty,
+            seed=seed,
+        )
+        tokens = self.tokenize(prompt.encode("utf-8"), special=True)
+        pieces = self._scheduler.submit(tokens, max_tokens, params, processors)
+        if stream:
+            return _CompletionChunks(pieces)
+        try:
+            return {"choices": [{"text": "".join(pieces), "index": 0}]}
+        finally:
+            pieces.close()
+
+
+_schedulers: Dict[str, tuple] = {}
+_schedulers_lock = threading.Lock()
+
+
+def shared_batched_llama(model_path: str, settings: Settings) -> BatchedLlama:
+    """Return a facade onto the process-wide scheduler for ``model_path``."""
+    with _schedulers_lock:
+        entry = _schedulers.get(model_path)
+        if entry is None:
+            from llama_cpp import Llama  # type: ignore
+
+            # Weights + tokenizer only; decoding happens in the batched context
+            llama = Llama(
+                model_path=model_path,
+                n_ctx=256,
+                n_threads=settings.n_threads,
+                use_mmap=settings.use_mmap,
+                use_mlock=settings.use_mlock,
+                verbose=False,
+            )
+            context = context_params(settings)
+            overrides = llama_overrides(model_path, settings)
+            n_ctx = overrides.pop("n_ctx", settings.ctx_size)
+            backend = LlamaCppBatchBackend(
+                llama,
+                n_seq=settings.batch_slots,
+                n_ctx_per_seq=n_ctx,
+                n_batch=settings.batch_tokens,
+                n_threads=settings.n_threads,
+                n_ubatch=settings.n_ubatch,
+                context={**context, **overrides},
+            )
+            entry = (BatchScheduler(backend, settings.batch_slots, model_path=model_path), llama)
+            _schedulers[model_path] = entry
+    scheduler, llama = entry
+    return BatchedLlama(scheduler, llama)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# The fixed budget every engine used before: max_tokens = max_c * 2 // 3,
+# i.e. an assumed 1.5 chars/token.
+PRIOR_CHARS_PER_TOKEN = 1.5
+MIN_TOKENS = 16
+
+
+def detect_language(text: str) -> str:
+    # Coarse script bucket: token density differs by script, not by language
+    cjk = letters = 0
+    for ch in text:
+        if ch.isalpha():
+            letters += 1
+            o = ord(ch)
+            if 0x3040 <= o <= 0x30FF or 0x3400 <= o <= 0x9FFF or 0xF900 <= o <= 0xFAFF or 0xFF66 <= o <= 0xFF9F:
+                cjk += 1
+    if letters and cjk * 5 >= letters:
+        return "ja"
+    return "en"
+
+
+def request_language(messages: List[Dict[str, str]]) -> str:
+    return detect_language(" ".join(m.get("content", "") for m in messages if m.get("role") == "user"))
+
+
+def count_completion_tokens(
+    llama: Any, text: str, usage: Dict[str, Any], n_events: int, sampled: Optional[int] = None
+) -> Tuple[int, str]:
+    """
+    Decoded tokens of one request and how they were counted, cheapest
+    reliable source first: ``usage`` (the backend's report), ``sampler``
+    (logits processor calls, one per sampled token), ``stream`` (one per
+    chunk; held-back multi-byte characters and accepted drafts merge a few)
+    and, only when nothing was streamed, ``tokenize`` (the text re-tokenized).
+    """
+    if usage.get("completion_tokens"):
+        return int(usage["completion_tokens"]), "usage"
+    if sampled:
+        return sampled, "sampler"
+    if n_events or not text:
+        return n_events, "stream"
+    try:
+        return len(llama.tokenize(text.encode("utf-8"), add_bos=False, special=True)), "tokenize"
+    except Exception:
+        return n_events, "stream"
+
+
+class CharsPerTokenEstimator:
+    """
+    Online chars/token ratio per (model, language).
+
+    Each finished request contributes generated_chars / completion_tokens
+    to an EWMA, alongside an EWMA of the absolute deviation that sets the
+    safety margin. Until ``min_samples`` observations exist the legacy
+    fixed budget is used.
+    """
+
+    def __init__(self, alpha: float = 0.2, min_samples: int = 3) -> None:
+        self.alpha = float(alpha)
+        self.min_samples = int(min_samples)
+        self._lock = threading.Lock()
+        # key -> [ratio, deviation, samples]
+        self._stats: Dict[Tuple[str, str], list] = {}
+        self.wasted_tokens = 0
+        self.exhausted = 0
+
+    def estimate(self, model: Optional[str], language: str) -> Optional[float]:
+        with self._lock:
+            s = self._stats.get((model or "", language))
+        if s is None or s[2] < self.min_samples:
+            return None
+        return s[0]
+
+    def budget(self, model: Optional[str], language: str, target_chars: int) -> Tuple[int, Optional[float]]:
+        """Return (max_tokens, chars_per_token used or None for the prior)."""
+        with self._lock:
+            s = self._stats.get((model or "", language))
+            s = list(s) if s is not None else None
+        if s is None or s[2] < self.min_samples:
+            return max(MIN_TOKENS, target_chars * 2 // 3), None
+        ratio, dev = s[0], s[1]
+        # Budget for a pessimistic ratio: two deviations down, 5%..30% margin
+        margin = min(0.3, max(0.05, 2 * dev / ratio))
+        return max(MIN_TOKENS, math.ceil(target_chars / (ratio * (1 - margin)))), ratio
+
+    def observe(
+        self,
+        model: Optional[str],
+        language: str,
+        generated_chars: int,
+        completion_tokens: int,
+        returned_chars: int,
+        max_tokens: int,
+        min_chars: int,
+    ) -> Dict[str, Any]:
+        """Record one request; return its per-request budget accounting."""
+        wasted = 0
+        exhausted = completion_tokens >= max_tokens and generated_chars < min_chars
+        if completion_tokens > 0 and generated_chars > 0:
+            ratio = generated_chars / completion_tokens
+            # Tokens whose characters were decoded and then trimmed away
+            wasted = max(0, completion_tokens - math.ceil(returned_chars / ratio))
+        with self._lock:
+            self.wasted_tokens += wasted
+            self.exhausted += int(exhausted)
+            # Tiny outputs say little about the ratio
+            if completion_tokens >= 4 and generated_chars > 0:
+                key = (model or "", language)
+                s = self._stats.get(key)
+                if s is None:
+                    self._stats[key] = [ratio, 0.0, 1]
+                else:
+                    a = self.alpha
+                    s[1] = (1 - a) * s[1] + a * abs(ratio - s[0])
+                    s[0] = (1 - a) * s[0] + a * ratio
+                    s[2] += 1
+        return {"completion_tokens": completion_tokens, "wasted_tokens": wasted, "exhausted": exhausted}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "wasted_tokens": self.wasted_tokens,
+                "exhausted": self.exhausted,
+                "estimates": [
+                    {"model": m, "language": lang, "chars_per_token": round(s[0], 4), "deviation": round(s[1], 4), "samples": s[2]}
+                    for (m, lang), s in self._stats.items()
+                ],
+            }
+
+
+# Shared across patterns: the ratio depends on the model, not the strategy
+estimator = CharsPerTokenEstimator()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from common.config import get_settings
+from common.models import ChatRequest, ChatResponse, Message
+from .admission import AdmissionRejected, Ticket, admit, release_after
+from .aio import ClientDisconnected, cancel_on_disconnect
+from .engine import Engine
+from .pool import PoolTimeout
+from .registry import ModelNotAllowed
+from .sessions import UnknownSession
+from .strategies import UnknownStrategy
+from .streaming import asse_stream
+
+
+class _StreamingResponse(StreamingResponse):
+    # Runs on_close however the response ends: sent, client gone midway, or
+    # never started (Starlette skips background tasks after a disconnect)
+    def __init__(self, content: Any, on_close: Callable[[], Awaitable[None]], **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._on_close()
+
+
+def chat_router(engine: Engine) -> APIRouter:
+    """``POST /chat`` for one pattern's engine; each app's routers/chat.py only binds its engine."""
+    router = APIRouter()
+
+    @router.post("/chat", response_model=ChatResponse)
+    async def chat(req: ChatRequest, request: Request) -> ChatResponse | Response:
+        settings = get_settings()
+        min_len = settings.min_len
+        max_len = settings.max_len
+        if min_len > max_len:
+            raise HTTPException(status_code=500, detail="Server misconfiguration: MIN_LEN > MAX_LEN")
+        # A request may ask for a shorter reply, never for one outside MIN_LEN..MAX_LEN
+        if req.max_len is not None:
+            max_len = min(max(req.max_len, min_len), max_len)
+
+        # Enforce constant system prompt
+        base_messages: list[Message] = [Message(role="system", content=settings.system_prompt)]
+        base_messages += [m for m in req.messages if m.role != "system"]
+
+        kwargs = dict(
+            messages=[m.model_dump() for m in base_messages],
+            min_len=min_len,
+            max_len=max_len,
+            model_override=req.model,
+            seed=req.seed,
+            session_id=req.session_id,
+        )
+        # Only the unified engine takes a per-request strategy
+        if engine.strategy is None:
+            kwargs["strategy"] = req.strategy
+        # The clamped max_len the generation runs with is the job size for
+        # shortest-job-first admission; it cannot undercut what is generated
+        cost = max_len
+        ticket: Ticket | None = None
+        try:
+            ticket = await cancel_on_disconnect(admit(request.headers, cost), request.is_disconnected)
+            if req.stream:
+                # Starlette cancels the body iterator on disconnect, which stops the decode
+                events = await engine.agenerate_stream(**kwargs)
+                body_ticket, ticket = ticket, None
+
+                async def finish() -> None:
+                    try:
+                        await events.aclose()
+                    finally:
+                        body_ticket.release()
+
+                body = asse_stream(release_after(body_ticket, events))
+                return _StreamingResponse(body, finish, media_type="text/event-stream")
+            result = await cancel_on_disconnect(engine.agenerate(**kwargs), request.is_disconnected)
+        except ClientDisconnected:
+            # Nobody is listening; 499 only shows up in access logs
+            return Response(status_code=499)
+        except AdmissionRejected as exc:
+            raise HTTPException(status_code=exc.status, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+        except (ModelNotAllowed, UnknownStrategy) as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        except UnknownSession as exc:
+            raise HTTPException(status_code=404, detail=str(exc))
+        except PoolTimeout as exc:
+            raise HTTPException(
+                status_code=settings.pool_busy_status,
+                detail=str(exc),
+                headers={"Retry-After": str(exc.retry_after)},
+            )
+        finally:
+            if ticket is not None:
+                ticket.release()
+        return ChatResponse(**result)
+
+    return router
@@ -0,0 +1,464 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from common import metrics
+from common.config import Settings, get_settings
+from common.utils.logging import get_logger
+from common.utils.text_sanitize import StreamingSanitizer
+from common.inference.aio import AsyncEvents, acollect_result, aiter_events, run_acquire
+from common.inference.batching import shared_batched_llama
+from common.inference.budget import count_completion_tokens, estimator, request_language
+from common.inference.memory import llama_overrides
+from common.inference.pool import Lease, LlamaPool, release_when_done
+from common.inference.prefix_cache import PrefixStateCache
+from common.inference.registry import ModelRegistry, model_allowlist
+from common.inference.response_cache import record, replay, response_cache, response_key
+from common.inference.runtime import llama_params
+from common.inference.sessions import fit_context, session_store
+from common.inference.speculative import make_draft_model, reset_speculation, speculation_meta
+from common.inference.strategies import STRATEGIES, StrategyContext, UnknownStrategy, make_strategy, resolve_strategy
+from common.inference.streaming import close_stream, collect_result, early_stop_reason
+from common.inference.tokenizer import StreamingCharCounter
+from common.inference.vocab import sentence_end_token_ids
+
+logger = get_logger(__name__)
+
+
+def _single_char_punct_ids(llama: Any) -> List[int]:
+    # Fallback when the vocab cannot be enumerated: first token of each terminator
+    ids: List[int] = []
+    for ch in ["。", "．", ".", "!", "?", "！", "？", "\n"]:
+        try:
+            toks = llama.tokenize(ch, add_bos=False, special=False)
+            if toks:
+                ids.append(toks[0])
+        except Exception:
+            pass
+    return ids
+
+
+def _build_prompt(messages: List[Dict[str, str]]) -> str:
+    parts: List[str] = []
+    for m in messages:
+        role = m.get("role", "user")
+        content = m.get("content", "")
+        if role == "system":
+            parts.append(f"[system]\n{content}\n")
+        elif role == "assistant":
+            parts.append(f"[assistant]\n{content}\n")
+        else:
+            parts.append(f"[user]\n{content}\n")
+    parts.append("[assistant]\n")
+    return "\n".join(parts)
+
+
+def _system_prefix(system_prompt: str) -> str:
+    # Leading part of every _build_prompt output (the fixed system turn)
+    prompt = _build_prompt([{"role": "system", "content": system_prompt}])
+    return prompt[: -len("[assistant]\n")]
+
+
+def _context_size(llama: Any) -> int:
+    # n_ctx of a llama (0 when it does not say), for keeping session prompts inside it
+    n_ctx = getattr(llama, "n_ctx", None)
+    if not callable(n_ctx) or not hasattr(llama, "tokenize"):
+        return 0
+    try:
+        return int(n_ctx())
+    except Exception:
+        return 0
+
+
+def _prompt_eval_tokens(prefix_stats: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    # Prompt tokens evaluated per pass; the second pass continues the same
+    # decode, so it never re-evaluates anything.
+    first = None
+    if "prompt_tokens" in prefix_stats:
+        first = prefix_stats["prompt_tokens"] - prefix_stats["tokens_saved"]
+    return {"first_pass": first, "second_pass": 0}
+
+
+class Engine:
+    """
+    Resident models (one pool per allowlisted path) and the decode loop.
+
+    ``pattern`` labels the pool/model metrics. With ``strategy`` set the
+    engine serves that length-control strategy only (the A/B/C apps);
+    otherwise each request picks one (the unified app). EOS handling lives
+    in common.inference.strategies.
+    """
+
+    def __init__(self, pattern: str, strategy: Optional[str] = None) -> None:
+        if strategy is not None and strategy not in STRATEGIES:
+            raise UnknownStrategy(f"unknown strategy: {strategy}")
+        self.pattern = pattern
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._registry: Optional[ModelRegistry] = None
+        # Per model path: EOS id, sentence-ending token ids and the prefix snapshot
+        self._eos_ids: Dict[str, Optional[int]] = {}
+        self._punct_ids: Dict[str, List[int]] = {}
+        self._prefix_caches: Dict[str, PrefixStateCache] = {}
+        metrics.register_engine(pattern, lambda: self._registry, self._prefix_caches)
+
+    # --- models --------------------------------------------------------------
+
+    def load_llama(self, model_path: str) -> Any:
+        settings = get_settings()
+        if settings.scheduler == "batch":
+            # One slot of the shared continuous-batching scheduler
+            return shared_batched_llama(model_path, settings)
+        from llama_cpp import Llama  # type: ignore
+
+        # MEMORY_BUDGET_MB picks the context size and KV cache type
+        overrides = llama_overrides(model_path, settings)
+        extra: Dict[str, Any] = {}
+        draft = make_draft_model(settings, **overrides)
+        if draft is not None:
+            extra["draft_model"] = draft
+        return Llama(model_path=model_path, verbose=False, **llama_params(settings, **overrides), **extra)
+
+    def create_llama(self, model_path: Optional[str] = None) -> Any:
+        settings = get_settings()
+        path = model_path or settings.model_path
+        llama = self.load_llama(path)
+        # Tokenizer facts the strategies need, looked up once per model
+        try:
+            self._eos_ids[path] = llama.token_eos()  # type: ignore[attr-defined]
+        except Exception:
+            try:
+                self._eos_ids[path] = llama.tokenize("</s>", add_bos=False, special=True)[0]
+            except Exception:
+                self._eos_ids[path] = None
+        if self._uses_punctuation():
+            punct_ids = sentence_end_token_ids(llama, path, settings.vocab_cache_dir)
+            self._punct_ids[path] = punct_ids if punct_ids is not None else _single_char_punct_ids(llama)
+        if settings.prefix_cache:
+            self._prefix_cache_for(path).warm(llama, _system_prefix(settings.system_prompt))
+        return llama
+
+    def _uses_punctuation(self) -> bool:
+        # Scanning the vocab is only worth it when a strategy biases punctuation
+        names = [self.strategy] if self.strategy is not None else list(STRATEGIES)
+        return any(getattr(STRATEGIES[n], "uses_punctuation", False) for n in names)
+
+    def _new_pool(self, model_path: str) -> LlamaPool:
+        settings = get_settings()
+        batched = settings.scheduler == "batch"
+        return LlamaPool(
+            factory=lambda: self.create_llama(model_path),
+            size=settings.batch_slots if batched else settings.pool_size,
+            max_queue=settings.pool_max_queue,
+            timeout=settings.pool_timeout,
+        )
+
+    def _ensure_registry(self) -> ModelRegistry:
+        if self._registry is not None:
+            return self._registry
+        with self._lock:
+            if self._registry is None:
+                settings = get_settings()
+                budget_mb = settings.model_memory_budget_mb
+                self._registry = ModelRegistry(
+                    self._new_pool,
+                    model_allowlist(settings.models, settings.model_path),
+                    default=settings.model_path,
+                    max_models=settings.max_models,
+                    memory_budget=budget_mb * 2**20 if budget_mb > 0 else None,
+                )
+        return self._registry
+
+    def _prefix_cache_for(self, model_path: str) -> PrefixStateCache:
+        return self._prefix_caches.setdefault(model_path, PrefixStateCache())
+
+    def warm_up(self, decode_tokens: int = 0) -> Dict[str, Any]:
+        # Load the default model (EOS/punctuation ids, prefix snapshot) and
+        # optionally decode a few tokens to fault in weights and compute buffers
+        start = time.perf_counter()
+        registry = self._ensure_registry()
+        registry.get(None)
+        timings: Dict[str, Any] = {"load_s": time.perf_counter() - start}
+        if decode_tokens > 0:
+            settings = get_settings()
+            prompt = _build_prompt(
+                [{"role": "system", "content": settings.system_prompt}, {"role": "user", "content": "こんにちは"}]
+            )
+            start = time.perf_counter()
+            with registry.acquire(None) as llama:
+                stream = llama.create_completion(
+                    prompt=prompt, max_tokens=decode_tokens, temperature=settings.temperature, top_p=settings.top_p, stream=True
+                )
+                for _ in stream:
+                    pass
+            timings["decode_s"] = time.perf_counter() - start
+        return timings
+
+    # --- requests ------------------------------------------------------------
+
+    def _resolve_strategy(self, strategy: Optional[str], settings: Settings) -> str:
+        if self.strategy is None:
+            return resolve_strategy(strategy, settings)
+        if strategy is not None and strategy.lower() != self.strategy:
+            raise UnknownStrategy(f"this app only serves the {self.strategy} strategy, not {strategy}")
+        return self.strategy
+
+    def generate(
+        self,
+        messages: List[Dict[str, str]],
+        min_len: Optional[int] = None,
+        max_len: Optional[int] = None,
+        model_override: Optional[str] = None,
+        seed: Optional[int] = None,
+        strategy: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        return collect_result(self.generate_stream(messages, min_len, max_len, model_override, seed, strategy, session_id))
+
+    def generate_stream(
+        self,
+        messages: List[Dict[str, str]],
+        min_len: Optional[int] = None,
+        max_len: Optional[int] = None,
+        model_override: Optional[str] = None,
+        seed: Optional[int] = None,
+        strategy: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        settings = get_settings()
+        min_c = int(min_len if min_len is not None else settings.min_len)
+        max_c = int(max_len if max_len is not None else settings.max_len)
+        if min_c > max_c:
+            raise ValueError("min_len must be <= max_len")
+        name = self._resolve_strategy(strategy, settings)
+
+        registry = self._ensure_registry()
+        _, model_path = registry.resolve(model_override)
+        if session_id is not None:
+            # Stored turns go between the system prompt and the new message
+            messages = session_store().conversation(session_id, messages)
+        # Deterministic requests are answered from the response cache; identical
+        # ones in flight wait for the first instead of decoding again
+        cache = response_cache()
+        key = None
+        flight = None
+        # A session turn must run to update the stored conversation
+        if cache is not None and session_id is None:
+            key = response_key(
+                settings,
+                pattern=name,
+                model=model_path,
+                prompt=_build_prompt(messages),
+                min_len=min_c,
+                max_len=max_c,
+                seed=seed,
+            )
+        if key is not None:
+            cached, source, flight = cache.acquire(key)
+            if cached is not None:
+                return replay(cached, source)
+
+        # Check out a context eagerly so a busy pool fails before streaming starts
+        try:
+            lease = registry.acquire(model_path)
+        except BaseException:
+            if flight is not None:
+                flight.abandon()
+            raise
+        events = release_when_done(
+            lease, self._generate_events(lease, model_path, messages, min_c, max_c, settings, seed, name, session_id)
+        )
+        return events if flight is None else record(flight, events)
+
+    async def agenerate(
+        self,
+        messages: List[Dict[str, str]],
+        min_len: Optional[int] = None,
+        max_len: Optional[int] = None,
+        model_override: Optional[str] = None,
+        seed: Optional[int] = None,
+        strategy: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        events = await self.agenerate_stream(messages, min_len, max_len, model_override, seed, strategy, session_id)
+        return await acollect_result(events)
+
+    async def agenerate_stream(
+        self,
+        messages: List[Dict[str, str]],
+        min_len: Optional[int] = None,
+        max_len: Optional[int] = None,
+        model_override: Optional[str] = None,
+        seed: Optional[int] = None,
+        strategy: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> AsyncEvents:
+        # Validation and the (possibly waiting) pool acquire happen off the event
+        # loop but before returning, so PoolTimeout still surfaces as an HTTP error.
+        # They run on the acquire executor, leaving decode threads to lease holders.
+        events = await run_acquire(
+            self.generate_stream, messages, min_len, max_len, model_override, seed, strategy, session_id
+        )
+        return aiter_events(events)
+
+    def _generate_events(
+        self,
+        lease: Lease,
+        model_path: str,
+        messages: List[Dict[str, str]],
+        min_c: int,
+        max_c: int,
+        settings: Settings,
+        seed: Optional[int],
+        strategy_name: str,
+        session_id: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        llama = lease.llama
+        prefix_cache = self._prefix_cache_for(model_path)
+        started = time.perf_counter() - lease.wait_s
+
+        model_key = getattr(llama, "model_path", None)
+        language = request_language(messages)
+        if settings.token_budget:
+            # Tokens for max_c chars at the observed chars/token ratio
+            max_tokens, chars_per_token = estimator.budget(model_key, language, max_c)
+        else:
+            max_tokens, chars_per_token = max(16, max_c * 2 // 3), None
+
+        prompt_start = time.perf_counter()
+        trimmed = 0
+        n_ctx = _context_size(llama)
+        if session_id is not None and n_ctx:
+            # A long conversation drops its oldest turns rather than outgrow the context
+            messages, trimmed = fit_context(
+                messages, lambda ms: len(llama.tokenize(_build_prompt(ms).encode("utf-8"), special=True)), n_ctx - max_tokens
+            )
+        prompt = _build_prompt(messages)
+        if settings.prefix_cache:
+            # No-op unless the system prompt changed since the last snapshot
+            prefix_cache.warm(llama, _system_prefix(settings.system_prompt))
+        session_stats: Optional[Dict[str, Any]] = None
+        if session_id is not None:
+            # The conversation's own state covers more than the system prompt snapshot
+            session_stats = session_store().restore(session_id, model_path, llama, prompt)
+            session_stats["context_trimmed_messages"] = trimmed
+        prefix_stats = prefix_cache.prepare(llama, prompt)
+        strategy = make_strategy(
+            strategy_name,
+            StrategyContext(
+                settings=settings,
+                eos_id=self._eos_ids.get(model_path),
+                min_len=min_c,
+                max_tokens=max_tokens,
+                punct_ids=self._punct_ids.get(model_path, []),
+            ),
+        )
+        kwargs: Dict[str, Any] = dict(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=settings.temperature,
+            top_p=settings.top_p,
+            stream=True,
+        )
+        strategy.configure(kwargs)
+        if seed is not None:
+            kwargs["seed"] = seed
+        if settings.top_k is not None:
+            kwargs["top_k"] = settings.top_k
+        if settings.min_p is not None:
+            kwargs["min_p"] = settings.min_p
+        if settings.repeat_penalty is not None:
+            kwargs["repeat_penalty"] = settings.repeat_penalty
+
+        reset_speculation(llama)
+        stream = llama.create_completion(**kwargs)
+
+        usage: Dict[str, Any] = {}
+        counter = StreamingCharCounter()
+        sanitizer = StreamingSanitizer(max_c, settings.banned_phrases)
+        generated: List[str] = []
+        n_events = 0
+        stop: Optional[str] = None
+        first_token: Optional[float] = None
+        first_text: Optional[float] = None
+        try:
+            for ev in stream:
+                n_events += 1
+                if n_events == 1:
+                    first_token = time.perf_counter()
+                delta = ev.get("choices", [{}])[0].get("text", "")
+                if delta:
+                    generated.append(delta)
+                    chars = counter.feed(delta)
+                    done = strategy.on_text(delta, chars)
+                    out = sanitizer.feed(delta)
+                    if out:
+                        if first_text is None:
+                            first_text = time.perf_counter()
+                        yield {"event": "delta", "text": out}
+                    if done:
+                        break
+                    stop = early_stop_reason(settings.early_stop, sanitizer, chars, min_c)
+                    if stop is not None:
+                        break
+                if not usage and "usage" in ev:
+                    usage = ev["usage"]
+        finally:
+            # Also when the consumer stops at a yield: frees a batch slot now
+            close_stream(stream)
+
+        out = sanitizer.finish()
+        if out:
+            if first_text is None:
+                first_text = time.perf_counter()
+            yield {"event": "delta", "text": out}
+        finished = time.perf_counter()
+        fixed = sanitizer.text
+
+        returned_chars = sanitizer.chars
+        completion_tokens, tokens_source = count_completion_tokens(
+            llama, "".join(generated), usage, n_events, strategy.sampled_tokens()
+        )
+        budget = estimator.observe(
+            model_key, language, counter.count, completion_tokens, returned_chars, kwargs["max_tokens"], min_c
+        )
+
+        if session_stats is not None:
+            session_stats.update(session_store().commit(session_id, model_path, llama, messages, fixed))
+
+        meta = {
+            "model": getattr(llama, "model_path", None),
+            "strategy": strategy.name,
+            **strategy.meta(counter.count),
+            "min_len": min_c,
+            "max_len": max_c,
+            "generated_chars": counter.count,
+            "returned_chars": returned_chars,
+            "prefix_cache": prefix_stats,
+            "pool": {"wait_ms": round(lease.wait_s * 1000, 3), "queue_depth": lease.queue_depth},
+            "prompt_eval_tokens": _prompt_eval_tokens(prefix_stats),
+            # tokens_saved is an upper bound: the model might have stopped by itself
+            "early_stop": {
+                "reason": stop,
+                "tokens_saved": max(0, kwargs["max_tokens"] - completion_tokens) if stop else 0,
+            },
+            "token_budget": {
+                "max_tokens": kwargs["max_tokens"],
+                "language": language,
+                "chars_per_token": round(chars_per_token, 4) if chars_per_token else None,
+                **budget,
+                "completion_tokens_source": tokens_source,
+            },
+            "speculative": speculation_meta(llama, completion_tokens),
+            "session": session_stats,
+            "timings": metrics.phase_timings(
+                started, lease.wait_s, prompt_start, first_token, first_text, finished, completion_tokens
+            ),
+            "usage": usage,
+        }
+        if settings.metrics:
+            # Request metrics are labelled by strategy; pool/model gauges by pattern
+            metrics.observe_request(strategy.name, meta)
+        yield {"event": "done", "text": fixed, "meta": meta}
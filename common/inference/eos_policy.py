@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+
+class EosReleasePolicy:
+    """
+    Logits processor that switches the EOS policy mid-stream.
+
+    Until released, EOS is suppressed (``eos_bias=-inf``) or biased. Release
+    happens when the caller reports the minimum length via ``release()`` or
+    after ``release_after_tokens`` steps. From then on the model may stop
+    naturally, and EOS is forced after ``tail_tokens`` more tokens. This
+    replaces a second ``create_completion`` call, so the continuation keeps
+    the exact token state instead of re-evaluating prompt + first pass.
+    """
+
+    def __init__(
+        self,
+        eos_token_id: Optional[int],
+        eos_bias: float,
+        release_after_tokens: int,
+        tail_tokens: int,
+    ) -> None:
+        self.eos_token_id = eos_token_id
+        self.eos_bias = float(eos_bias)
+        self.release_after_tokens = max(0, int(release_after_tokens))
+        self.tail_tokens = max(0, int(tail_tokens))
+        self._steps = 0
+        self._tail_steps = 0
+        self._released = False
+
+    @property
+    def released(self) -> bool:
+        return self._released
+
+    @property
+    def steps(self) -> int:
+        # One call per sampled token
+        return self._steps
+
+    @property
+    def tail_steps(self) -> int:
+        return self._tail_steps
+
+    def release(self) -> None:
+        self._released = True
+
+    def __call__(self, input_ids, scores):  # noqa: N802 - API contract
+        self._steps += 1
+        if not self._released and self._steps > self.release_after_tokens:
+            self._released = True
+        eos = self.eos_token_id
+        if eos is None or not 0 <= eos < len(scores):
+            return scores
+        if not self._released:
+            if np.isneginf(self.eos_bias):
+                scores[eos] = -np.inf
+            else:
+                scores[eos] += self.eos_bias
+        else:
+            self._tail_steps += 1
+            if self._tail_steps > self.tail_tokens:
+                scores[:] = -np.inf
+                scores[eos] = 0.0
+        return scores
@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from common import metrics
+from common.config import Settings
+from common.utils.logging import get_logger
+from .runtime import kv_cache_type
+
+logger = get_logger(__name__)
+
+
+class MemoryBudgetError(RuntimeError):
+    """Not even the smallest KV cache type fits MEMORY_MIN_CTX in the budget."""
+
+
+# --- GGUF metadata -----------------------------------------------------------
+
+_GGUF_MAGIC = b"GGUF"
+# value type id -> struct format (fixed-size types only)
+_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+_STRING, _ARRAY = 8, 9
+# Arrays longer than this (token lists, merges) are skipped, keeping only their length
+_MAX_ARRAY = 1024
+
+
+@dataclass
+class GGUFArray:
+    type: int
+    count: int
+    values: Optional[List[Any]] = None
+
+
+def _read(f: BinaryIO, fmt: str) -> Any:
+    size = struct.calcsize(fmt)
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("truncated GGUF header")
+    return struct.unpack(fmt, data)[0]
+
+
+def _read_str(f: BinaryIO) -> str:
+    n = _read(f, "<Q")
+    return f.read(n).decode("utf-8", errors="replace")
+
+
+def _read_value(f: BinaryIO, vtype: int) -> Any:
+    if vtype in _SCALARS:
+        return _read(f, _SCALARS[vtype])
+    if vtype == _STRING:
+        return _read_str(f)
+    if vtype == _ARRAY:
+        etype, count = _read(f, "<I"), _read(f, "<Q")
+        if etype in _SCALARS and count > _MAX_ARRAY:
+            f.seek(struct.calcsize(_SCALARS[etype]) * count, os.SEEK_CUR)
+            return GGUFArray(etype, count)
+        if etype == _STRING and count > _MAX_ARRAY:
+            for _ in range(count):
+                f.seek(_read(f, "<Q"), os.SEEK_CUR)
+            return GGUFArray(etype, count)
+        return GGUFArray(etype, count, [_read_value(f, etype) for _ in range(count)])
+    raise ValueError(f"unknown GGUF value type {vtype}")
+
+
+def read_gguf_metadata(path: str) -> Dict[str, Any]:
+    """Key/value metadata of a GGUF file (v2+), without touching the tensors."""
+    with open(path, "rb") as f:
+        if f.read(4) != _GGUF_MAGIC:
+            raise ValueError(f"{path} is not a GGUF file")
+        version = _read(f, "<I")
+        if version < 2:
+            raise ValueError(f"GGUF v{version} is not supported")
+        _read(f, "<Q")  # tensor count
+        n_kv = _read(f, "<Q")
+        meta: Dict[str, Any] = {"GGUF.version": version}
+        for _ in range(n_kv):
+            key = _read_str(f)
+            meta[key] = _read_value(f, _read(f, "<I"))
+    return meta
+
+
+@dataclass(frozen=True)
+class ModelShape:
+    n_layer: int
+    n_ctx_train: int
+    n_embd: int
+    n_head_kv: int
+    head_k: int
+    head_v: int
+    n_vocab: int
+
+    @classmethod
+    def from_metadata(cls, meta: Dict[str, Any]) -> "ModelShape":
+        arch = meta.get("general.architecture", "llama")
+
+        def get(name: str, default: Any = None) -> Any:
+            value = meta.get(f"{arch}.{name}", default)
+            if isinstance(value, GGUFArray):
+                # Per-layer values (e.g. head_count_kv): size for the largest
+                value = max(value.values or [0])
+            return value
+
+        n_embd = int(get("embedding_length"))
+        n_head = int(get("attention.head_count"))
+        tokens = meta.get("tokenizer.ggml.tokens")
+        return cls(
+            n_layer=int(get("block_count")),
+            n_ctx_train=int(get("context_length", 0) or 0),
+            n_embd=n_embd,
+            n_head_kv=int(get("attention.head_count_kv", n_head)),
+            head_k=int(get("attention.key_length", n_embd // n_head)),
+            head_v=int(get("attention.value_length", n_embd // n_head)),
+            n_vocab=int(get("vocab_size", tokens.count if isinstance(tokens, GGUFArray) else 32000)),
+        )
+
+
+# --- planning ----------------------------------------------------------------
+
+# Bytes per KV element: ggml block size / elements per block
+_KV_BYTES = {"f32": 4.0, "f16": 2.0, "q8_0": 34 / 32, "q5_1": 24 / 32, "q5_0": 22 / 32, "q4_1": 20 / 32, "q4_0": 18 / 32}
+# Tried in order: the first type that fits MEMORY_MIN_CTX wins
+KV_PREFERENCE = ("f16", "q8_0", "q4_0")
+_CTX_STEP = 256
+
+
+def kv_bytes_per_token(shape: ModelShape, type_k: str, type_v: str) -> float:
+    return shape.n_layer * shape.n_head_kv * (shape.head_k * _KV_BYTES[type_k] + shape.head_v * _KV_BYTES[type_v])
+
+
+def context_overhead(shape: ModelShape, n_batch: int, n_ubatch: int, logits_all: bool = False) -> int:
+    # llama-cpp-python's per-batch logits array plus llama.cpp's compute
+    # buffer (one ubatch of activations and output logits); a rough figure.
+    # With logits_all the array has a row per context token instead, which
+    # the planner counts per token
+    scores = 0 if logits_all else n_batch * shape.n_vocab * 4
+    compute = n_ubatch * (shape.n_vocab + 8 * shape.n_embd) * 4
+    return scores + compute
+
+
+@dataclass
+class MemoryPlan:
+    model_path: str
+    ctx_size: int
+    type_k: str
+    type_v: str
+    slots: int
+    weights_bytes: int
+    kv_bytes: int
+    overhead_bytes: int
+    budget_bytes: int
+    # Draft model weights, KV and buffers plus the logits_all scores rows
+    speculative_bytes: int = 0
+
+    @property
+    def estimated_bytes(self) -> int:
+        return self.weights_bytes + self.kv_bytes + self.overhead_bytes + self.speculative_bytes
+
+    def overrides(self) -> Dict[str, Any]:
+        """``llama_params`` overrides; a quantized V cache needs flash attention."""
+        params: Dict[str, Any] = {
+            "n_ctx": self.ctx_size,
+            "type_k": kv_cache_type(self.type_k),
+            "type_v": kv_cache_type(self.type_v),
+        }
+        if self.type_v not in ("f16", "f32"):
+            params["flash_attn"] = True
+        return params
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "ctx_size": self.ctx_size,
+            "type_k": self.type_k,
+            "type_v": self.type_v,
+            "slots": self.slots,
+            "speculative_bytes": self.speculative_bytes,
+            "estimated_bytes": self.estimated_bytes,
+            "budget_bytes": self.budget_bytes,
+        }
+
+
+def plan_memory(
+    model_path: str,
+    shape: ModelShape,
+    weights_bytes: int,
+    budget_bytes: int,
+    slots: int,
+    min_ctx: int,
+    max_ctx: int,
+    n_batch: int,
+    n_ubatch: int,
+    shared_weights: bool = True,
+    kv_types: Iterable[Tuple[str, str]] = tuple((t, t) for t in KV_PREFERENCE),
+    logits_all: bool = False,
+    draft_shape: Optional[ModelShape] = None,
+    draft_weights_bytes: int = 0,
+) -> MemoryPlan:
+    """
+    Largest context (up to ``max_ctx``) for ``slots`` contexts of one model,
+    using the first KV type pair that still fits ``min_ctx`` in the budget.
+
+    Weights are counted once when mmap-shared across slots, per slot
+    otherwise. ``logits_all`` (set by llama-cpp-python whenever a drafter is
+    attached) keeps ``n_ctx * n_vocab`` scores per context; a ``draft_shape``
+    adds a draft model with its own KV cache of the same size to every
+    context. Raises MemoryBudgetError when nothing fits.
+    """
+    slots = max(1, slots)
+    for model in (shape, draft_shape):
+        if model is not None and model.n_ctx_train:
+            max_ctx = min(max_ctx, model.n_ctx_train)
+    weights = weights_bytes if shared_weights else weights_bytes * slots
+    overhead = context_overhead(shape, n_batch, n_ubatch, logits_all) * slots
+    spec_fixed = 0
+    if draft_shape is not None:
+        spec_fixed = draft_weights_bytes if shared_weights else draft_weights_bytes * slots
+        spec_fixed += context_overhead(draft_shape, n_batch, n_ubatch) * slots
+    room = budget_bytes - weights - overhead - spec_fixed
+    tried: List[str] = []
+    for type_k, type_v in kv_types:
+        kv_token = kv_bytes_per_token(shape, type_k, type_v)
+        spec_token = shape.n_vocab * 4 if logits_all else 0
+        if draft_shape is not None:
+            spec_token += kv_bytes_per_token(draft_shape, type_k, type_v)
+        per_token = (kv_token + spec_token) * slots
+        fit = int(room // per_token) if room > 0 else 0
+        ctx = min(max_ctx, fit - fit % _CTX_STEP)
+        tried.append(f"{type_k}/{type_v}: {max(ctx, 0)} tokens")
+        if ctx >= min(min_ctx, max_ctx):
+            return MemoryPlan(
+                model_path=model_path,
+                ctx_size=ctx,
+                type_k=type_k,
+                type_v=type_v,
+                slots=slots,
+                weights_bytes=weights,
+                kv_bytes=int(kv_token * slots * ctx),
+                overhead_bytes=overhead,
+                budget_bytes=budget_bytes,
+                speculative_bytes=spec_fixed + int(spec_token * slots * ctx),
+            )
+    raise MemoryBudgetError(
+        f"{model_path}: {budget_bytes / 2**20:.0f} MiB cannot hold {slots} context(s) of {min_ctx} tokens "
+        f"({', '.join(tried)})"
+    )
+
+
+_plans: Dict[str, MemoryPlan] = {}
+_plans_lock = threading.Lock()
+
+
+def plan_for(model_path: str, settings: Settings) -> Optional[MemoryPlan]:
+    """The MEMORY_BUDGET_MB plan for ``model_path`` (cached per settings), or None when off."""
+    if settings.memory_budget_mb <= 0:
+        return None
+    batched = settings.scheduler == "batch"
+    # The batch scheduler attaches no drafter
+    speculative = "off" if batched else settings.speculative or "off"
+    key = (
+        f"{model_path}|{settings.memory_budget_mb}|{settings.memory_min_ctx}|{settings.ctx_size}|{batched}"
+        f"|{speculative}|{settings.draft_model_path}"
+    )
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            return plan
+    shape = ModelShape.from_metadata(read_gguf_metadata(model_path))
+    # Explicit TYPE_K/TYPE_V are kept; only the context is sized then
+    if settings.type_k or settings.type_v:
+        kv_types: Iterable[Tuple[str, str]] = ((settings.type_k or "f16", settings.type_v or "f16"),)
+    else:
+        kv_types = tuple((t, t) for t in KV_PREFERENCE)
+    draft_shape: Optional[ModelShape] = None
+    draft_weights = 0
+    if speculative == "draft" and settings.draft_model_path:
+        # make_draft_model loads it once per context with the planned n_ctx and KV types
+        draft_shape = ModelShape.from_metadata(read_gguf_metadata(settings.draft_model_path))
+        draft_weights = os.path.getsize(settings.draft_model_path)
+    plan = plan_memory(
+        model_path,
+        shape,
+        weights_bytes=os.path.getsize(model_path),
+        # Resident models share the process budget
+        budget_bytes=settings.memory_budget_mb * 2**20 // max(1, settings.max_models),
+        slots=settings.batch_slots if batched else settings.pool_size,
+        min_ctx=settings.memory_min_ctx,
+        max_ctx=settings.ctx_size,
+        n_batch=settings.batch_tokens if batched else settings.n_batch,
+        n_ubatch=settings.n_ubatch,
+        # The batch scheduler keeps one weights copy; pool slots share it only through mmap
+        shared_weights=batched or settings.use_mmap,
+        kv_types=kv_types,
+        logits_all=speculative != "off",
+        draft_shape=draft_shape,
+        draft_weights_bytes=draft_weights,
+    )
+    logger.info(
+        "memory plan for %s: ctx=%d kv=%s/%s x%d, estimated %.0f of %.0f MiB",
+        model_path,
+        plan.ctx_size,
+        plan.type_k,
+        plan.type_v,
+        plan.slots,
+        plan.estimated_bytes / 2**20,
+        plan.budget_bytes / 2**20,
+    )
+    with _plans_lock:
+        _plans[key] = plan
+    return plan
+
+
+def llama_overrides(model_path: str, settings: Settings) -> Dict[str, Any]:
+    plan = plan_for(model_path, settings)
+    return plan.overrides() if plan is not None else {}
+
+
+def resident_bytes() -> Optional[int]:
+    """Current RSS of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def memory_report() -> Dict[str, Any]:
+    with _plans_lock:
+        plans = list(_plans.values())
+    estimated = sum(p.estimated_bytes for p in plans)
+    return {
+        "estimated_bytes": estimated if plans else None,
+        "resident_bytes": resident_bytes(),
+        "plans": {p.model_path: p.describe() for p in plans},
+    }
+
+
+def _collect() -> Iterable[metrics.Family]:
+    resident = resident_bytes()
+    if resident is not None:
+        yield ("llama_process_resident_bytes", "gauge", "Resident memory of this process.", [({}, resident)])
+    with _plans_lock:
+        plans = list(_plans.values())
+    if plans:
+        yield (
+            "llama_memory_estimated_bytes",
+            "gauge",
+            "Planned memory per model (weights, KV cache, buffers).",
+            [({"model": p.model_path, "kv": p.type_k}, p.estimated_bytes) for p in plans],
+        )
+        yield (
+            "llama_memory_planned_ctx",
+            "gauge",
+            "Context size chosen under MEMORY_BUDGET_MB.",
+            [({"model": p.model_path}, p.ctx_size) for p in plans],
+        )
+
+
+metrics.REGISTRY.register_collector(_collect)
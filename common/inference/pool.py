@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, TypeVar
+
+from common.utils.logging import get_logger
+from .streaming import ClosingStream
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class PoolTimeout(Exception):
+    """No context became free in time (or the wait queue is full)."""
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PoolClosed(PoolTimeout):
+    """The pool was closed (its model evicted); a retry loads the model again."""
+
+
+class Lease:
+    """A checked-out context; release() returns it to the pool exactly once."""
+
+    def __init__(self, pool: "LlamaPool", llama: Any, wait_s: float, queue_depth: int) -> None:
+        self._pool = pool
+        self.llama = llama
+        self.wait_s = wait_s
+        self.queue_depth = queue_depth
+        self._acquired_at = time.monotonic()
+        self._released = False
+        # Runs once after the context is back in the pool (e.g. the registry's unpin)
+        self.on_release: Optional[Callable[[], None]] = None
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self.llama, time.monotonic() - self._acquired_at)
+        if self.on_release is not None:
+            self.on_release()
+
+    def __enter__(self) -> Any:
+        return self.llama
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+    def __del__(self) -> None:
+        # release() takes the pool lock, which the collecting thread may hold
+        if not self._released:
+            logger.warning("pool lease leaked: collected without release()")
+
+
+class LlamaPool:
+    """
+    Up to ``size`` independent llama contexts, created on demand.
+
+    Each request checks out one context for the whole generation, so a
+    context is never used by two threads at once. Waiters block on a
+    condition variable; at most ``max_queue`` may wait, each for at most
+    ``timeout`` seconds. Contexts load the same GGUF file, so with mmap the
+    weights are shared through the page cache and only the KV cache and
+    compute buffers are per context.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 1, max_queue: int = 16, timeout: float = 30.0) -> None:
+        self._factory = factory
+        self.size = max(1, int(size))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = float(timeout)
+        self._cond = threading.Condition()
+        self._idle: Deque[Any] = deque()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._avg_hold_s = 0.0
+        self.acquired = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_wait_s = 0.0
+        self._closed = False
+
+    def close(self) -> None:
+        # Drop idle contexts now and in-use ones as their leases come back
+        with self._cond:
+            self._closed = True
+            self._created -= len(self._idle)
+            self._idle.clear()
+            # Waiters fail with PoolClosed instead of creating untracked contexts
+            self._cond.notify_all()
+
+    def acquire(self) -> Lease:
+        start = time.monotonic()
+        create = False
+        llama: Optional[Any] = None
+        with self._cond:
+            if self._closed:
+                raise PoolClosed("model was unloaded; retry the request")
+            depth = self._waiting
+            if not self._idle and self._created >= self.size and depth >= self.max_queue:
+                self.rejected += 1
+                raise PoolTimeout("all model contexts are busy and the wait queue is full", self._retry_after())
+            self._waiting += 1
+            try:
+                deadline = start + self.timeout
+                while True:
+                    if self._closed:
+                        raise PoolClosed("model was unloaded; retry the request")
+                    if self._idle:
+                        # LIFO: the most recently used context has the warmest KV cache
+                        llama = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        self._created += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout("timed out waiting for a free model context", self._retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+        if create:
+            try:
+                llama = self._factory()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            logger.info("pool: created context %d/%d", self._created, self.size)
+        wait_s = time.monotonic() - start
+        with self._cond:
+            self.acquired += 1
+            self.total_wait_s += wait_s
+        return Lease(self, llama, wait_s, depth)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "queue_depth": self._waiting,
+                "max_queue": self.max_queue,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "total_wait_s": self.total_wait_s,
+            }
+
+    def _release(self, llama: Any, held_s: float) -> None:
+        with self._cond:
+            self._in_use -= 1
+            if self._closed:
+                self._created -= 1
+                return
+            self._idle.append(llama)
+            self._avg_hold_s = held_s if self._avg_hold_s == 0 else 0.8 * self._avg_hold_s + 0.2 * held_s
+            self._cond.notify()
+
+    def _retry_after(self) -> int:
+        # Rough time until the queue ahead drains; callers hold the lock
+        per_slot = (self._waiting + 1) / self.size
+        return max(1, math.ceil(per_slot * self._avg_hold_s))
+
+
+def release_when_done(lease: Lease, events: Iterator[T]) -> Iterator[T]:
+    return ClosingStream(events, lease.release)
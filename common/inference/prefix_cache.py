@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from common.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def common_prefix_len(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PrefixStateCache:
+    """
+    Snapshot of the llama state right after evaluating a fixed prompt prefix
+    (the system prompt). Restoring it before a request lets llama.cpp's own
+    prefix matching skip re-evaluating those tokens.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._prefix: Optional[str] = None
+        self._tokens: List[int] = []
+        self._state: Any = None
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    @property
+    def prefix_tokens(self) -> int:
+        return len(self._tokens)
+
+    def warm(self, llama: Any, prefix: str) -> bool:
+        """Evaluate ``prefix`` on ``llama`` and keep a snapshot of its state."""
+        if not hasattr(llama, "save_state"):
+            return False
+        with self._lock:
+            if self._prefix == prefix and self._state is not None:
+                return True
+            try:
+                # Same tokenization as create_completion (BOS + special tokens)
+                tokens = llama.tokenize(prefix.encode("utf-8"), special=True)
+                llama.reset()
+                llama.eval(tokens)
+                self._state = llama.save_state()
+                self._tokens = list(tokens)
+                self._prefix = prefix
+            except Exception:
+                logger.exception("prefix cache warm-up failed; continuing without it")
+                self._state = None
+                self._tokens = []
+                self._prefix = None
+                return False
+        logger.info("prefix cache: snapshot of %d system prompt tokens", len(self._tokens))
+        return True
+
+    def prepare(self, llama: Any, prompt: str) -> Dict[str, Any]:
+        """
+        Make ``llama`` start from the longest reusable prefix of ``prompt``,
+        restoring the snapshot if the resident context shares less of it.
+        """
+        stats: Dict[str, Any] = {"hit": False, "tokens_saved": 0}
+        if not hasattr(llama, "input_ids"):
+            return stats
+        prompt_tokens = llama.tokenize(prompt.encode("utf-8"), special=True)
+        # llama.cpp always re-evaluates the last prompt token to get logits
+        limit = max(0, len(prompt_tokens) - 1)
+        resident = common_prefix_len(llama.input_ids.tolist(), prompt_tokens)
+        usable = self._state is not None and self._prefix is not None and prompt.startswith(self._prefix)
+        if usable:
+            cached = common_prefix_len(self._tokens, prompt_tokens)
+            if cached > resident:
+                llama.load_state(self._state)
+                resident = cached
+        saved = min(resident, limit)
+        # Allow the last prefix token to re-merge with the user turn
+        hit = usable and saved >= min(len(self._tokens) - 1, limit)
+        if usable:
+            with self._lock:
+                self.hits += int(hit)
+                self.misses += int(not hit)
+                self.tokens_saved += saved
+        stats.update(hit=hit, tokens_saved=saved, prompt_tokens=len(prompt_tokens))
+        return stats
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common.inference.tokenizer import StreamingCharCounter
+
+try:
+    from llama_cpp import LogitsProcessor  # type: ignore
+except Exception:  # pragma: no cover - fallback stub for type checking
+    class LogitsProcessor:  # type: ignore
+        def __call__(self, input_ids, scores):
+            return scores
+
+
+_Plan = Tuple[npt.NDArray[np.intp], npt.NDArray[np.float32], npt.NDArray[np.intp]]
+
+
+class TokenRule:
+    """
+    A fixed set of token ids plus the bias to apply to them while ``when()``
+    is true (always, if ``when`` is None). A bias of -inf suppresses them.
+    """
+
+    def __init__(
+        self,
+        token_ids: Iterable[int],
+        bias: float = float("-inf"),
+        when: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        ids = np.unique(np.fromiter((int(t) for t in token_ids), dtype=np.intp))
+        self.ids = ids[ids >= 0]
+        self.bias = float(bias)
+        self.when = when
+
+    @property
+    def suppress(self) -> bool:
+        return self.bias == float("-inf")
+
+    def active(self) -> bool:
+        return self.when is None or bool(self.when())
+
+
+def ban_tokens(token_ids: Iterable[int]) -> TokenRule:
+    return TokenRule(token_ids)
+
+
+class FusedLogitsProcessor(LogitsProcessor):
+    """
+    Apply several TokenRules in one pass over the logits.
+
+    For each combination of active rules and vocab size the rules are merged
+    once into an (index, bias) pair and a suppression index, so a call is a
+    single in-place fancy-index add plus a single -inf write.
+    """
+
+    def __init__(self, rules: Sequence[TokenRule]) -> None:
+        self.rules: List[TokenRule] = list(rules)
+        self._plans: Dict[Tuple[Tuple[bool, ...], int], _Plan] = {}
+
+    def _plan(self, active: Tuple[bool, ...], n_vocab: int) -> _Plan:
+        key = (active, n_vocab)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        add_idx: List[np.ndarray] = []
+        add_val: List[np.ndarray] = []
+        ban_idx: List[np.ndarray] = []
+        for rule, on in zip(self.rules, active):
+            if not on:
+                continue
+            ids = rule.ids[rule.ids < n_vocab]
+            if rule.suppress:
+                ban_idx.append(ids)
+            else:
+                add_idx.append(ids)
+                add_val.append(np.full(ids.size, rule.bias, dtype=np.float64))
+        if add_idx:
+            # Overlapping rules sum their biases so each index is written once
+            idx, inverse = np.unique(np.concatenate(add_idx), return_inverse=True)
+            vals = np.bincount(inverse, weights=np.concatenate(add_val)).astype(np.float32)
+        else:
+            idx, vals = np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        ban = np.unique(np.concatenate(ban_idx)) if ban_idx else np.empty(0, dtype=np.intp)
+        plan = (idx.astype(np.intp), vals, ban.astype(np.intp))
+        self._plans[key] = plan
+        return plan
+
+    def __call__(self, input_ids, logits):  # noqa: N802 - API contract
+        # input_ids: token sequence array; logits: vocabulary logits array
+        scores = logits if isinstance(logits, np.ndarray) else np.asarray(logits, dtype=np.float32)
+        active = tuple(rule.active() for rule in self.rules)
+        idx, vals, ban = self._plan(active, scores.shape[-1])
+        if idx.size:
+            scores[idx] += vals
+        if ban.size:
+            scores[ban] = -np.inf
+        return scores
+
+
+class MinCharLengthProcessor(FusedLogitsProcessor):
+    """
+    Suppress EOS until a minimum character length is reached, then
+    release suppression and optionally bias sentence-ending punctuation.
+    """
+
+    def __init__(
+        self,
+        eos_token_id: Optional[int],
+        min_len: int,
+        punctuation_token_ids: Optional[Iterable[int]] = None,
+        punctuation_bias: float = 0.5,
+        banned_token_ids: Optional[Iterable[int]] = None,
+    ) -> None:
+        self.eos_token_id = eos_token_id
+        self.min_len = max(0, int(min_len))
+        self._counter = StreamingCharCounter()
+        self._chars = 0
+        self._released = self.min_len == 0
+        self.punct_ids = set(punctuation_token_ids or [])
+        self.punct_bias = float(punctuation_bias)
+        # Calls so far, i.e. tokens sampled
+        self.steps = 0
+        rules = [
+            TokenRule([] if eos_token_id is None else [eos_token_id], when=lambda: not self._released),
+            TokenRule(self.punct_ids, self.punct_bias, when=lambda: self._released),
+        ]
+        if banned_token_ids:
+            rules.append(ban_tokens(banned_token_ids))
+        super().__init__(rules)
+
+    def __call__(self, input_ids, logits):  # noqa: N802 - API contract
+        self.steps += 1
+        return super().__call__(input_ids, logits)
+
+    @property
+    def char_count(self) -> int:
+        return self._chars
+
+    def update_char_count(self, new_text: str) -> None:
+        # Resync from the full generated text (prefer feed_text while streaming)
+        self._counter.reset()
+        self.feed_text(new_text)
+
+    def feed_text(self, delta: str) -> None:
+        # Called externally with each decoded delta to keep char count in sync
+        self._chars = self._counter.feed(delta)
+        if not self._released and self._chars >= self.min_len:
+            self._released = True
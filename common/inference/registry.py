@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from common.utils.logging import get_logger
+from .pool import Lease, LlamaPool
+
+logger = get_logger(__name__)
+
+
+class ModelNotAllowed(ValueError):
+    """The requested model is neither an allowlisted name nor its path."""
+
+
+@dataclass
+class _Entry:
+    name: str
+    path: str
+    pool: LlamaPool
+    size_bytes: int
+    load_s: float
+    loaded_at: float
+    # Requests waiting for or holding a context of this model; never evicted while > 0
+    pins: int = 0
+
+
+class ModelRegistry:
+    """
+    Per-model LlamaPools, loaded on demand from an allowlist.
+
+    ``get(model)`` accepts an allowlisted name or its path (None means the
+    default model). At most ``max_models`` models stay resident, and with
+    ``memory_budget`` (bytes) their summed GGUF sizes must fit; the least
+    recently used model not serving a request is evicted to make room.
+    Loads in progress count against both limits from the moment they start.
+    Concurrent requests for a model that is still loading wait for that one
+    load instead of starting their own. ``acquire(model)`` pins the model
+    until the returned lease is released.
+    """
+
+    def __init__(
+        self,
+        pool_factory: Callable[[str], LlamaPool],
+        models: Sequence[Tuple[str, str]],
+        default: str,
+        max_models: int = 1,
+        memory_budget: Optional[int] = None,
+    ) -> None:
+        self._pool_factory = pool_factory
+        self._paths: Dict[str, str] = dict(models)
+        self.default = default
+        self._names: Dict[str, str] = {path: name for name, path in self._paths.items()}
+        self.max_models = max(1, int(max_models))
+        self.memory_budget = memory_budget
+        self._lock = threading.Lock()
+        self._resident: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._loading: Dict[str, threading.Event] = {}
+        # Bytes reserved by loads in progress, per path
+        self._reserved: Dict[str, int] = {}
+        self.loads = 0
+        self.evictions = 0
+        self.load_errors = 0
+
+    def resolve(self, model: Optional[str]) -> Tuple[str, str]:
+        """Return (name, path) for an allowlisted name or path."""
+        key = model or self.default
+        if key in self._paths:
+            return key, self._paths[key]
+        if key in self._names:
+            return self._names[key], key
+        raise ModelNotAllowed(f"model not allowed: {key}")
+
+    def get(self, model: Optional[str] = None) -> LlamaPool:
+        return self._get(model, pin=False).pool
+
+    def acquire(self, model: Optional[str] = None) -> Lease:
+        """A context of ``model``, which stays resident until the lease is released."""
+        entry = self._get(model, pin=True)
+        try:
+            lease = entry.pool.acquire()
+        except BaseException:
+            self._unpin(entry)
+            raise
+        lease.on_release = lambda: self._unpin(entry)
+        return lease
+
+    def _unpin(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.pins -= 1
+
+    def _get(self, model: Optional[str], pin: bool) -> _Entry:
+        name, path = self.resolve(model)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        while True:
+            with self._lock:
+                entry = self._resident.get(path)
+                if entry is not None:
+                    self._resident.move_to_end(path)
+                    entry.pins += int(pin)
+                    return entry
+                flight = self._loading.get(path)
+                if flight is None:
+                    self._make_room(size)
+                    if self._loading and self._over(size):
+                        # The room is held by loads in progress; retry after one
+                        flight = next(iter(self._loading.values()))
+                    else:
+                        # Reserve the slot before loading, so concurrent loads
+                        # of other models see it when they make room
+                        flight = self._loading[path] = threading.Event()
+                        self._reserved[path] = size
+                        break
+            # Someone else is loading (this model: use theirs, or retry if it failed)
+            flight.wait()
+        try:
+            entry = self._load(name, path, size, pin)
+        except Exception:
+            with self._lock:
+                self.load_errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(path, None)
+                self._reserved.pop(path, None)
+            flight.set()
+        return entry
+
+    def _load(self, name: str, path: str, size: int, pin: bool) -> _Entry:
+        start = time.monotonic()
+        pool = self._pool_factory(path)
+        # Create the first context now so the load is paid once, here
+        pool.acquire().release()
+        load_s = time.monotonic() - start
+        entry = _Entry(name=name, path=path, pool=pool, size_bytes=size, load_s=load_s, loaded_at=time.time())
+        with self._lock:
+            entry.pins = int(pin)
+            self._resident[path] = entry
+            self.loads += 1
+        logger.info("registry: loaded %s (%.0f MiB) in %.2fs", name, size / 2**20, load_s)
+        return entry
+
+    def _over(self, incoming: int) -> bool:
+        # Caller holds the lock; loads in progress count as resident
+        if len(self._resident) + len(self._reserved) + 1 > self.max_models:
+            return True
+        used = sum(e.size_bytes for e in self._resident.values()) + sum(self._reserved.values())
+        return self.memory_budget is not None and used + incoming > self.memory_budget
+
+    def _make_room(self, incoming: int) -> None:
+        # Caller holds the lock. Busy models are skipped, so the budget is
+        # best effort while every resident model is serving requests.
+        for path in list(self._resident):
+            if not self._over(incoming):
+                break
+            entry = self._resident[path]
+            if entry.pins or entry.pool.stats()["in_use"]:
+                continue
+            del self._resident[path]
+            entry.pool.close()
+            self.evictions += 1
+            logger.info("registry: evicted %s", entry.name)
+
+    def pools(self) -> Dict[str, LlamaPool]:
+        with self._lock:
+            return {e.name: e.pool for e in self._resident.values()}
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._resident.values())
+        return [
+            {
+                "name": e.name,
+                "path": e.path,
+                "size_bytes": e.size_bytes,
+                "load_s": e.load_s,
+                "loaded_at": e.loaded_at,
+                "in_use": e.pool.stats()["in_use"],
+            }
+            for e in entries
+        ]
+
+
+def model_allowlist(models: Sequence[Tuple[str, str]], default_path: str) -> List[Tuple[str, str]]:
+    # The configured MODEL_PATH is always servable, as "default"
+    allow = list(models)
+    if default_path not in {p for _, p in allow}:
+        allow.insert(0, ("default", default_path))
+    return allow
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from common.config import Settings, get_settings
+from common.utils.logging import get_logger
+from .streaming import ClosingStream, close_stream
+
+logger = get_logger(__name__)
+
+Result = Dict[str, Any]
+
+
+def response_key(settings: Settings, **parts: Any) -> Optional[str]:
+    """
+    Cache key for a generation, or None when its output is not determined
+    by its inputs (sampling with temperature > 0 and no seed).
+    """
+    if settings.temperature > 0 and parts.get("seed") is None:
+        return None
+    sampling = {
+        "temperature": settings.temperature,
+        "top_p": settings.top_p,
+        "top_k": settings.top_k,
+        "min_p": settings.min_p,
+        "repeat_penalty": settings.repeat_penalty,
+        "eos_bias": settings.eos_bias,
+        "second_pass": settings.second_pass,
+        "second_pass_tokens": settings.second_pass_tokens,
+        "early_stop": settings.early_stop,
+        "banned_phrases": list(settings.banned_phrases),
+        # A quantized KV cache changes the logits
+        "type_k": settings.type_k,
+        "type_v": settings.type_v,
+        "memory_budget_mb": settings.memory_budget_mb,
+    }
+    blob = json.dumps({**parts, **sampling}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """
+    A caller's claim on a key being generated. The leader's ``complete``
+    stores the result and wakes the waiters; ``abandon`` (after a failure,
+    or when the stream is closed or dropped) hands the key to one of them.
+    A caller that gave up waiting gets a non-leading flight: its result is
+    still cached, but it never ends the leader's flight.
+    """
+
+    def __init__(self, cache: "ResponseCache", key: str, event: Optional[threading.Event]) -> None:
+        self._cache = cache
+        self.key = key
+        self._event = event
+
+    @property
+    def leader(self) -> bool:
+        return self._event is not None
+
+    def complete(self, result: Result) -> None:
+        self._cache._complete(self.key, result, self._event)
+        self._event = None
+
+    def abandon(self) -> None:
+        if self._event is not None:
+            self._cache._abandon(self.key, self._event)
+            self._event = None
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of finished generations, with an optional disk tier.
+
+    ``acquire`` also coalesces concurrent identical requests: the first
+    caller becomes the leader and generates, later ones wait (at most
+    ``wait_s``) for its result, take over if it abandons, or generate
+    themselves when the wait runs out.
+    """
+
+    def __init__(
+        self, max_entries: int = 256, ttl_s: float = 600.0, disk_dir: Optional[str] = None, wait_s: float = 30.0
+    ) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.disk_dir = disk_dir or None
+        self.wait_s = float(wait_s)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Result]]" = OrderedDict()
+        self._flights: Dict[str, threading.Event] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.wait_timeouts = 0
+
+    def acquire(self, key: str) -> Tuple[Optional[Result], Optional[str], Optional[Flight]]:
+        """Return (result, source, None) on a hit, else (None, None, flight) to generate under."""
+        waited = False
+        deadline = time.monotonic() + self.wait_s
+        while True:
+            with self._lock:
+                result = self._get_memory(key)
+                if result is not None:
+                    source = "coalesced" if waited else "memory"
+                    if waited:
+                        self.coalesced += 1
+                    else:
+                        self.hits += 1
+                    return result, source, None
+                event = self._flights.get(key)
+                if event is None:
+                    result = self._get_disk(key)
+                    if result is not None:
+                        self.disk_hits += 1
+                        self._put_memory(key, result)
+                        return copy.deepcopy(result), "disk", None
+                    event = self._flights[key] = threading.Event()
+                    self.misses += 1
+                    return None, None, Flight(self, key, event)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not event.wait(remaining):
+                # The leader is stuck (queued for the pool, or a slow decode)
+                with self._lock:
+                    self.wait_timeouts += 1
+                    self.misses += 1
+                return None, None, Flight(self, key, None)
+            waited = True
+
+    def _complete(self, key: str, result: Result, event: Optional[threading.Event]) -> None:
+        stored = copy.deepcopy(result)
+        with self._lock:
+            self._put_memory(key, stored)
+            if event is not None and self._flights.get(key) is event:
+                del self._flights[key]
+        if event is not None:
+            event.set()
+        self._put_disk(key, stored)
+
+    def _abandon(self, key: str, event: threading.Event) -> None:
+        # Leader failed or its client left; a waiter takes over
+        with self._lock:
+            if self._flights.get(key) is event:
+                del self._flights[key]
+        event.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "wait_timeouts": self.wait_timeouts,
+            }
+
+    def _get_memory(self, key: str) -> Optional[Result]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def _put_memory(self, key: str, result: Result) -> None:
+        self._entries[key] = (time.time() + self.ttl_s, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")  # type: ignore[arg-type]
+
+    def _get_disk(self, key: str) -> Optional[Result]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("expires", 0) < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return data["result"]
+
+    def _put_disk(self, key: str, result: Result) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"expires": time.time() + self.ttl_s, "result": result}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("response cache: could not write %s: %s", path, e)
+
+
+def replay(result: Result, source: str) -> Iterator[Dict[str, Any]]:
+    # A hit streams as one delta with the whole text, then the usual done event
+    if result["text"]:
+        yield {"event": "delta", "text": result["text"]}
+    meta = dict(result["meta"])
+    meta["cache"] = {"hit": True, "source": source}
+    yield {"event": "done", "text": result["text"], "meta": meta}
+
+
+def record(flight: Flight, events: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Pass ``events`` through, storing the finished result under ``flight``."""
+
+    def passthrough() -> Iterator[Dict[str, Any]]:
+        for ev in events:
+            if ev.get("event") == "done":
+                ev["meta"]["cache"] = {"hit": False}
+                flight.complete({"text": ev["text"], "meta": ev["meta"]})
+            yield ev
+
+    def finish() -> None:
+        # Also closes ``events`` if the passthrough never started
+        try:
+            close_stream(events)
+        finally:
+            flight.abandon()
+
+    # Abandons unless completed, even if the stream is closed before it starts
+    return ClosingStream(passthrough(), finish)
+
+
+_cache: Optional[ResponseCache] = None
+_cache_config: Optional[Tuple[int, float, str, float]] = None
+_cache_lock = threading.Lock()
+
+
+def response_cache() -> Optional[ResponseCache]:
+    """The process-wide cache, or None when RESPONSE_CACHE is off."""
+    global _cache, _cache_config
+    settings = get_settings()
+    if not settings.response_cache:
+        return None
+    config = (
+        settings.response_cache_size,
+        settings.response_cache_ttl,
+        settings.response_cache_dir,
+        settings.response_cache_wait,
+    )
+    if _cache is None or _cache_config != config:
+        with _cache_lock:
+            # A settings reload that resizes the cache starts a fresh one
+            if _cache is None or _cache_config != config:
+                _cache = ResponseCache(
+                    max_entries=config[0], ttl_s=config[1], disk_dir=config[2] or None, wait_s=config[3]
+                )
+                _cache_config = config
+    return _cache
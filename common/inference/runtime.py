@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from common.config import Settings
+
+# ggml type ids accepted for TYPE_K / TYPE_V (llama.cpp's KV cache element type)
+KV_CACHE_TYPES = {"f32": 0, "f16": 1, "q4_0": 2, "q4_1": 3, "q5_0": 6, "q5_1": 7, "q8_0": 8}
+
+
+def kv_cache_type(name: Optional[str]) -> Optional[int]:
+    if name is None:
+        return None
+    try:
+        return KV_CACHE_TYPES[name]
+    except KeyError:
+        raise ValueError(f"unknown KV cache type: {name} (available: {', '.join(KV_CACHE_TYPES)})") from None
+
+
+def llama_params(settings: Settings, **overrides: Any) -> Dict[str, Any]:
+    """``Llama(...)`` keyword arguments for the runtime knobs in ``settings``."""
+    params: Dict[str, Any] = dict(
+        n_ctx=settings.ctx_size,
+        n_threads=settings.n_threads,
+        n_batch=settings.n_batch,
+        n_ubatch=settings.n_ubatch,
+        use_mmap=settings.use_mmap,
+        use_mlock=settings.use_mlock,
+        flash_attn=settings.flash_attn,
+    )
+    if settings.n_threads_batch is not None:
+        params["n_threads_batch"] = settings.n_threads_batch
+    # Unset KV types keep llama.cpp's default (f16)
+    for key, name in (("type_k", settings.type_k), ("type_v", settings.type_v)):
+        if name is not None:
+            params[key] = kv_cache_type(name)
+    params.update(overrides)
+    return params
+
+
+def context_params(settings: Settings) -> Dict[str, Any]:
+    """The same knobs as ``llama_context_params`` fields, for contexts built through the low-level API."""
+    params: Dict[str, Any] = {
+        "n_threads_batch": settings.n_threads_batch or settings.n_threads,
+        "flash_attn": settings.flash_attn,
+    }
+    for key, name in (("type_k", settings.type_k), ("type_v", settings.type_v)):
+        if name is not None:
+            params[key] = kv_cache_type(name)
+    return params
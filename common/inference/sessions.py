@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import APIRouter, HTTPException
+
+from common.config import get_settings
+from common.utils.logging import get_logger
+from .prefix_cache import common_prefix_len
+
+logger = get_logger(__name__)
+
+
+class UnknownSession(LookupError):
+    """The session id was not issued by POST /sessions, or it expired or was deleted."""
+
+
+@dataclass
+class _Session:
+    model_path: Optional[str] = None
+    history: List[Dict[str, str]] = field(default_factory=list)
+    tokens: List[int] = field(default_factory=list)
+    state: Any = None
+    state_bytes: int = 0
+    spilled: bool = False
+    # Disk I/O in progress (the lock is not held for it); a state being
+    # written out stays readable from ``spilling`` until it is on disk
+    busy: bool = False
+    spilling: Any = None
+    last_used: float = 0.0
+
+
+def _state_bytes(state: Any) -> int:
+    size = int(getattr(state, "llama_state_size", 0) or 0)
+    for name in ("input_ids", "scores"):
+        size += int(getattr(getattr(state, name, None), "nbytes", 0) or 0)
+    return size
+
+
+# --- spill format ------------------------------------------------------------
+# Magic, a little-endian u32 header length, a JSON header, then the raw
+# input_ids, scores and llama_state bytes. Nothing in it is executable, and
+# a file that does not match its header is rejected.
+
+_SPILL_MAGIC = b"LLSTATE1"
+
+
+def encode_state(state: Any) -> bytes:
+    input_ids = np.ascontiguousarray(state.input_ids, dtype=np.int32)
+    scores = np.ascontiguousarray(state.scores, dtype=np.float32)
+    llama_state = bytes(state.llama_state)
+    header = {
+        "n_tokens": int(state.n_tokens),
+        "llama_state_size": int(state.llama_state_size),
+        "seed": getattr(state, "seed", None),
+        "input_ids": list(input_ids.shape),
+        "scores": list(scores.shape),
+        "llama_state": len(llama_state),
+    }
+    blob = json.dumps(header).encode("utf-8")
+    return b"".join((_SPILL_MAGIC, struct.pack("<I", len(blob)), blob, input_ids.tobytes(), scores.tobytes(), llama_state))
+
+
+def decode_state(data: bytes, factory: Callable[..., Any]) -> Any:
+    """Rebuild a state written by ``encode_state``; raises ValueError on anything else."""
+    if not data.startswith(_SPILL_MAGIC) or len(data) < len(_SPILL_MAGIC) + 4:
+        raise ValueError("not a session state file")
+    offset = len(_SPILL_MAGIC) + 4
+    (n,) = struct.unpack("<I", data[len(_SPILL_MAGIC): offset])
+    header = json.loads(data[offset: offset + n].decode("utf-8"))
+    offset += n
+    arrays = {}
+    for name, dtype in (("input_ids", np.int32), ("scores", np.float32)):
+        shape = tuple(int(d) for d in header[name])
+        count = int(np.prod(shape))
+        size = count * np.dtype(dtype).itemsize
+        if any(d < 0 for d in shape) or offset + size > len(data):
+            raise ValueError(f"truncated {name}")
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape).copy()
+        offset += size
+    if len(data) - offset != int(header["llama_state"]):
+        raise ValueError("llama_state size does not match the header")
+    kwargs: Dict[str, Any] = dict(
+        input_ids=arrays["input_ids"],
+        scores=arrays["scores"],
+        n_tokens=int(header["n_tokens"]),
+        llama_state=data[offset:],
+        llama_state_size=int(header["llama_state_size"]),
+    )
+    if header.get("seed") is not None:
+        kwargs["seed"] = int(header["seed"])
+    return factory(**kwargs)
+
+
+def fit_context(
+    messages: List[Dict[str, str]], count_tokens: Callable[[List[Dict[str, str]]], int], limit: int
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Drop the oldest non-system turns until ``count_tokens`` of the prompt is
+    within ``limit``. The newest user turn is always kept. Returns the
+    messages and how many were dropped.
+    """
+    system = [m for m in messages if m.get("role") == "system"]
+    rest = [m for m in messages if m.get("role") != "system"]
+    dropped = 0
+    while len(rest) > 1 and count_tokens(system + rest) > limit:
+        # Whole turns: the oldest user message and the replies after it
+        rest.pop(0)
+        dropped += 1
+        while len(rest) > 1 and rest[0].get("role") != "user":
+            rest.pop(0)
+            dropped += 1
+    return (messages if not dropped else system + rest), dropped
+
+
+def _llama_state(**kwargs: Any) -> Any:
+    from llama_cpp import LlamaState  # type: ignore
+
+    return LlamaState(**kwargs)
+
+
+class SessionStore:
+    """
+    Server-side conversations: message history plus the llama state after
+    the last turn, so the next turn only evaluates what is new.
+
+    ``create`` issues an unguessable session id; only issued ids are
+    accepted. States live in memory up to ``memory_budget`` bytes; beyond
+    that the least recently used ones are written to ``spill_dir`` (or
+    dropped, if unset; the history is kept and the next turn re-evaluates
+    it). Disk reads and writes happen outside the store lock. At most
+    ``max_sessions`` conversations are kept, each with its last ``max_turns``
+    user turns, and idle ones expire after ``ttl_s``. Concurrent turns on
+    one session are last-writer-wins.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        max_sessions: int = 1024,
+        spill_dir: Optional[str] = None,
+        ttl_s: float = 3600.0,
+        state_factory: Optional[Callable[..., Any]] = None,
+        max_turns: int = 32,
+    ) -> None:
+        self.memory_budget = max(0, int(memory_budget))
+        self.max_sessions = max(1, int(max_sessions))
+        self.spill_dir = spill_dir or None
+        self.ttl_s = float(ttl_s)
+        self.max_turns = max(1, int(max_turns))
+        # Builds a state from spilled fields (llama_cpp.LlamaState by default)
+        self.state_factory = state_factory or _llama_state
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self.evictions = 0
+        self.spills = 0
+        self.disk_loads = 0
+        self.expired = 0
+
+    def create(self) -> str:
+        session_id = secrets.token_urlsafe(24)
+        removals: List[str] = []
+        with self._lock:
+            self._sessions[session_id] = _Session(last_used=time.time())
+            jobs = self._rebalance(session_id, removals)
+        self._run_io(jobs, removals)
+        return session_id
+
+    def conversation(self, session_id: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """System turn(s) of ``messages``, then the stored history, then the new turns."""
+        removals: List[str] = []
+        with self._lock:
+            self._expire(removals)
+            s = self._sessions.get(session_id)
+            history = list(s.history) if s is not None else None
+        self._run_io([], removals)
+        if history is None:
+            raise UnknownSession("unknown session; create one with POST /sessions")
+        system = [m for m in messages if m.get("role") == "system"]
+        new = [m for m in messages if m.get("role") != "system"]
+        return system + history + new
+
+    def restore(self, session_id: str, model_path: str, llama: Any, prompt: str) -> Dict[str, Any]:
+        """Load the session's state into ``llama`` if it covers more of ``prompt`` than the resident one."""
+        stats: Dict[str, Any] = {"id": session_id, "restored": False, "source": None, "tokens_reused": 0}
+        if not (hasattr(llama, "load_state") and hasattr(llama, "input_ids")):
+            return stats
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None or s.model_path != model_path or not s.tokens:
+                return stats
+            tokens = s.tokens
+        prompt_tokens = llama.tokenize(prompt.encode("utf-8"), special=True)
+        # llama.cpp always re-evaluates the last prompt token to get logits
+        limit = max(0, len(prompt_tokens) - 1)
+        resident = common_prefix_len(llama.input_ids.tolist(), prompt_tokens)
+        ours = common_prefix_len(tokens, prompt_tokens)
+        if ours > resident:
+            state, source = self._checkout(session_id)
+            if state is not None:
+                llama.load_state(state)
+                resident = ours
+                stats.update(restored=True, source=source)
+        stats["tokens_reused"] = min(resident, limit)
+        return stats
+
+    def commit(self, session_id: str, model_path: str, llama: Any, messages: List[Dict[str, str]], reply: str) -> Dict[str, Any]:
+        """Record the finished turn and snapshot ``llama``'s state for the next one."""
+        history = [m for m in messages if m.get("role") != "system"]
+        history.append({"role": "assistant", "content": reply})
+        turns = sum(m["role"] == "user" for m in history)
+        trimmed = turns > self.max_turns
+        while sum(m["role"] == "user" for m in history) > self.max_turns:
+            # The oldest turn and the replies that followed it
+            history.pop(0)
+            while history and history[0]["role"] != "user":
+                history.pop(0)
+        turns = min(turns, self.max_turns)
+        state, tokens = None, []
+        # The snapshot covers the untrimmed conversation, which the next prompt no longer starts with
+        if hasattr(llama, "save_state") and not trimmed:
+            try:
+                state = llama.save_state()
+                tokens = llama.input_ids.tolist()
+            except Exception:
+                logger.exception("session: state snapshot failed; keeping history only")
+                state, tokens = None, []
+        removals: List[str] = []
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None:
+                # Deleted or expired during the turn; it stays gone
+                return {"id": session_id, "turns": turns, "state_bytes": 0}
+            removals += self._unspill(session_id, s)
+            s.spilling = None
+            s.model_path = model_path
+            s.history = history
+            s.tokens = tokens
+            s.state = state
+            s.state_bytes = _state_bytes(state) if state is not None else 0
+            s.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            jobs = self._rebalance(session_id, removals)
+            result = {"id": session_id, "turns": turns, "state_bytes": s.state_bytes, "history_trimmed": trimmed}
+        self._run_io(jobs, removals)
+        return result
+
+    def describe(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None:
+                return None
+            in_memory = s.state is not None or s.spilling is not None
+            return {
+                "id": session_id,
+                "model": s.model_path,
+                "turns": sum(m["role"] == "user" for m in s.history),
+                "tokens": len(s.tokens),
+                "state_bytes": s.state_bytes,
+                "location": "memory" if in_memory else "disk" if s.spilled else None,
+                "idle_s": round(time.time() - s.last_used, 3),
+            }
+
+    def delete(self, session_id: str) -> bool:
+        removals: List[str] = []
+        with self._lock:
+            s = self._sessions.pop(session_id, None)
+            if s is not None:
+                removals += self._unspill(session_id, s)
+        self._run_io([], removals)
+        return s is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self._memory_bytes(),
+                "memory_budget": self.memory_budget,
+                "in_memory": sum(s.state is not None for s in self._sessions.values()),
+                "on_disk": sum(s.spilled for s in self._sessions.values()),
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "disk_loads": self.disk_loads,
+                "expired": self.expired,
+            }
+
+    def _checkout(self, session_id: str) -> Tuple[Any, Optional[str]]:
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None:
+                return None, None
+            self._sessions.move_to_end(session_id)
+            s.last_used = time.time()
+            if s.state is not None:
+                return s.state, "memory"
+            if s.spilling is not None:
+                return s.spilling, "memory"
+            if not s.spilled or s.busy:
+                # Nothing to load, or another turn is loading it right now
+                return None, None
+            s.busy = True
+        state = self._read(session_id)
+        removals: List[str] = []
+        jobs: List[Tuple[str, _Session, Any]] = []
+        with self._lock:
+            s.busy = False
+            current = self._sessions.get(session_id) is s and s.spilled and s.state is None
+            if current:
+                removals += self._unspill(session_id, s)
+                if state is not None:
+                    self.disk_loads += 1
+                    s.state = state
+                    jobs = self._rebalance(session_id, removals)
+        self._run_io(jobs, removals)
+        if not current or state is None:
+            return None, None
+        return state, "disk"
+
+    def _memory_bytes(self) -> int:
+        return sum(s.state_bytes for s in self._sessions.values() if s.state is not None)
+
+    def _rebalance(self, keep: str, removals: List[str]) -> List[Tuple[str, _Session, Any]]:
+        # Caller holds the lock. Returns the spills to write once it is released.
+        self._expire(removals)
+        while len(self._sessions) > self.max_sessions:
+            sid, s = self._sessions.popitem(last=False)
+            removals += self._unspill(sid, s)
+            self.evictions += 1
+        jobs: List[Tuple[str, _Session, Any]] = []
+        for sid, s in list(self._sessions.items()):
+            if self._memory_bytes() <= self.memory_budget:
+                break
+            if sid == keep or s.state is None:
+                continue
+            if self.spill_dir:
+                s.spilling, s.busy = s.state, True
+                jobs.append((sid, s, s.state))
+            else:
+                self.evictions += 1
+            s.state = None
+        return jobs
+
+    def _expire(self, removals: List[str]) -> None:
+        # Caller holds the lock
+        if self.ttl_s <= 0:
+            return
+        cutoff = time.time() - self.ttl_s
+        for sid, s in list(self._sessions.items()):
+            if s.last_used < cutoff:
+                del self._sessions[sid]
+                removals += self._unspill(sid, s)
+                self.expired += 1
+
+    def _unspill(self, session_id: str, s: _Session) -> List[str]:
+        # Caller holds the lock; the file is removed by _run_io
+        if not s.spilled:
+            return []
+        s.spilled = False
+        return [self._spill_path(session_id)]
+
+    def _run_io(self, jobs: List[Tuple[str, _Session, Any]], removals: List[str]) -> None:
+        # Disk work collected under the lock, done without it
+        for path in removals:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        for sid, s, state in jobs:
+            written = self._write(sid, state)
+            with self._lock:
+                s.busy = False
+                # A newer turn, a delete or an expiry may have superseded it
+                current = self._sessions.get(sid) is s and s.spilling is state
+                if current:
+                    s.spilling = None
+                if current and written:
+                    s.spilled = True
+                    self.spills += 1
+                elif current:
+                    self.evictions += 1
+            if written and not current:
+                try:
+                    os.remove(self._spill_path(sid))
+                except OSError:
+                    pass
+
+    def _spill_path(self, session_id: str) -> str:
+        # Hashed, so no session id can name a path outside spill_dir
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"{name}.state")  # type: ignore[arg-type]
+
+    def _write(self, session_id: str, state: Any) -> bool:
+        path = self._spill_path(session_id)
+        try:
+            data = encode_state(state)
+            os.makedirs(self.spill_dir, exist_ok=True)  # type: ignore[arg-type]
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except (OSError, AttributeError, TypeError, ValueError) as e:
+            logger.warning("session: could not spill %s: %s", session_id, e)
+            return False
+        return True
+
+    def _read(self, session_id: str) -> Any:
+        try:
+            with open(self._spill_path(session_id), "rb") as f:
+                return decode_state(f.read(), self.state_factory)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            logger.warning("session: spilled state for %s is unreadable: %s", session_id, e)
+            return None
+
+
+_store: Optional[SessionStore] = None
+_store_config: Optional[Tuple[Any, ...]] = None
+_store_lock = threading.Lock()
+
+
+def session_store() -> SessionStore:
+    global _store, _store_config
+    settings = get_settings()
+    config = (
+        settings.session_memory_mb,
+        settings.session_max,
+        settings.session_dir,
+        settings.session_ttl,
+        settings.session_max_turns,
+    )
+    if _store is None or _store_config != config:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(
+                    memory_budget=settings.session_memory_mb * 2**20,
+                    max_sessions=settings.session_max,
+                    spill_dir=settings.session_dir or None,
+                    ttl_s=settings.session_ttl,
+                    max_turns=settings.session_max_turns,
+                )
+            else:
+                # Keep the conversations across a settings reload, with the new limits
+                _store.memory_budget = settings.session_memory_mb * 2**20
+                _store.max_sessions = max(1, settings.session_max)
+                _store.spill_dir = settings.session_dir or None
+                _store.ttl_s = settings.session_ttl
+                _store.max_turns = max(1, settings.session_max_turns)
+            _store_config = config
+    return _store
+
+
+router = APIRouter()
+
+
+@router.post("/sessions", status_code=201)
+def create_session() -> Dict[str, Any]:
+    # The id is the only credential for the conversation, so the server picks it
+    return {"id": session_store().create()}
+
+
+@router.get("/sessions/{session_id}")
+def get_session(session_id: str) -> Dict[str, Any]:
+    info = session_store().describe(session_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="unknown session")
+    return info
+
+
+@router.delete("/sessions/{session_id}", status_code=204)
+def delete_session(session_id: str) -> None:
+    if not session_store().delete(session_id):
+        raise HTTPException(status_code=404, detail="unknown session")
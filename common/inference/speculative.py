@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from common.config import Settings
+from common.utils.logging import get_logger
+from .runtime import llama_params
+
+logger = get_logger(__name__)
+
+# Speculative decoding through llama-cpp-python's ``Llama(draft_model=...)``.
+# The drafter proposes a few tokens, the model verifies them in one batch and
+# keeps the longest prefix it would have sampled itself. Every emitted token
+# still goes through sample() with the request's logits processors and
+# logit_bias, once per token and in order, so ignore_eos, the EOS bias,
+# EosReleasePolicy and MinCharLengthProcessor see exactly the same calls as
+# without a drafter; only the number of forward passes changes.
+
+
+class PromptLookupDraft:
+    """
+    n-gram prompt lookup: find the latest earlier occurrence of the last
+    ``max_ngram_size`` (down to 1) tokens in the context and propose the
+    ``num_pred_tokens`` that followed it. Free to run, and effective when the
+    output repeats phrasing from the prompt or from itself (house style).
+    """
+
+    def __init__(self, max_ngram_size: int = 2, num_pred_tokens: int = 10) -> None:
+        self.max_ngram_size = max(1, int(max_ngram_size))
+        self.num_pred_tokens = max(1, int(num_pred_tokens))
+
+    def __call__(self, input_ids: np.ndarray, **kwargs: Any) -> np.ndarray:
+        ids = np.asarray(input_ids)
+        n = ids.shape[0]
+        for size in range(min(self.max_ngram_size, n - 1), 0, -1):
+            windows = np.lib.stride_tricks.sliding_window_view(ids[:-1], size)
+            hits = np.nonzero(np.all(windows == ids[-size:], axis=1))[0]
+            if hits.size:
+                start = int(hits[-1]) + size
+                return ids[start:start + self.num_pred_tokens].astype(np.intc)
+        return np.zeros(0, dtype=np.intc)
+
+
+class LlamaModelDraft:
+    """Greedy proposals from a small GGUF model sharing the tokenizer."""
+
+    def __init__(self, llama: Any, num_pred_tokens: int = 8) -> None:
+        self.llama = llama
+        self.num_pred_tokens = max(1, int(num_pred_tokens))
+
+    def __call__(self, input_ids: np.ndarray, **kwargs: Any) -> np.ndarray:
+        out: List[int] = []
+        # reset=True reuses the longest matching prefix of the draft's own KV
+        for token in self.llama.generate(list(map(int, input_ids)), top_k=1, temp=0.0, reset=True):
+            out.append(int(token))
+            if len(out) >= self.num_pred_tokens:
+                break
+        return np.asarray(out, dtype=np.intc)
+
+
+class DraftStats:
+    """
+    Wraps a drafter and measures acceptance.
+
+    Each call proposes tokens for the positions after ``input_ids``; by the
+    next call the model has appended what it actually sampled, so the
+    matching prefix is the accepted part. Counters cover one request
+    (``reset()`` at its start); a context serves one request at a time.
+    """
+
+    def __init__(self, inner: Any, mode: str) -> None:
+        self.inner = inner
+        self.mode = mode
+        self.reset()
+
+    def reset(self) -> None:
+        self.steps = 0
+        self.drafted = 0
+        self.accepted = 0
+        self._pending: Optional[Tuple[int, np.ndarray]] = None
+
+    def __call__(self, input_ids: np.ndarray, **kwargs: Any) -> np.ndarray:
+        ids = np.asarray(input_ids)
+        if self._pending is not None:
+            start, proposal = self._pending
+            actual = ids[start:start + len(proposal)]
+            k = min(len(actual), len(proposal))
+            mismatch = np.nonzero(actual[:k] != proposal[:k])[0]
+            self.accepted += int(mismatch[0]) if mismatch.size else k
+        proposal = np.asarray(self.inner(ids, **kwargs), dtype=np.intc)
+        self.steps += 1
+        self.drafted += len(proposal)
+        self._pending = (ids.shape[0], proposal)
+        return proposal
+
+    def snapshot(self, completion_tokens: int) -> Dict[str, Any]:
+        # The last proposal is never checked, so it is left out of the rate
+        last = len(self._pending[1]) if self._pending is not None else 0
+        checked = self.drafted - last
+        return {
+            "mode": self.mode,
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.accepted / checked, 4) if checked else None,
+            # Forward passes saved: ~1.0 without speculation
+            "tokens_per_step": round(completion_tokens / self.steps, 3) if self.steps else None,
+        }
+
+
+def make_draft_model(settings: Settings, **overrides: Any) -> Optional[DraftStats]:
+    """
+    The drafter for a new context per SPECULATIVE, or None when off.
+    ``overrides`` are the main context's ``llama_params`` overrides (the
+    MEMORY_BUDGET_MB n_ctx and KV types), which the draft model shares.
+    """
+    mode = settings.speculative
+    if mode in ("", "off"):
+        return None
+    if mode == "prompt_lookup":
+        return DraftStats(PromptLookupDraft(settings.speculative_ngram, settings.speculative_tokens), mode)
+    if mode == "draft":
+        if not settings.draft_model_path:
+            raise ValueError("SPECULATIVE=draft needs DRAFT_MODEL_PATH")
+        from llama_cpp import Llama  # type: ignore
+
+        draft = Llama(model_path=settings.draft_model_path, verbose=False, **llama_params(settings, **overrides))
+        return DraftStats(LlamaModelDraft(draft, settings.speculative_tokens), mode)
+    raise ValueError(f"unknown SPECULATIVE mode: {mode}")
+
+
+def reset_speculation(llama: Any) -> None:
+    draft = getattr(llama, "draft_model", None)
+    if isinstance(draft, DraftStats):
+        draft.reset()
+
+
+def speculation_meta(llama: Any, completion_tokens: int) -> Optional[Dict[str, Any]]:
+    draft = getattr(llama, "draft_model", None)
+    if not isinstance(draft, DraftStats):
+        return None
+    return draft.snapshot(completion_tokens)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import abc
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from common.config import Settings
+from .eos_policy import EosReleasePolicy
+from .processors import MinCharLengthProcessor
+
+
+class UnknownStrategy(ValueError):
+    """The requested length-control strategy is not registered."""
+
+
+@dataclass
+class StrategyContext:
+    """What a strategy needs to set up one decode."""
+
+    settings: Settings
+    eos_id: Optional[int]
+    min_len: int
+    max_tokens: int
+    punct_ids: List[int] = field(default_factory=list)
+
+
+class LengthStrategy(abc.ABC):
+    """
+    How one decode is kept inside [min_len, max_len]; a new instance per request.
+
+    ``configure`` adds the EOS handling to the create_completion kwargs (and
+    may raise ``max_tokens``). ``on_text`` sees every decoded delta with the
+    running char count and returns True to end the decode there. ``meta``
+    adds strategy-specific fields to the response meta. ``sampled_tokens``
+    is the call count of an attached logits processor, if any.
+    """
+
+    name = ""
+    # Needs the model's sentence-ending token ids (StrategyContext.punct_ids)
+    uses_punctuation = False
+
+    def __init__(self, ctx: StrategyContext) -> None:
+        self.ctx = ctx
+
+    @abc.abstractmethod
+    def configure(self, kwargs: Dict[str, Any]) -> None:
+        ...
+
+    def on_text(self, delta: str, chars: int) -> bool:
+        return False
+
+    def meta(self, generated_chars: int) -> Dict[str, Any]:
+        return {}
+
+    def sampled_tokens(self) -> Optional[int]:
+        return None
+
+
+class _EosReleaseStrategy(LengthStrategy):
+    # Shared by ignore_eos and logit_bias: stop at min_len, or with
+    # SECOND_PASS let the model end on its own within a few more tokens
+    default_tail = 32
+
+    def __init__(self, ctx: StrategyContext) -> None:
+        super().__init__(ctx)
+        sp_tokens = ctx.settings.second_pass_tokens
+        if sp_tokens is None:
+            sp_tokens = self.default_tail
+        self.second_used = ctx.settings.second_pass and sp_tokens > 0
+        self.tail_tokens = max(1, min(sp_tokens, 128))
+        self.policy: Optional[EosReleasePolicy] = None
+
+    def _release_policy(self, kwargs: Dict[str, Any], eos_bias: float) -> None:
+        self.policy = EosReleasePolicy(
+            eos_token_id=self.ctx.eos_id,
+            eos_bias=eos_bias,
+            release_after_tokens=self.ctx.max_tokens,
+            tail_tokens=self.tail_tokens,
+        )
+        kwargs["max_tokens"] = self.ctx.max_tokens + self.policy.tail_tokens
+        kwargs["logits_processor"] = [self.policy]
+
+    def on_text(self, delta: str, chars: int) -> bool:
+        if chars < self.ctx.min_len:
+            return False
+        if self.policy is None:
+            return True
+        self.policy.release()
+        return False
+
+    def meta(self, generated_chars: int) -> Dict[str, Any]:
+        return {"second_pass_used": self.second_used}
+
+    def sampled_tokens(self) -> Optional[int]:
+        return self.policy.steps if self.policy is not None else None
+
+
+class IgnoreEosStrategy(_EosReleaseStrategy):
+    """Pattern A: never sample EOS before min_len."""
+
+    name = "ignore_eos"
+    default_tail = 48
+
+    def configure(self, kwargs: Dict[str, Any]) -> None:
+        if self.second_used:
+            self._release_policy(kwargs, float("-inf"))
+        else:
+            kwargs["ignore_eos"] = True
+
+
+class LogitBiasStrategy(_EosReleaseStrategy):
+    """Pattern B: a negative EOS logit bias (EOS_BIAS) until min_len."""
+
+    name = "logit_bias"
+    default_tail = 32
+
+    def configure(self, kwargs: Dict[str, Any]) -> None:
+        eos_bias = self.ctx.settings.eos_bias
+        if self.second_used:
+            self._release_policy(kwargs, eos_bias)
+        elif self.ctx.eos_id is not None:
+            kwargs["logit_bias"] = {self.ctx.eos_id: eos_bias}
+
+    def meta(self, generated_chars: int) -> Dict[str, Any]:
+        return {"eos_bias": self.ctx.settings.eos_bias, **super().meta(generated_chars)}
+
+
+class LogitsProcessorStrategy(LengthStrategy):
+    """Pattern C: MinCharLengthProcessor, then a sentence-end punctuation bias."""
+
+    name = "logits_processor"
+    uses_punctuation = True
+
+    def __init__(self, ctx: StrategyContext) -> None:
+        super().__init__(ctx)
+        self.processor = MinCharLengthProcessor(
+            eos_token_id=ctx.eos_id,
+            min_len=ctx.min_len,
+            punctuation_token_ids=ctx.punct_ids,
+            punctuation_bias=0.3,
+        )
+
+    def configure(self, kwargs: Dict[str, Any]) -> None:
+        kwargs["logits_processor"] = [self.processor]
+
+    def on_text(self, delta: str, chars: int) -> bool:
+        self.processor.feed_text(delta)
+        return False
+
+    def meta(self, generated_chars: int) -> Dict[str, Any]:
+        return {"eos_suppressed": generated_chars < self.ctx.min_len}
+
+    def sampled_tokens(self) -> Optional[int]:
+        return self.processor.steps
+
+
+STRATEGIES: Dict[str, Callable[[StrategyContext], LengthStrategy]] = {}
+
+
+def register_strategy(name: str, factory: Callable[[StrategyContext], LengthStrategy]) -> None:
+    STRATEGIES[name] = factory
+
+
+for _cls in (IgnoreEosStrategy, LogitBiasStrategy, LogitsProcessorStrategy):
+    register_strategy(_cls.name, _cls)
+
+
+def resolve_strategy(name: Optional[str], settings: Settings) -> str:
+    key = (name or settings.default_strategy).lower()
+    if key not in STRATEGIES:
+        raise UnknownStrategy(f"unknown strategy: {key} (available: {', '.join(sorted(STRATEGIES))})")
+    return key
+
+
+def make_strategy(name: str, ctx: StrategyContext) -> LengthStrategy:
+    return STRATEGIES[name](ctx)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from common.utils.logging import get_logger
+from common.utils.text_sanitize import StreamingSanitizer
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+# Engines stream plain dict events:
+#   {"event": "delta", "text": "..."}                  post-processed text, in order
+#   {"event": "done", "text": "...", "meta": {...}}    final text and meta
+
+
+class ClosingStream(Iterator[T]):
+    """
+    ``events`` with a cleanup that runs exactly once: when they end or fail,
+    or on ``close()``. Unlike a generator's ``finally`` this also covers a
+    stream that was never started, e.g. one returned to a request that was
+    cancelled while it was being set up. Owners must close what they do not
+    exhaust; the cleanup takes locks, so it never runs from the GC.
+    """
+
+    def __init__(self, events: Iterator[T], cleanup: Callable[[], None]) -> None:
+        self._events = events
+        self._cleanup: Optional[Callable[[], None]] = cleanup
+
+    def __next__(self) -> T:
+        try:
+            return next(self._events)
+        except BaseException:
+            self._finish()
+            raise
+
+    def close(self) -> None:
+        try:
+            close_stream(self._events)
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        cleanup, self._cleanup = self._cleanup, None
+        if cleanup is not None:
+            cleanup()
+
+    def __del__(self) -> None:
+        if self._cleanup is not None:
+            logger.warning("stream dropped without close(); its cleanup never ran")
+
+
+def collect_result(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    for ev in events:
+        if ev.get("event") == "done":
+            result = {"text": ev["text"], "meta": ev["meta"]}
+    return result
+
+
+def early_stop_reason(mode: str, sanitizer: StreamingSanitizer, chars: int, min_c: int) -> Optional[str]:
+    """
+    Why the decode loop may stop now without changing the response, if at all.
+
+    ``max_len``: the raw text is already past max_len, so safe_trim will cut
+    everything decoded from here on. ``sentence`` (opt-in, EARLY_STOP=sentence)
+    additionally stops at the first sentence boundary once min_len is met,
+    which ends generation earlier than the model would have.
+    """
+    if mode == "off":
+        return None
+    if sanitizer.saturated:
+        return "max_len"
+    if mode == "sentence" and chars >= min_c and sanitizer.at_sentence_end:
+        return "sentence"
+    return None
+
+
+def close_stream(stream: Any) -> None:
+    # Stop the backend decode now instead of when the generator is collected
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def sse_stream(events: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    try:
+        for ev in events:
+            data = dict(ev)
+            name = data.pop("event", "message")
+            yield format_sse(name, data)
+    except Exception as exc:  # headers are already sent; report in-band
+        logger.exception("streaming generation failed")
+        yield format_sse("error", {"detail": str(exc)})
+
+
+async def asse_stream(events: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[str]:
+    try:
+        async for ev in events:
+            data = dict(ev)
+            name = data.pop("event", "message")
+            yield format_sse(name, data)
+    except Exception as exc:  # headers are already sent; report in-band
+        logger.exception("streaming generation failed")
+        yield format_sse("error", {"detail": str(exc)})
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import unicodedata
+from functools import lru_cache
 
 
 SENTENCE_END_CHARS = set("。．.!?！？\n")
@@ -13,3 +14,76 @@ def count_chars(text: str) -> int:
 
 def is_sentence_end(token_str: str) -> bool:
     return any(ch in SENTENCE_END_CHARS for ch in token_str)
+
+
+@lru_cache(maxsize=1)
+def _backward_composers() -> frozenset[str]:
+    # Starters that can be the second half of a canonical composition
+    chars = {chr(cp) for cp in range(0x1161, 0x1176)}  # Hangul V jamo
+    chars.update(chr(cp) for cp in range(0x11A8, 0x11C3))  # Hangul T jamo
+    for cp in range(0x30000):
+        decomp = unicodedata.decomposition(chr(cp))
+        if not decomp or decomp.startswith("<"):
+            continue
+        parts = decomp.split()
+        if len(parts) == 2:
+            second = chr(int(parts[1], 16))
+            if unicodedata.combining(second) == 0:
+                chars.add(second)
+    return frozenset(chars)
+
+
+def _nfc(text: str) -> str:
+    return unicodedata.normalize("NFC", text)
+
+
+class StreamingCharCounter:
+    """
+    Keep ``count_chars`` of a growing text while consuming it delta by delta.
+
+    Only the tail after the last stable boundary (a starter that cannot
+    compose with the character before it) is re-normalized on each feed,
+    so combining marks or Hangul jamo split across token boundaries are
+    still counted exactly as NFC would compose them.
+    """
+
+    def __init__(self) -> None:
+        self._committed = 0
+        self._tail = ""
+        self._count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def reset(self) -> None:
+        self._committed = 0
+        self._tail = ""
+        self._count = 0
+
+    def feed(self, delta: str) -> int:
+        if not delta:
+            return self._count
+        s = self._tail + delta
+        cut = 0
+        for i in range(len(s) - 1, 0, -1):
+            if self._is_boundary(s[i]):
+                cut = i
+                break
+        if cut:
+            self._committed += len(_nfc(s[:cut]))
+            s = s[cut:]
+        self._tail = s
+        self._count = self._committed + len(_nfc(s))
+        return self._count
+
+    @staticmethod
+    def _is_boundary(ch: str) -> bool:
+        # A starter blocks reordering and composition across it, unless it
+        # can compose backwards with whatever precedes it (e.g. Hangul jamo).
+        if unicodedata.combining(ch) != 0:
+            return False
+        head = unicodedata.normalize("NFD", ch)[0]
+        if unicodedata.combining(head) != 0:
+            return False
+        return head not in _backward_composers()
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from common.utils.logging import get_logger
+from .tokenizer import is_sentence_end
+
+logger = get_logger(__name__)
+
+_SAMPLE_BYTES = 1 << 20
+_memo: Dict[str, List[int]] = {}
+_memo_lock = threading.Lock()
+
+
+def model_fingerprint(path: str) -> str:
+    # Size plus the first and last MiB: cheap on multi-GB GGUF files, and
+    # the header (metadata, tokenizer) and tail differ between any two models
+    h = hashlib.sha256()
+    size = os.path.getsize(path)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(_SAMPLE_BYTES))
+        if size > _SAMPLE_BYTES:
+            f.seek(max(_SAMPLE_BYTES, size - _SAMPLE_BYTES))
+            h.update(f.read(_SAMPLE_BYTES))
+    return h.hexdigest()[:32]
+
+
+def scan_sentence_end_tokens(llama: Any) -> List[int]:
+    """Ids of every vocab token whose decoded piece ends in a sentence terminator."""
+    n_vocab = int(llama.n_vocab())
+    try:
+        eos = int(llama.token_eos())
+    except Exception:
+        eos = -1
+    ids: List[int] = []
+    for tid in range(n_vocab):
+        if tid == eos:
+            continue
+        try:
+            piece = llama.detokenize([tid])
+        except Exception:
+            continue
+        # Partial UTF-8 byte tokens decode to nothing useful; skip them
+        text = piece.decode("utf-8", errors="ignore") if isinstance(piece, bytes) else str(piece)
+        if text and is_sentence_end(text[-1]):
+            ids.append(tid)
+    return ids
+
+
+def sentence_end_token_ids(llama: Any, model_path: str, cache_dir: Optional[str]) -> Optional[List[int]]:
+    """
+    Cached ``scan_sentence_end_tokens``: memoized per process and persisted
+    under ``cache_dir`` keyed by the model fingerprint. Returns None when the
+    llama cannot enumerate its vocabulary.
+    """
+    if not (hasattr(llama, "n_vocab") and hasattr(llama, "detokenize")):
+        return None
+    try:
+        key = model_fingerprint(model_path)
+    except OSError:
+        key = None
+    if key is not None:
+        with _memo_lock:
+            if key in _memo:
+                return _memo[key]
+    path = os.path.join(cache_dir, f"{key}.sentence_end.json") if (cache_dir and key) else None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                ids = [int(t) for t in json.load(f)["ids"]]
+            with _memo_lock:
+                _memo[key] = ids  # type: ignore[index]
+            return ids
+        except Exception as e:
+            logger.warning("vocab: ignoring unreadable cache %s: %s", path, e)
+    try:
+        ids = scan_sentence_end_tokens(llama)
+    except Exception as e:
+        logger.warning("vocab: scan failed: %s", e)
+        return None
+    logger.info("vocab: %d sentence-ending tokens", len(ids))
+    if key is not None:
+        with _memo_lock:
+            _memo[key] = ids
+    if path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)  # type: ignore[arg-type]
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"model": os.path.basename(model_path), "ids": ids}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("vocab: could not write cache %s: %s", path, e)
+    return ids
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional
+
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from common import metrics
+from common.config import get_settings
+from common.utils.logging import get_logger
+from .aio import decode_executor
+from .memory import memory_report, plan_for
+from .registry import model_allowlist
+
+logger = get_logger(__name__)
+
+
+class Readiness:
+    """Startup state behind GET /ready: starting -> warming -> ready | failed."""
+
+    def __init__(self) -> None:
+        self.state = "starting"
+        self.timings: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.memory: Dict[str, Any] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+
+_states: Dict[str, Readiness] = {}
+
+
+def _run_warmup(pattern: str, readiness: Readiness, warm_up: Callable[[int], Dict[str, Any]], tokens: int) -> None:
+    readiness.state = "warming"
+    start = time.perf_counter()
+    try:
+        timings = warm_up(tokens)
+    except Exception as exc:
+        readiness.state = "failed"
+        readiness.error = str(exc)
+        logger.exception("warm-up failed for %s; models will load on first request", pattern)
+        return
+    timings["total_s"] = time.perf_counter() - start
+    readiness.timings = timings
+    readiness.state = "ready"
+    logger.info(
+        "warm-up done for %s: %s",
+        pattern,
+        ", ".join(f"{k}={v:.3f}" for k, v in timings.items() if isinstance(v, float)),
+    )
+    readiness.memory = memory_report()
+    estimated, resident = readiness.memory["estimated_bytes"], readiness.memory["resident_bytes"]
+    if estimated is not None and resident is not None:
+        logger.info("memory for %s: estimated %.0f MiB, resident %.0f MiB", pattern, estimated / 2**20, resident / 2**20)
+
+
+def install_warmup(app: FastAPI, pattern: str, warm_up: Callable[[int], Dict[str, Any]]) -> None:
+    """
+    Warm ``warm_up`` up in the background at startup and serve GET /ready.
+
+    The app starts accepting connections right away (so /health answers
+    liveness probes), while /ready returns 503 until the model is loaded
+    and, with WARMUP_TOKENS > 0, a short decode has run. WARMUP=false keeps
+    lazy loading and reports ready immediately. A MEMORY_BUDGET_MB that
+    cannot fit an allowlisted model is checked before that and fails startup.
+    """
+    readiness = Readiness()
+    _states[pattern] = readiness
+    app.state.readiness = readiness
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+        settings = get_settings()
+        if settings.memory_budget_mb > 0:
+            # Only GGUF headers are read; MemoryBudgetError aborts startup
+            for _, path in model_allowlist(settings.models, settings.model_path):
+                if os.path.exists(path):
+                    plan_for(path, settings)
+        if settings.warmup:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(
+                decode_executor(), _run_warmup, pattern, readiness, warm_up, settings.warmup_tokens
+            )
+        else:
+            readiness.state = "ready"
+        yield
+
+    app.router.lifespan_context = lifespan
+    app.include_router(router)
+
+
+router = APIRouter()
+
+
+@router.get("/ready")
+def ready(request: Request) -> JSONResponse:
+    readiness: Readiness = request.app.state.readiness
+    body: Dict[str, Any] = {"status": readiness.state}
+    if readiness.timings:
+        body["warmup"] = readiness.timings
+    if readiness.memory:
+        body["memory"] = readiness.memory
+    if readiness.error:
+        body["error"] = readiness.error
+    return JSONResponse(body, status_code=200 if readiness.ready else 503)
+
+
+def _collect() -> Iterable[metrics.Family]:
+    states = list(_states.items())
+    yield ("llama_ready", "gauge", "1 once startup warm-up finished.", [({"pattern": p}, int(r.ready)) for p, r in states])
+    yield (
+        "llama_warmup_seconds",
+        "gauge",
+        "Startup warm-up time by phase.",
+        [
+            ({"pattern": p, "phase": phase.removesuffix("_s")}, value)
+            for p, r in states
+            for phase, value in r.timings.items()
+            if phase.endswith("_s")
+        ],
+    )
+
+
+metrics.REGISTRY.register_collector(_collect)
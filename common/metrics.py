@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+# Minimal Prometheus text exposition (format 0.0.4). Engines record one
+# observe_request() per finished request; the token loop only takes a couple
+# of timestamps, so nothing here runs per token.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Sample = Tuple[str, Dict[str, str], float]
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)
+_CHAR_BUCKETS = (16, 32, 64, 128, 192, 256, 384, 512, 768, 1024, 2048)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> List[Sample]:  # pragma: no cover - abstract
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), v) for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float], labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[2] if series else 0
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        out: List[Sample] = []
+        for key, counts, total, n in items:
+            base = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                out.append((f"{self.name}_bucket", {**base, "le": _fmt_value(bound)}, cumulative))
+            out.append((f"{self.name}_sum", base, total))
+            out.append((f"{self.name}_count", base, n))
+        return out
+
+
+# A collector returns (name, type, help, [(labels, value), ...]) families,
+# computed at scrape time from live objects (pools, caches, schedulers).
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float], labelnames: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(name, help, buckets, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+        families: Dict[str, Tuple[str, str, List[Tuple[Dict[str, str], float]]]] = {}
+        for collect in collectors:
+            for name, kind, help, samples in collect():
+                families.setdefault(name, (kind, help, []))[2].extend(samples)
+        for name, (kind, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("llama_requests_total", "Completed generations.", ["pattern"])
+SECOND_PASS = REGISTRY.counter("llama_second_pass_total", "Generations that used the SECOND_PASS tail.", ["pattern"])
+EOS_SUPPRESSED = REGISTRY.counter(
+    "llama_eos_suppressed_total", "Generations that ended before min_len, with EOS still suppressed.", ["pattern"]
+)
+TRIMMED = REGISTRY.counter("llama_trimmed_total", "Generations cut back by safe_trim.", ["pattern"])
+EARLY_STOP = REGISTRY.counter("llama_early_stop_total", "Decodes stopped early, by reason.", ["pattern", "reason"])
+EARLY_STOP_TOKENS = REGISTRY.counter(
+    "llama_early_stop_saved_tokens_total", "Upper bound of decode tokens skipped by early stop.", ["pattern"]
+)
+COMPLETION_TOKENS = REGISTRY.counter("llama_completion_tokens_total", "Decoded tokens.", ["pattern"])
+SPEC_DRAFTED = REGISTRY.counter("llama_speculative_drafted_tokens_total", "Tokens proposed by the drafter.", ["pattern"])
+SPEC_ACCEPTED = REGISTRY.counter(
+    "llama_speculative_accepted_tokens_total", "Drafted tokens the model accepted.", ["pattern"]
+)
+
+QUEUE_WAIT = REGISTRY.histogram(
+    "llama_queue_wait_seconds", "Time waiting for a llama context.", _LATENCY_BUCKETS, ["pattern"]
+)
+PROMPT_EVAL = REGISTRY.histogram(
+    "llama_prompt_eval_seconds", "Prefix restore + prompt eval up to the first token.", _LATENCY_BUCKETS, ["pattern"]
+)
+TTFT = REGISTRY.histogram(
+    "llama_time_to_first_token_seconds", "Request start to the first text sent.", _LATENCY_BUCKETS, ["pattern"]
+)
+DECODE_RATE = REGISTRY.histogram(
+    "llama_decode_tokens_per_second", "Decode throughput after the first token.", _RATE_BUCKETS, ["pattern"]
+)
+LATENCY = REGISTRY.histogram(
+    "llama_request_duration_seconds", "Request start (incl. queue wait) to the final event.", _LATENCY_BUCKETS, ["pattern"]
+)
+GENERATED_CHARS = REGISTRY.histogram(
+    "llama_generated_chars", "Characters decoded per generation.", _CHAR_BUCKETS, ["pattern"]
+)
+RETURNED_CHARS = REGISTRY.histogram(
+    "llama_returned_chars", "Characters returned per generation.", _CHAR_BUCKETS, ["pattern"]
+)
+ADMISSION_WAIT = REGISTRY.histogram(
+    "llama_admission_wait_seconds", "Time queued in admission control.", _LATENCY_BUCKETS, ["priority"]
+)
+ADMISSION_SHED = REGISTRY.counter(
+    "llama_admission_shed_total", "Requests refused or dropped by admission control.", ["priority", "reason"]
+)
+
+
+def phase_timings(
+    started: float,
+    queue_wait_s: float,
+    prompt_start: float,
+    first_token: Optional[float],
+    first_text: Optional[float],
+    finished: float,
+    completion_tokens: int,
+) -> Dict[str, Optional[float]]:
+    """Per-phase timings for meta["timings"] from perf_counter() stamps."""
+    decode_s = finished - first_token if first_token is not None else 0.0
+    rate = (completion_tokens - 1) / decode_s if decode_s > 0 and completion_tokens > 1 else None
+    return {
+        "queue_wait_ms": round(queue_wait_s * 1000, 3),
+        "prompt_eval_ms": round((first_token - prompt_start) * 1000, 3) if first_token is not None else None,
+        "ttft_ms": round((first_text - started) * 1000, 3) if first_text is not None else None,
+        "decode_ms": round(decode_s * 1000, 3),
+        "total_ms": round((finished - started) * 1000, 3),
+        "decode_tokens_per_s": round(rate, 3) if rate is not None else None,
+    }
+
+
+def observe_request(pattern: str, meta: Dict[str, Any]) -> None:
+    """Record one finished generation from its meta dict."""
+    REQUESTS.inc(pattern=pattern)
+    t = meta.get("timings") or {}
+    if t.get("queue_wait_ms") is not None:
+        QUEUE_WAIT.observe(t["queue_wait_ms"] / 1000, pattern=pattern)
+    if t.get("prompt_eval_ms") is not None:
+        PROMPT_EVAL.observe(t["prompt_eval_ms"] / 1000, pattern=pattern)
+    if t.get("ttft_ms") is not None:
+        TTFT.observe(t["ttft_ms"] / 1000, pattern=pattern)
+    if t.get("decode_tokens_per_s") is not None:
+        DECODE_RATE.observe(t["decode_tokens_per_s"], pattern=pattern)
+    if t.get("total_ms") is not None:
+        LATENCY.observe(t["total_ms"] / 1000, pattern=pattern)
+    generated = int(meta.get("generated_chars") or 0)
+    returned = int(meta.get("returned_chars") or 0)
+    GENERATED_CHARS.observe(generated, pattern=pattern)
+    RETURNED_CHARS.observe(returned, pattern=pattern)
+    if meta.get("second_pass_used"):
+        SECOND_PASS.inc(pattern=pattern)
+    if generated < int(meta.get("min_len") or 0):
+        EOS_SUPPRESSED.inc(pattern=pattern)
+    if returned < generated:
+        TRIMMED.inc(pattern=pattern)
+    early = meta.get("early_stop") or {}
+    if early.get("reason"):
+        EARLY_STOP.inc(pattern=pattern, reason=early["reason"])
+        EARLY_STOP_TOKENS.inc(early.get("tokens_saved", 0), pattern=pattern)
+    tokens = (meta.get("token_budget") or {}).get("completion_tokens")
+    if tokens:
+        COMPLETION_TOKENS.inc(tokens, pattern=pattern)
+    spec = meta.get("speculative") or {}
+    if spec:
+        SPEC_DRAFTED.inc(spec.get("drafted", 0), pattern=pattern)
+        SPEC_ACCEPTED.inc(spec.get("accepted", 0), pattern=pattern)
+
+
+def register_engine(pattern: str, get_registry: Callable[[], Any], prefix_caches: Dict[str, Any]) -> None:
+    """Export an engine's registry, pool and prefix-cache counters at scrape time."""
+
+    def collect() -> Iterable[Family]:
+        registry = get_registry()
+        if registry is not None:
+            models = registry.stats()
+            pools = registry.pools()
+            yield (
+                "llama_models_resident",
+                "gauge",
+                "Models loaded by the registry.",
+                [({"pattern": pattern}, len(models))],
+            )
+            yield (
+                "llama_model_load_seconds",
+                "gauge",
+                "Load time of each resident model.",
+                [({"pattern": pattern, "model": m["name"]}, m["load_s"]) for m in models],
+            )
+            yield (
+                "llama_model_size_bytes",
+                "gauge",
+                "GGUF size of each resident model.",
+                [({"pattern": pattern, "model": m["name"]}, m["size_bytes"]) for m in models],
+            )
+            yield ("llama_model_loads_total", "counter", "Model loads.", [({"pattern": pattern}, registry.loads)])
+            yield (
+                "llama_model_evictions_total",
+                "counter",
+                "Models evicted to make room.",
+                [({"pattern": pattern}, registry.evictions)],
+            )
+            stats = [({"pattern": pattern, "model": name}, pool.stats()) for name, pool in pools.items()]
+            for metric, kind, help, field in (
+                ("llama_pool_size", "gauge", "Pool capacity.", "size"),
+                ("llama_pool_contexts", "gauge", "Contexts created.", "created"),
+                ("llama_pool_in_use", "gauge", "Contexts leased.", "in_use"),
+                ("llama_pool_queue_depth", "gauge", "Requests waiting for a context.", "queue_depth"),
+                ("llama_pool_timeouts_total", "counter", "Acquires that timed out.", "timeouts"),
+                ("llama_pool_rejected_total", "counter", "Acquires rejected by a full queue.", "rejected"),
+            ):
+                yield (metric, kind, help, [(labels, s[field]) for labels, s in stats])
+        caches = [({"pattern": pattern, "model": path}, cache) for path, cache in list(prefix_caches.items())]
+        yield ("llama_prefix_cache_hits_total", "counter", "Prefix cache hits.", [(l, c.hits) for l, c in caches])
+        yield ("llama_prefix_cache_misses_total", "counter", "Prefix cache misses.", [(l, c.misses) for l, c in caches])
+        yield (
+            "llama_prefix_cache_saved_tokens_total",
+            "counter",
+            "Prompt tokens not re-evaluated.",
+            [(l, c.tokens_saved) for l, c in caches],
+        )
+
+    REGISTRY.register_collector(collect)
+
+
+def _collect_shared() -> Iterable[Family]:
+    from common.inference.batching import _schedulers
+    from common.inference.budget import estimator
+    from common.inference import admission, response_cache, sessions
+
+    sched = []
+    for model_path, (scheduler, _llama) in list(_schedulers.items()):
+        s = scheduler.stats()
+        sched.append(({"model": model_path}, s))
+    if sched:
+        yield ("llama_batch_active", "gauge", "Sequences decoding.", [(l, s["active"]) for l, s in sched])
+        yield ("llama_batch_pending", "gauge", "Sequences waiting for a slot.", [(l, s["pending"]) for l, s in sched])
+        yield ("llama_batch_steps_total", "counter", "Batched decode steps.", [(l, s["steps"]) for l, s in sched])
+        yield (
+            "llama_batch_tokens_total",
+            "counter",
+            "Tokens decoded by the scheduler.",
+            [(l, s["tokens_decoded"]) for l, s in sched],
+        )
+    snap = estimator.snapshot()
+    yield ("llama_token_budget_wasted_tokens_total", "counter", "Decoded tokens trimmed away.", [({}, snap["wasted_tokens"])])
+    yield (
+        "llama_token_budget_exhausted_total",
+        "counter",
+        "Generations that hit max_tokens before min_len.",
+        [({}, snap["exhausted"])],
+    )
+    yield (
+        "llama_chars_per_token",
+        "gauge",
+        "Estimated chars per token.",
+        [({"model": e["model"], "language": e["language"]}, e["chars_per_token"]) for e in snap["estimates"]],
+    )
+    controller = admission._controller
+    if controller is not None:
+        st = controller.stats()
+        yield ("llama_admission_running", "gauge", "Requests holding an admission slot.", [({}, st["running"])])
+        yield (
+            "llama_admission_queue_depth",
+            "gauge",
+            "Requests waiting for admission.",
+            [({"priority": p}, n) for p, n in st["queued"].items()],
+        )
+    cache = response_cache._cache
+    if cache is not None:
+        cs = cache.stats()
+        yield ("llama_response_cache_entries", "gauge", "Responses held in memory.", [({}, cs["entries"])])
+        yield (
+            "llama_response_cache_lookups_total",
+            "counter",
+            "Response cache lookups by result.",
+            [({"result": r}, cs[k]) for r, k in (("memory", "hits"), ("disk", "disk_hits"), ("coalesced", "coalesced"), ("miss", "misses"))],
+        )
+    store = sessions._store
+    if store is not None:
+        ss = store.stats()
+        yield ("llama_sessions", "gauge", "Server-side conversations held.", [({}, ss["sessions"])])
+        yield ("llama_session_state_bytes", "gauge", "Session states held in memory.", [({}, ss["memory_bytes"])])
+        yield (
+            "llama_session_state_moves_total",
+            "counter",
+            "Session states moved out of (or back into) memory.",
+            [({"event": e}, ss[e]) for e in ("evictions", "spills", "disk_loads", "expired")],
+        )
+
+
+REGISTRY.register_collector(_collect_shared)
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -17,6 +17,15 @@ class ChatRequest(BaseModel):
     messages: list[Message]
     min_len: Optional[int] = None
     max_len: Optional[int] = None
+    stream: bool = Field(default=False, description="Stream text deltas as server-sent events")
+    seed: Optional[int] = Field(default=None, description="Sampling seed; makes the response reproducible and cacheable")
+    strategy: Optional[str] = Field(
+        default=None, description="Length-control strategy for the unified app: ignore_eos, logit_bias or logits_processor"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Id from POST /sessions; send only the new turn and the stored history is prepended",
+    )
 
 
 class ChatResponse(BaseModel):
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import re
+from typing import Iterable, Optional, Sequence
+
+from common.inference.tokenizer import StreamingCharCounter
 
 
 SENTENCE_END = re.compile(r"[。．\.!?？！]\s*$")
@@ -11,11 +14,10 @@ def safe_trim(text: str, max_len: int) -> str:
         return text
     # Prefer cutting at a sentence boundary before max_len
     snippet = text[:max_len]
-    # Find last sentence end in the snippet
-    m = list(SENTENCE_END.finditer(snippet))
+    # A sentence end can only match at the very end of the snippet
+    m = SENTENCE_END.search(snippet)
     if m:
-        end = m[-1].end()
-        return snippet[:end]
+        return snippet[: m.end()]
     # Fallback: cut at max_len and try not to cut inside whitespace
     # Trim trailing partial word/punctuation cleanly
     trimmed = snippet.rstrip()
@@ -44,3 +46,234 @@ def auto_close_pairs(text: str) -> str:
             stack.pop()
     # Append missing closers in reverse order
     return text + "".join(reversed(stack))
+
+
+def remove_phrases(text: str, phrases: Iterable[str]) -> str:
+    # Leftmost match wins, longest first; removal does not rescan the result
+    alts = sorted({p for p in phrases if p}, key=len, reverse=True)
+    if not alts:
+        return text
+    return re.sub("|".join(map(re.escape, alts)), "", text)
+
+
+class TextStage:
+    """
+    One step of a ``TextPipeline``.
+
+    ``feed`` takes the previous stage's output and returns the part that is
+    final; ``finish`` is called once the input ends and returns whatever
+    was held back (plus anything the stage appends).
+    """
+
+    def feed(self, chunk: str) -> str:
+        return chunk
+
+    def finish(self) -> str:
+        return ""
+
+
+class RemovePhrases(TextStage):
+    """Incremental ``remove_phrases``; holds back at most one phrase length."""
+
+    def __init__(self, phrases: Iterable[str]) -> None:
+        self.phrases = sorted({p for p in phrases if p}, key=len, reverse=True)
+        firsts = "".join(sorted({p[0] for p in self.phrases}))
+        self._starts = re.compile(f"[{re.escape(firsts)}]") if firsts else None
+        self._buf = ""
+        self.removed = 0
+
+    def feed(self, chunk: str) -> str:
+        if self._starts is None:
+            return chunk
+        self._buf += chunk
+        return self._scan(final=False)
+
+    def finish(self) -> str:
+        return self._scan(final=True) if self._starts is not None else ""
+
+    def _scan(self, final: bool) -> str:
+        buf, out, i = self._buf, [], 0
+        while True:
+            m = self._starts.search(buf, i)  # type: ignore[union-attr]
+            if m is None:
+                out.append(buf[i:])
+                i = len(buf)
+                break
+            j = m.start()
+            out.append(buf[i:j])
+            match: Optional[str] = None
+            for p in self.phrases:
+                if buf.startswith(p, j):
+                    match = p
+                    break
+                if not final and len(buf) - j < len(p) and p.startswith(buf[j:]):
+                    # A longer phrase may still complete here; wait for more text
+                    break
+            else:
+                out.append(buf[j])
+                i = j + 1
+                continue
+            if match is None:
+                i = j
+                break
+            self.removed += 1
+            i = j + len(match)
+        self._buf = buf[i:]
+        return "".join(out)
+
+
+class TrimToSentence(TextStage):
+    """
+    Incremental ``safe_trim``: passes text through up to ``max_len``,
+    holding back only trailing whitespace that may still be stripped.
+    """
+
+    def __init__(self, max_len: int) -> None:
+        self.max_len = max_len
+        self.size = 0
+        self._kept = 0
+        self._pending = ""
+        self.last = ""
+
+    @property
+    def saturated(self) -> bool:
+        # True once the input is long enough that safe_trim will cut it
+        return self.size > self.max_len
+
+    def feed(self, chunk: str) -> str:
+        self.size += len(chunk)
+        room = self.max_len - self._kept
+        if room <= 0 or not chunk:
+            return ""
+        part = chunk[:room]
+        self._kept += len(part)
+        self._pending += part
+        ready = self._pending.rstrip()
+        if not ready:
+            return ""
+        self._pending = self._pending[len(ready):]
+        self.last = ready[-1]
+        return ready
+
+    def finish(self) -> str:
+        out = ""
+        if self._pending and (not self.saturated or SENTENCE_END.match(self.last)):
+            out = self._pending
+        self._pending = ""
+        return out
+
+
+class ClosePairs(TextStage):
+    """Incremental ``auto_close_pairs``."""
+
+    def __init__(self) -> None:
+        self._stack: list[str] = []
+        self._closers = set(PAIRS.values())
+
+    def feed(self, chunk: str) -> str:
+        stack = self._stack
+        for ch in chunk:
+            if ch in PAIRS:
+                stack.append(PAIRS[ch])
+            elif ch in self._closers and stack and ch == stack[-1]:
+                stack.pop()
+        return chunk
+
+    def finish(self) -> str:
+        closing = "".join(reversed(self._stack))
+        self._stack = []
+        return closing
+
+
+class CountChars(TextStage):
+    """Pass-through keeping ``count_chars`` of everything that went by."""
+
+    def __init__(self) -> None:
+        self._counter = StreamingCharCounter()
+
+    @property
+    def count(self) -> int:
+        return self._counter.count
+
+    def feed(self, chunk: str) -> str:
+        self._counter.feed(chunk)
+        return chunk
+
+
+class TextPipeline:
+    """
+    Post-processing as a chain of ``TextStage``s, run over each delta as it
+    is decoded, so the text is scanned once however many stages there are.
+    ``text`` is the output so far; after ``finish`` it is the final text.
+    """
+
+    def __init__(self, stages: Sequence[TextStage]) -> None:
+        self.stages = list(stages)
+        self._out: list[str] = []
+        self._finished = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._out)
+
+    def feed(self, delta: str) -> str:
+        for st in self.stages:
+            if not delta:
+                return ""
+            delta = st.feed(delta)
+        if delta:
+            self._out.append(delta)
+        return delta
+
+    def finish(self) -> str:
+        if self._finished:
+            return ""
+        self._finished = True
+        out = ""
+        for st in self.stages:
+            out = (st.feed(out) if out else "") + st.finish()
+        if out:
+            self._out.append(out)
+        return out
+
+    def run(self, text: str) -> str:
+        # Whole-text convenience: same result as feeding it in any split
+        self.feed(text)
+        self.finish()
+        return self.text
+
+
+class StreamingSanitizer(TextPipeline):
+    """
+    Incremental ``auto_close_pairs(safe_trim(remove_phrases(text, banned), max_len))``
+    that also counts the returned chars (``chars``, equal to ``count_chars``
+    of the final text).
+
+    ``feed`` returns the part of each delta that is already final, holding
+    back only trailing whitespace that ``safe_trim`` might still strip (and
+    a possible banned-phrase prefix). ``finish`` returns the remainder plus
+    any missing closers. ``extra`` stages run first, on the raw text.
+    """
+
+    def __init__(self, max_len: int, banned: Iterable[str] = (), extra: Sequence[TextStage] = ()) -> None:
+        stages: list[TextStage] = list(extra)
+        phrases = [p for p in banned if p]
+        if phrases:
+            stages.append(RemovePhrases(phrases))
+        self._trim = TrimToSentence(max_len)
+        self._count = CountChars()
+        super().__init__(stages + [self._trim, ClosePairs(), self._count])
+        self.max_len = max_len
+
+    @property
+    def saturated(self) -> bool:
+        return self._trim.saturated
+
+    @property
+    def at_sentence_end(self) -> bool:
+        # Kept text ends in a terminator plus optional whitespace (SENTENCE_END)
+        return bool(self._trim.last) and SENTENCE_END.match(self._trim.last) is not None
+
+    @property
+    def chars(self) -> int:
+        return self._count.count
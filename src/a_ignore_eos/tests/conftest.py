@@ -2,6 +2,8 @@ import os
 import types
 import pytest
 
+from common.config import reload_settings
+
 
 @pytest.fixture(autouse=True)
 def set_env_defaults(monkeypatch):
@@ -10,6 +12,8 @@ def set_env_defaults(monkeypatch):
     monkeypatch.setenv("MAX_LEN", "64")
     # Disable second pass by default in tests
     monkeypatch.setenv("SECOND_PASS", "false")
+    # settings are cached; pick up the env above
+    reload_settings()
 
 
 class DummyLlama:
@@ -33,8 +37,10 @@ class DummyLlama:
 @pytest.fixture
 def patch_llama(monkeypatch):
     dummy = DummyLlama()
-    def fake_ensure_llama(model_path=None):
+    def fake_create_llama(model_path=None):
         return dummy
-    monkeypatch.setattr("src.a_ignore_eos.app.engine._ensure_llama", fake_ensure_llama)
+    monkeypatch.setattr("src.a_ignore_eos.app.engine.engine.load_llama", fake_create_llama)
+    # start every test with a fresh registry (and pool) built from the dummy
+    monkeypatch.setattr("src.a_ignore_eos.app.engine.engine._registry", None)
     return dummy
 
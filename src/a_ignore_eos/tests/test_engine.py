@@ -10,3 +10,108 @@ def test_generate_respects_min_and_max(patch_llama):
     assert meta["returned_chars"] <= 20
     assert meta["strategy"] == "ignore_eos"
 
+
+
+def test_generate_stream_deltas_match_final_text(patch_llama):
+    from src.a_ignore_eos.app.engine import generate_stream
+
+    messages = [{"role": "user", "content": "hello"}]
+    events = list(generate_stream(messages, min_len=16, max_len=20))
+    deltas = [ev["text"] for ev in events if ev["event"] == "delta"]
+    done = events[-1]
+    assert done["event"] == "done"
+    assert "".join(deltas) == done["text"]
+    assert done["meta"]["returned_chars"] <= 20
+
+
+def test_second_pass_continues_in_a_single_decode(patch_llama, monkeypatch):
+    from src.a_ignore_eos.app.engine import generate
+
+    from common.config import reload_settings
+
+    monkeypatch.setenv("SECOND_PASS", "true")
+    reload_settings()
+    calls = []
+
+    def create_completion(prompt, max_tokens, temperature, top_p, logits_processor=None, stream=False):
+        calls.append(logits_processor)
+        return patch_llama._stream_gen("A" * 40 + "。")
+
+    monkeypatch.setattr(patch_llama, "create_completion", create_completion)
+    out = generate([{"role": "user", "content": "hello"}], min_len=16, max_len=64)
+    assert len(calls) == 1 and calls[0]
+    assert out["meta"]["second_pass_used"] is True
+    assert out["meta"]["prompt_eval_tokens"]["second_pass"] == 0
+    assert out["text"] == "A" * 40 + "。"
+
+
+def test_ready_flips_after_startup_warmup(patch_llama, monkeypatch):
+    import time
+
+    from fastapi.testclient import TestClient
+
+    from src.a_ignore_eos.app.main import create_app
+
+    calls = []
+    orig = patch_llama.create_completion
+    monkeypatch.setattr(patch_llama, "create_completion", lambda *a, **kw: calls.append(kw["max_tokens"]) or orig(*a, **kw))
+    app = create_app()
+    assert TestClient(app).get("/ready").status_code == 503  # lifespan not started
+    with TestClient(app) as client:
+        for _ in range(100):
+            resp = client.get("/ready")
+            if resp.status_code == 200:
+                break
+            time.sleep(0.01)
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["status"] == "ready"
+        assert {"load_s", "decode_s", "total_s"} <= set(body["warmup"])
+        assert calls == [8]
+        assert 'llama_warmup_seconds{pattern="ignore_eos",phase="load"}' in client.get("/metrics").text
+
+
+def test_admission_sheds_with_retry_after(patch_llama, monkeypatch):
+    import asyncio
+
+    from fastapi.testclient import TestClient
+
+    from common.config import reload_settings
+    from common.inference.admission import admission_controller
+    from src.a_ignore_eos.app.main import create_app
+
+    monkeypatch.setenv("ADMISSION", "true")
+    monkeypatch.setenv("ADMISSION_CONCURRENCY", "1")
+    monkeypatch.setenv("ADMISSION_MAX_QUEUE", "0")
+    reload_settings()
+    client = TestClient(create_app())
+    body = {"messages": [{"role": "user", "content": "hello"}]}
+    assert client.post("/chat", json=body, headers={"X-Priority": "interactive"}).status_code == 200
+
+    holder = asyncio.run(admission_controller().admit("interactive", 10))
+    resp = client.post("/chat", json=body)
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+    holder.release()
+    assert client.post("/chat", json=body).status_code == 200
+    # No X-Priority: the least urgent class
+    assert 'llama_admission_shed_total{priority="batch",reason="queue_full"} 1' in client.get("/metrics").text
+
+
+def test_request_max_len_is_clamped_and_used_as_admission_cost(patch_llama, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from common.inference import chat
+    from src.a_ignore_eos.app.main import create_app
+
+    costs = []
+    orig = chat.admit
+    monkeypatch.setattr(chat, "admit", lambda headers, cost: costs.append(cost) or orig(headers, cost))
+    client = TestClient(create_app())
+    for max_len in (20, 1, 10_000, None):
+        body = {"messages": [{"role": "user", "content": "hello"}], "max_len": max_len}
+        resp = client.post("/chat", json=body)
+        assert resp.status_code == 200
+        assert resp.json()["meta"]["returned_chars"] <= costs[-1]
+    # MIN_LEN=16, MAX_LEN=64 in these tests
+    assert costs == [20, 16, 64, 64]
@@ -1,6 +1,8 @@
 import os
 import pytest
 
+from common.config import reload_settings
+
 
 @pytest.fixture(autouse=True)
 def set_env_defaults(monkeypatch):
@@ -9,6 +11,8 @@ def set_env_defaults(monkeypatch):
     monkeypatch.setenv("MAX_LEN", "64")
     monkeypatch.setenv("EOS_BIAS", "-10.0")
     monkeypatch.setenv("SECOND_PASS", "false")
+    # settings are cached; pick up the env above
+    reload_settings()
 
 
 class DummyLlama:
@@ -23,7 +27,7 @@ class DummyLlama:
         for i in range(0, len(text), step):
             yield {"choices": [{"text": text[i:i+step]}]}
 
-    def create_completion(self, prompt, max_tokens, temperature, top_p, logit_bias=None, stream=False):
+    def create_completion(self, prompt, max_tokens, temperature, top_p, logit_bias=None, stream=False, seed=None):
         full = "B" * 40 + "."
         if stream:
             return self._stream_gen(full)
@@ -34,12 +38,11 @@ class DummyLlama:
 def patch_llama(monkeypatch):
     dummy = DummyLlama()
 
-    def fake_ensure_llama(model_path=None):
+    def fake_create_llama(model_path=None):
         return dummy
 
-    # patch ensure
-    monkeypatch.setattr("src.b_logit_bias.app.engine._ensure_llama", fake_ensure_llama)
-    # ensure eos id on import path
-    monkeypatch.setattr("src.b_logit_bias.app.engine._eos_id", 2, raising=False)
+    monkeypatch.setattr("src.b_logit_bias.app.engine.engine.load_llama", fake_create_llama)
+    # start every test with a fresh registry (and pool) built from the dummy
+    monkeypatch.setattr("src.b_logit_bias.app.engine.engine._registry", None)
     return dummy
 
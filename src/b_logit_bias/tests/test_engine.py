@@ -1,3 +1,4 @@
+from common.config import reload_settings
 from src.b_logit_bias.app.engine import generate
 
 
@@ -9,3 +10,44 @@ def test_generate_meta_and_trim(patch_llama):
     assert meta["strategy"] == "logit_bias"
     assert meta["returned_chars"] <= 20
 
+
+
+def test_metrics_endpoint_reports_generation(patch_llama):
+    from fastapi.testclient import TestClient
+    from src.b_logit_bias.app.main import create_app
+
+    client = TestClient(create_app())
+    assert client.post("/chat", json={"messages": [{"role": "user", "content": "hello"}]}).status_code == 200
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    body = resp.text
+    assert 'llama_requests_total{pattern="logit_bias"}' in body
+    assert 'llama_request_duration_seconds_count{pattern="logit_bias"}' in body
+    assert 'llama_pool_size{pattern="logit_bias",model="default"} 1' in body
+    assert 'llama_models_resident{pattern="logit_bias"} 1' in body
+
+
+def test_response_cache_serves_deterministic_repeats(patch_llama, monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE", "true")
+    monkeypatch.setenv("TEMPERATURE", "0.7")
+    reload_settings()
+    calls = []
+    original = patch_llama.create_completion
+
+    def counting(**kwargs):
+        calls.append(kwargs.get("seed"))
+        return original(**kwargs)
+
+    monkeypatch.setattr(patch_llama, "create_completion", counting)
+    messages = [{"role": "user", "content": "hello"}]
+    first = generate(messages, min_len=16, max_len=20, seed=7)
+    again = generate(messages, min_len=16, max_len=20, seed=7)
+    assert calls == [7]
+    assert first["meta"]["cache"] == {"hit": False}
+    assert again["meta"]["cache"] == {"hit": True, "source": "memory"}
+    assert again["text"] == first["text"]
+    # Sampling without a seed is not reproducible, so it always decodes
+    generate(messages, min_len=16, max_len=20)
+    generate(messages, min_len=16, max_len=20)
+    assert calls == [7, None, None]
@@ -1,5 +1,11 @@
 from fastapi import FastAPI
 
+from common.config import install_reload_signal
+from common.inference.sessions import router as sessions_router
+from common.inference.warmup import install_warmup
+from common.metrics import router as metrics_router
+
+from .engine import warm_up
 from .routers.chat import router as chat_router
 
 
@@ -11,6 +17,10 @@ def create_app() -> FastAPI:
         return {"status": "ok"}
 
     app.include_router(chat_router)
+    app.include_router(metrics_router)
+    app.include_router(sessions_router)
+    install_warmup(app, "logits_processor", warm_up)
+    install_reload_signal()
     return app
 
 
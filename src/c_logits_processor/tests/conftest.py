@@ -2,12 +2,16 @@ import os
 import types
 import pytest
 
+from common.config import reload_settings
+
 
 @pytest.fixture(autouse=True)
 def set_env_defaults(monkeypatch):
     monkeypatch.setenv("MODEL_PATH", os.getenv("MODEL_PATH", "model.gguf"))
     monkeypatch.setenv("MIN_LEN", "16")
     monkeypatch.setenv("MAX_LEN", "64")
+    # settings are cached; pick up the env above
+    reload_settings()
 
 
 class DummyLlama:
@@ -18,9 +22,16 @@ class DummyLlama:
         # Fake token ids: map char to ord modulo a small range
         return [min(255, ord(s[0]))] if s else []
 
-    def create_completion(self, prompt, max_tokens, temperature, top_p, logits_processor, stream=False):
+    def _stream_gen(self, text: str):
+        step = 8
+        for i in range(0, len(text), step):
+            yield {"choices": [{"text": text[i:i+step]}]}
+
+    def create_completion(self, prompt, max_tokens, temperature, top_p, logits_processor=None, stream=False):
         # Return a deterministic string of a certain length
         text = "A" * 40 + "。"
+        if stream:
+            return self._stream_gen(text)
         return {"choices": [{"text": text}], "usage": {"prompt_tokens": 0, "completion_tokens": len(text)}}
 
     def token_eos(self):
@@ -30,10 +41,9 @@ class DummyLlama:
 @pytest.fixture
 def patch_llama(monkeypatch):
     dummy = DummyLlama()
-    def fake_ensure_llama(model_path=None):
+    def fake_create_llama(model_path=None):
         return dummy
-    monkeypatch.setattr(
-        "src.c_logits_processor.app.engine._ensure_llama",
-        fake_ensure_llama,
-    )
+    monkeypatch.setattr("src.c_logits_processor.app.engine.engine.load_llama", fake_create_llama)
+    # start every test with a fresh registry (and pool) built from the dummy
+    monkeypatch.setattr("src.c_logits_processor.app.engine.engine._registry", None)
     return dummy
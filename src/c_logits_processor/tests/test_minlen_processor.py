@@ -5,7 +5,7 @@ def test_minlen_processor_suppresses_eos():
     proc = MinCharLengthProcessor(eos_token_id=5, min_len=10)
     # Before reaching min, EOS should be -inf
     logits = [0.0] * 10
-    logits = proc(logits, [])
+    logits = proc([], logits)
     assert logits[5] == float('-inf')
 
 
@@ -13,14 +13,41 @@ def test_minlen_processor_releases_after_threshold():
     proc = MinCharLengthProcessor(eos_token_id=5, min_len=3, punctuation_token_ids=[7], punctuation_bias=0.5)
     proc.update_char_count("abc")
     logits = [0.0] * 10
-    logits = proc(logits, [])
+    logits = proc([], logits)
     assert logits[5] != float('-inf')
     assert logits[7] > 0.0
 
 
+def test_fused_processor_combines_rules():
+    import numpy as np
+    from src.c_logits_processor.app.processors import FusedLogitsProcessor, TokenRule, ban_tokens
+
+    gate = {"on": False}
+    proc = FusedLogitsProcessor([
+        TokenRule([1, 2], 1.0),
+        TokenRule([2, 3, 99], 0.5, when=lambda: gate["on"]),
+        ban_tokens([4]),
+    ])
+    logits = proc([], np.zeros(8, dtype=np.float32))
+    assert logits.tolist()[:5] == [0.0, 1.0, 1.0, 0.0, float('-inf')]
+    gate["on"] = True
+    logits = proc([], np.zeros(8, dtype=np.float32))
+    assert logits.tolist()[:5] == [0.0, 1.0, 1.5, 0.5, float('-inf')]
+
+
 def test_engine_generate_uses_trim_and_meta(patch_llama):
     from src.c_logits_processor.app.engine import generate
     messages = [{"role": "user", "content": "hello"}]
     result = generate(messages, min_len=16, max_len=20)
     assert "text" in result and "meta" in result
     assert result["meta"]["returned_chars"] <= 20
+
+
+def test_engine_stops_decoding_past_max_len(patch_llama):
+    from src.c_logits_processor.app.engine import generate
+    messages = [{"role": "user", "content": "hello"}]
+    result = generate(messages, min_len=8, max_len=20)
+    # Dummy streams 8-char chunks; the third one pushes past max_len
+    assert result["meta"]["early_stop"]["reason"] == "max_len"
+    assert result["meta"]["generated_chars"] == 24
+    assert result["text"] == "A" * 20
@@ -0,0 +1,12 @@
+from __future__ import annotations
+
+from common.inference.engine import Engine
+
+# Unified app: the shared engine with the strategy chosen per request
+engine = Engine("unified")
+
+generate = engine.generate
+generate_stream = engine.generate_stream
+agenerate = engine.agenerate
+agenerate_stream = engine.agenerate_stream
+warm_up = engine.warm_up
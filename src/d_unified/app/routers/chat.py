@@ -0,0 +1,6 @@
+from __future__ import annotations
+
+from common.inference.chat import chat_router
+from ..engine import engine
+
+router = chat_router(engine)
@@ -0,0 +1,56 @@
+import os
+import pytest
+
+from common.config import reload_settings
+
+
+@pytest.fixture(autouse=True)
+def set_env_defaults(monkeypatch):
+    monkeypatch.setenv("MODEL_PATH", os.getenv("MODEL_PATH", "model.gguf"))
+    monkeypatch.setenv("MIN_LEN", "16")
+    monkeypatch.setenv("MAX_LEN", "64")
+    monkeypatch.setenv("SECOND_PASS", "false")
+    # settings are cached; pick up the env above
+    reload_settings()
+
+
+class DummyLlama:
+    def __init__(self):
+        self.model_path = "dummy"
+        self.calls = []
+        self.prompts = []
+
+    def token_eos(self):
+        return 2
+
+    def tokenize(self, s, add_bos=False, special=False):
+        return [min(255, ord(s[0]))] if s else []
+
+    def _stream_gen(self, text: str):
+        step = 8
+        for i in range(0, len(text), step):
+            yield {"choices": [{"text": text[i:i+step]}]}
+
+    def create_completion(self, prompt, max_tokens, temperature, top_p, stream=False, **kwargs):
+        self.calls.append(kwargs)
+        self.prompts.append(prompt)
+        text = "D" * 40 + "。"
+        if stream:
+            return self._stream_gen(text)
+        return {"choices": [{"text": text}], "usage": {}}
+
+
+@pytest.fixture
+def patch_llama(monkeypatch):
+    dummy = DummyLlama()
+    loads = []
+
+    def fake_create_llama(model_path=None):
+        loads.append(model_path)
+        return dummy
+
+    monkeypatch.setattr("src.d_unified.app.engine.engine.load_llama", fake_create_llama)
+    # start every test with a fresh registry (and pool) built from the dummy
+    monkeypatch.setattr("src.d_unified.app.engine.engine._registry", None)
+    dummy.loads = loads
+    return dummy
@@ -0,0 +1,66 @@
+import pytest
+
+from src.d_unified.app.engine import generate
+from common.inference.strategies import UnknownStrategy
+
+
+def test_one_model_serves_every_strategy(patch_llama):
+    messages = [{"role": "user", "content": "hello"}]
+    metas = {s: generate(messages, min_len=16, max_len=20, strategy=s)["meta"] for s in ("ignore_eos", "logit_bias", "logits_processor")}
+    assert len(patch_llama.loads) == 1
+    assert {s: m["strategy"] for s, m in metas.items()} == {s: s for s in metas}
+    assert all(m["returned_chars"] <= 20 for m in metas.values())
+
+    ignore, bias, proc = patch_llama.calls
+    assert ignore.get("ignore_eos") is True
+    assert bias["logit_bias"] == {2: -10.0} and metas["logit_bias"]["eos_bias"] == -10.0
+    assert type(proc["logits_processor"][0]).__name__ == "MinCharLengthProcessor"
+    assert "eos_suppressed" in metas["logits_processor"]
+
+
+def test_default_and_unknown_strategy(patch_llama, monkeypatch):
+    from common.config import reload_settings
+
+    monkeypatch.setenv("DEFAULT_STRATEGY", "logit_bias")
+    reload_settings()
+    out = generate([{"role": "user", "content": "hello"}], min_len=16, max_len=20)
+    assert out["meta"]["strategy"] == "logit_bias"
+    with pytest.raises(UnknownStrategy):
+        generate([{"role": "user", "content": "hello"}], strategy="nope")
+
+
+def test_chat_route_selects_strategy(patch_llama):
+    from fastapi.testclient import TestClient
+
+    from src.d_unified.app.main import create_app
+
+    client = TestClient(create_app())
+    body = {"messages": [{"role": "user", "content": "hello"}], "strategy": "ignore_eos"}
+    resp = client.post("/chat", json=body)
+    assert resp.status_code == 200
+    assert resp.json()["meta"]["strategy"] == "ignore_eos"
+    assert client.post("/chat", json={**body, "strategy": "nope"}).status_code == 400
+
+
+def test_session_carries_history_between_turns(patch_llama, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src.d_unified.app.main import create_app
+
+    monkeypatch.setattr("common.inference.sessions._store", None)
+    client = TestClient(create_app())
+    # Only ids the server issued are accepted
+    unknown = client.post("/chat", json={"messages": [{"role": "user", "content": "hi"}], "session_id": "s1"})
+    assert unknown.status_code == 404
+    sid = client.post("/sessions").json()["id"]
+
+    first = client.post("/chat", json={"messages": [{"role": "user", "content": "first"}], "session_id": sid})
+    assert first.json()["meta"]["session"]["turns"] == 1
+    second = client.post("/chat", json={"messages": [{"role": "user", "content": "second"}], "session_id": sid})
+    assert second.json()["meta"]["session"]["turns"] == 2
+    prompt = patch_llama.prompts[-1]
+    assert prompt.index("first") < prompt.index(first.json()["text"]) < prompt.index("second")
+
+    assert client.get(f"/sessions/{sid}").json()["turns"] == 2
+    assert client.delete(f"/sessions/{sid}").status_code == 204
+    assert client.get(f"/sessions/{sid}").status_code == 404
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from common.config import reload_settings
+from common.inference.admission import AdmissionController, AdmissionRejected, request_priority
+
+CLASSES = [("interactive", 5.0), ("batch", 5.0)]
+
+
+def test_priority_then_shortest_job_first():
+    async def scenario():
+        ctl = AdmissionController(capacity=1, max_queue=8, classes=CLASSES)
+        holder = await ctl.admit("interactive", 10)
+        order = []
+
+        async def request(priority, cost):
+            ticket = await ctl.admit(priority, cost)
+            order.append((priority, cost))
+            ticket.release()
+
+        tasks = [
+            asyncio.create_task(request("batch", 10)),
+            asyncio.create_task(request("interactive", 200)),
+            asyncio.create_task(request("interactive", 50)),
+        ]
+        await asyncio.sleep(0.01)
+        assert ctl.stats()["queued"] == {"interactive": 2, "batch": 1}
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order, ctl.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == [("interactive", 50), ("interactive", 200), ("batch", 10)]
+    assert stats["running"] == 0 and stats["admitted"] == {"interactive": 3, "batch": 1}
+
+
+def test_full_queue_and_expected_wait_are_refused_with_429():
+    async def scenario():
+        ctl = AdmissionController(capacity=1, max_queue=1, classes=[("interactive", 1.0)])
+        holder = await ctl.admit("interactive", 10)
+        ctl._s_per_cost = 1.0  # one second per max_len char
+        waiter = asyncio.create_task(ctl.admit("interactive", 10))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as full:
+            await ctl.admit("interactive", 10)
+        holder.release()
+        (await waiter).release()
+
+        holder = await ctl.admit("interactive", 10)
+        ctl.max_queue = 8
+        queued = asyncio.create_task(ctl.admit("interactive", 5))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as slow:
+            await ctl.admit("interactive", 10)  # 5 s of work ahead vs a 1 s deadline
+        holder.release()
+        (await queued).release()
+        return full.value, slow.value, ctl.stats()
+
+    full, slow, stats = asyncio.run(scenario())
+    assert full.status == 429 and slow.status == 429
+    assert slow.retry_after >= 1
+    assert stats["shed"] == {("interactive", "queue_full"): 1, ("interactive", "expected_wait"): 1}
+
+
+def test_deadline_in_queue_sheds_with_503():
+    async def scenario():
+        ctl = AdmissionController(capacity=1, max_queue=4, classes=[("interactive", 0.05)])
+        holder = await ctl.admit("interactive", 10)
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctl.admit("interactive", 10)
+        holder.release()
+        return exc.value, ctl.stats()
+
+    exc, stats = asyncio.run(scenario())
+    assert exc.status == 503
+    assert stats["queued"] == {"interactive": 0} and stats["running"] == 0
+
+
+def test_priority_from_api_key_or_header(monkeypatch):
+    monkeypatch.setenv("ADMISSION_CLASSES", "interactive=10,batch=120")
+    monkeypatch.setenv("ADMISSION_API_KEYS", "k-batch=batch,k-live=interactive")
+    settings = reload_settings()
+    # Unidentified requests get the least urgent class
+    assert request_priority({}, settings) == "batch"
+    assert request_priority({"x-priority": "Interactive"}, settings) == "interactive"
+    assert request_priority({"x-priority": "vip"}, settings) == "batch"
+    assert request_priority({"authorization": "Bearer k-batch", "x-priority": "interactive"}, settings) == "batch"
+    assert request_priority({"x-api-key": "k-batch"}, settings) == "batch"
+    assert request_priority({"x-api-key": "k-live"}, settings) == "interactive"
+
+
+def test_unknown_classes_fall_back_to_the_least_urgent(monkeypatch):
+    monkeypatch.setenv("ADMISSION_CLASSES", "interactive=10,batch=120")
+    monkeypatch.setenv("ADMISSION_DEFAULT_CLASS", "interactve")
+    monkeypatch.setenv("ADMISSION_API_KEYS", "k-typo=vip,k-live=interactive")
+    settings = reload_settings()
+    assert settings.admission_default_class == ""
+    assert settings.admission_api_keys == (("k-live", "interactive"),)
+    assert request_priority({}, settings) == "batch"
+    assert request_priority({"x-api-key": "k-typo"}, settings) == "batch"
+
+    async def scenario():
+        ctl = AdmissionController(capacity=1, max_queue=8, classes=CLASSES)
+        (await ctl.admit("vip", 10)).release()
+        return ctl.stats()["admitted"]
+
+    assert asyncio.run(scenario()) == {"interactive": 0, "batch": 1}
+    monkeypatch.undo()
+    reload_settings()
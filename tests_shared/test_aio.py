@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.config import reload_settings
+from common.inference import aio
+from common.inference.aio import ClientDisconnected, acollect_result, aiter_events, cancel_on_disconnect, run_acquire
+from common.inference.pool import LlamaPool, PoolTimeout, release_when_done
+
+
+def _slow_events(n, closed, delay=0.01):
+    try:
+        for i in range(n):
+            time.sleep(delay)
+            yield {"event": "delta", "text": str(i)}
+        yield {"event": "done", "text": "", "meta": {"n": n}}
+    finally:
+        closed.set()
+
+
+def test_aiter_events_runs_off_loop_and_collects():
+    closed = threading.Event()
+
+    async def main():
+        return await acollect_result(aiter_events(_slow_events(3, closed)))
+
+    assert asyncio.run(main()) == {"text": "", "meta": {"n": 3}}
+    assert closed.wait(1)
+
+
+def test_abandoned_consumer_stops_the_worker():
+    closed = threading.Event()
+
+    async def main():
+        events = aiter_events(_slow_events(10_000, closed))
+        async for _ in events:
+            break
+        await events.aclose()
+
+    asyncio.run(main())
+    # The worker notices at its next event and closes the source iterator
+    assert closed.wait(1)
+
+
+def test_worker_errors_reach_the_consumer():
+    def failing():
+        yield {"event": "delta", "text": "x"}
+        raise RuntimeError("boom")
+
+    async def main():
+        return [ev async for ev in aiter_events(failing())]
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(main())
+
+
+def test_cancel_on_disconnect_cancels_the_generation():
+    cancelled = []
+
+    async def generation():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def gone():
+        return True
+
+    async def main():
+        await cancel_on_disconnect(generation(), gone, poll_s=0.01)
+
+    with pytest.raises(ClientDisconnected):
+        asyncio.run(main())
+    assert cancelled
+
+
+def test_full_wait_queue_does_not_starve_the_lease_holder(monkeypatch):
+    # One decode thread, and more waiters than that queued on the pool
+    monkeypatch.setenv("DECODE_WORKERS", "1")
+    monkeypatch.setenv("POOL_SIZE", "1")
+    monkeypatch.setenv("POOL_MAX_QUEUE", "3")
+    reload_settings()
+    monkeypatch.setattr(aio, "_executor", None)
+    monkeypatch.setattr(aio, "_acquire_executor", None)
+    pool = LlamaPool(factory=object, size=1, max_queue=3, timeout=3)
+    closed = threading.Event()
+
+    def start_stream():
+        return release_when_done(pool.acquire(), _slow_events(5, closed))
+
+    async def main():
+        holder = await run_acquire(start_stream)
+        waiters = [asyncio.ensure_future(run_acquire(pool.acquire)) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        assert pool.stats()["queue_depth"] == 3
+        # The holder's events need the only decode thread
+        result = await asyncio.wait_for(acollect_result(aiter_events(holder)), 0.5)
+        for waiter in waiters:
+            (await asyncio.wait_for(waiter, 2)).release()
+        return result
+
+    assert asyncio.run(main()) == {"text": "", "meta": {"n": 5}}
+
+
+def test_cancelled_setup_closes_what_it_returns():
+    gate = threading.Event()
+    closed = threading.Event()
+
+    class Stream:
+        def close(self):
+            closed.set()
+
+    def setup():
+        gate.wait(1)  # e.g. queued for a pool context
+        return Stream()
+
+    async def main():
+        task = asyncio.ensure_future(run_acquire(setup))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        gate.set()
+
+    asyncio.run(main())
+    assert closed.wait(1)
+
+
+def test_unstarted_stream_is_released_by_aclose_not_by_the_gc():
+    import gc
+
+    pool = LlamaPool(lambda: object(), size=1, timeout=0.05)
+
+    def events():
+        yield {"event": "done", "text": "", "meta": {}}
+
+    # Closing an async stream that was never iterated returns its context
+    stream = aiter_events(release_when_done(pool.acquire(), events()))
+    asyncio.run(stream.aclose())
+    pool.acquire().release()
+
+    # Dropping one without closing leaks it (finalizers must not take locks)
+    lease = pool.acquire()
+    del lease
+    gc.collect()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
@@ -0,0 +1,80 @@
+from common import autotune, config
+from common.config import reload_settings
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeLlama:
+    # Prompt eval scales with threads; flash attention speeds up decode and
+    # a q8_0 KV cache (type 8) a little more
+    def __init__(self, clock, model_path, n_threads, flash_attn, type_k, **kwargs):
+        self.clock = clock
+        self.prompt_tps = 100.0 * n_threads
+        self.decode_tps = 10.0 * (2 if flash_attn else 1) * (1.1 if type_k == 8 else 1)
+
+    def tokenize(self, text, special=False):
+        return list(text[:200])
+
+    def reset(self):
+        pass
+
+    def generate(self, tokens, temp, reset):
+        self.clock.now += len(tokens) / self.prompt_tps
+        while True:
+            yield 0
+            self.clock.now += 1 / self.decode_tps
+
+
+def test_autotune_writes_fastest_profile_that_settings_load(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(autotune.time, "perf_counter", clock)
+    out = tmp_path / "host.env"
+    argv = ["--threads", "2,4", "--batch", "512", "--ubatch", "512", "--flash-attn", "off,on", "--kv", "f16,q8_0", "-o", str(out)]
+    assert autotune.main(argv, factory=lambda **kw: FakeLlama(clock, **kw)) == 0
+
+    text = out.read_text()
+    assert "N_THREADS=4" in text and "FLASH_ATTN=true" in text and "TYPE_K=q8_0" in text
+
+    monkeypatch.setenv("TUNED_PROFILE", str(out))
+    settings = reload_settings()
+    assert (settings.n_threads, settings.flash_attn, settings.type_v) == (4, True, "q8_0")
+    assert settings.tuned_profile == str(out)
+    # Env vars still win over the profile
+    monkeypatch.setenv("N_THREADS", "3")
+    assert reload_settings().n_threads == 3
+    monkeypatch.undo()
+    reload_settings()
+
+
+def test_float_knobs_are_read_from_the_profile_too(tmp_path, monkeypatch):
+    out = tmp_path / "host.env"
+    out.write_text("TEMPERATURE=0.2\nMIN_P=0.1\n")
+    # No float knob is tuned today; one added to TUNED_KEYS must still be picked up
+    monkeypatch.setattr(config, "TUNED_KEYS", config.TUNED_KEYS + ("TEMPERATURE", "MIN_P"))
+    monkeypatch.delenv("TEMPERATURE", raising=False)
+    monkeypatch.delenv("MIN_P", raising=False)
+    monkeypatch.setenv("TUNED_PROFILE", str(out))
+    settings = reload_settings()
+    assert (settings.temperature, settings.min_p) == (0.2, 0.1)
+    monkeypatch.setenv("TEMPERATURE", "0.5")
+    assert reload_settings().temperature == 0.5
+    monkeypatch.undo()
+    reload_settings()
+
+
+def test_candidates_skip_quantized_v_without_flash_attention():
+    args = autotune.argparse.Namespace(
+        threads="2", batch="256,512", ubatch="512", flash_attn="off,on", kv="f16,q8_0", mmap="on", mlock="off"
+    )
+    profiles = autotune.candidates(args)
+    # ubatch > batch is skipped, q8_0 only with flash attention
+    assert [(p["N_BATCH"], p["FLASH_ATTN"], p["TYPE_V"]) for p in profiles] == [
+        ("512", "false", "f16"),
+        ("512", "true", "f16"),
+        ("512", "true", "q8_0"),
+    ]
@@ -0,0 +1,54 @@
+import io
+import json
+
+from common.batch import load_checkpoint, run_batch
+
+
+class EchoLlama:
+    model_path = "echo"
+
+    def token_eos(self):
+        return 2
+
+    def tokenize(self, s, add_bos=False, special=False):
+        return [1]
+
+    def create_completion(self, prompt, max_tokens, stream=False, **kwargs):
+        text = "はい。" * 20
+        return iter([{"choices": [{"text": text[i:i + 2]}]} for i in range(0, len(text), 2)])
+
+
+def _write_lines(path, records):
+    path.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), encoding="utf-8")
+
+
+def test_batch_runs_inline_and_resumes(tmp_path, monkeypatch):
+    monkeypatch.setenv("SYSTEM_PROMPT_FILE", "prompts/system_prompt.md")
+    monkeypatch.setattr("src.c_logits_processor.app.engine.engine.load_llama", lambda model_path=None: EchoLlama())
+    monkeypatch.setattr("src.c_logits_processor.app.engine.engine._registry", None)
+    src = tmp_path / "in.jsonl"
+    out = tmp_path / "out.jsonl"
+    _write_lines(src, [
+        {"id": "a", "messages": [{"role": "user", "content": "こんにちは"}], "min_len": 4, "max_len": 10},
+        {"messages": [{"role": "user", "content": "hi"}], "min_len": 4, "max_len": 10},
+        {"id": "bad", "messages": "nope"},
+    ])
+    log = io.StringIO()
+    stats = run_batch(str(src), str(out), pattern="c", workers=0, progress_out=log)
+    assert stats == {"done": 3, "skipped": 0, "errors": 1}
+    recs = [json.loads(l) for l in out.read_text(encoding="utf-8").splitlines()]
+    assert [r["id"] for r in recs] == ["a", 2, "bad"]
+    assert recs[0]["text"] == "はい。はい。はい。は" and recs[0]["meta"]["returned_chars"] == 10
+    assert "error" in recs[2]
+    assert "3 done" in log.getvalue()
+
+    # A torn trailing line (crash mid-write) is dropped; finished ids are skipped
+    with open(out, "a", encoding="utf-8") as f:
+        f.write('{"id": "x", "te')
+    assert load_checkpoint(str(out)) == {'"a"', "2", '"bad"'}
+    stats = run_batch(str(src), str(out), pattern="c", workers=0, retry_errors=True, progress_out=log)
+    assert stats == {"done": 1, "skipped": 2, "errors": 1}
+    # The rerun replaced the earlier error record instead of adding a second one
+    recs = [json.loads(l) for l in out.read_text(encoding="utf-8").splitlines()]
+    assert sorted(json.dumps(r["id"]) for r in recs) == ['"a"', '"bad"', "2"]
+    assert not (tmp_path / "out.jsonl.tmp").exists()
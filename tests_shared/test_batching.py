@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+
+from common.inference.batching import BatchScheduler, SamplingParams
+
+
+class CountingBackend:
+    # Greedy "next token = previous + 1" model; token 0 is EOS
+    n_vocab = 16
+    n_batch = 64
+    n_ctx_per_seq = 64
+
+    def __init__(self):
+        self.batches = []
+        self.cleared = []
+
+    def decode(self, tokens, positions, seq_ids, want_logits):
+        time.sleep(0.005)
+        self.batches.append(set(seq_ids))
+        rows = []
+        for tok, want in zip(tokens, want_logits):
+            if want:
+                row = np.zeros(self.n_vocab, dtype=np.float32)
+                row[(tok + 1) % self.n_vocab] = 10.0
+                rows.append(row)
+        return rows
+
+    def clear_sequence(self, seq_id):
+        self.cleared.append(seq_id)
+
+    def token_bytes(self, token):
+        return chr(ord("a") + token).encode()
+
+    def token_eos(self):
+        return 0
+
+
+def _suppress_eos(input_ids, scores):
+    scores[0] = -np.inf
+    return scores
+
+
+def test_scheduler_batches_sequences_with_their_own_policies():
+    backend = CountingBackend()
+    scheduler = BatchScheduler(backend, n_slots=4)
+    greedy = SamplingParams(temperature=0)
+    natural = scheduler.submit([5, 13], max_tokens=8, params=greedy)
+    suppressed = scheduler.submit([5, 13], max_tokens=4, params=greedy, processors=[_suppress_eos])
+    other = scheduler.submit([2, 3], max_tokens=3, params=greedy)
+
+    assert "".join(natural) == "op"
+    assert "".join(suppressed) == "opbc"
+    assert "".join(other) == "efg"
+    assert max(len(b) for b in backend.batches) > 1
+    assert sorted(backend.cleared) == [0, 1, 2]
+    assert scheduler.stats()["active"] == 0
+
+
+def test_closing_an_unread_stream_frees_its_slot():
+    backend = CountingBackend()
+    scheduler = BatchScheduler(backend, n_slots=1)
+    greedy = SamplingParams(temperature=0)
+    running = scheduler.submit([1], max_tokens=60, params=greedy, processors=[_suppress_eos])
+    queued = scheduler.submit([1], max_tokens=60, params=greedy, processors=[_suppress_eos])
+    # Neither stream was ever iterated (the client left before the first token)
+    queued.close()
+    running.close()
+
+    # With one slot this only completes once both were dropped
+    assert "".join(scheduler.submit([2, 3], max_tokens=3, params=greedy)) == "efg"
+    stats = scheduler.stats()
+    assert (stats["active"], stats["pending"]) == (0, 0)
+    # ...long before either could have run its 60 tokens
+    assert stats["steps"] < 30
@@ -0,0 +1,47 @@
+from common.inference.budget import CharsPerTokenEstimator, count_completion_tokens, detect_language, request_language
+
+
+def test_detect_language_buckets_by_script():
+    assert detect_language("こんにちは、元気ですか") == "ja"
+    assert detect_language("Hello there, how are you?") == "en"
+    assert detect_language("") == "en"
+    assert request_language([{"role": "system", "content": "日本語で答えて"}, {"role": "user", "content": "hi"}]) == "en"
+
+
+def test_budget_uses_prior_until_warm_then_tracks_ratio():
+    est = CharsPerTokenEstimator(alpha=0.5, min_samples=2)
+    assert est.budget("m", "ja", 240) == (160, None)
+    est.observe("m", "ja", generated_chars=300, completion_tokens=100, returned_chars=240, max_tokens=160, min_chars=120)
+    est.observe("m", "ja", generated_chars=300, completion_tokens=100, returned_chars=240, max_tokens=160, min_chars=120)
+    tokens, ratio = est.budget("m", "ja", 240)
+    assert ratio == 3.0
+    # 240 chars at 3 chars/token, with the minimum 5% margin
+    assert tokens == 85
+    # Other languages keep their own estimate
+    assert est.budget("m", "en", 240) == (160, None)
+
+
+def test_observe_reports_wasted_and_exhausted_budgets():
+    est = CharsPerTokenEstimator()
+    r = est.observe("m", "en", generated_chars=400, completion_tokens=100, returned_chars=240, max_tokens=100, min_chars=120)
+    assert r == {"completion_tokens": 100, "wasted_tokens": 40, "exhausted": False}
+    r = est.observe("m", "en", generated_chars=90, completion_tokens=100, returned_chars=90, max_tokens=100, min_chars=120)
+    assert r["exhausted"] and r["wasted_tokens"] == 0
+    snap = est.snapshot()
+    assert snap["wasted_tokens"] == 40 and snap["exhausted"] == 1
+    assert snap["estimates"][0]["samples"] == 2
+
+
+class ByteTokenizer:
+    def tokenize(self, text, add_bos=True, special=False):
+        return list(text)
+
+
+def test_completion_tokens_prefer_usage_then_sampler_then_chunks():
+    # Two 3-byte characters arriving as one held-back chunk
+    assert count_completion_tokens(ByteTokenizer(), "日本", {"completion_tokens": 5}, 1, 4) == (5, "usage")
+    assert count_completion_tokens(ByteTokenizer(), "日本", {}, 1, 6) == (6, "sampler")
+    assert count_completion_tokens(ByteTokenizer(), "日本", {}, 1) == (1, "stream")
+    # Re-tokenizing is only the fallback for text that was not streamed
+    assert count_completion_tokens(ByteTokenizer(), "日本", {}, 0) == (6, "tokenize")
+    assert count_completion_tokens(object(), "日本", {}, 0) == (0, "stream")
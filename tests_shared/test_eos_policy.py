@@ -0,0 +1,25 @@
+import numpy as np
+
+from common.inference.eos_policy import EosReleasePolicy
+
+
+def test_policy_suppresses_then_forces_eos_after_tail():
+    policy = EosReleasePolicy(eos_token_id=2, eos_bias=float("-inf"), release_after_tokens=100, tail_tokens=2)
+    scores = policy([], np.zeros(8, dtype=np.float32))
+    assert scores[2] == -np.inf
+
+    policy.release()
+    for _ in range(2):
+        scores = policy([], np.zeros(8, dtype=np.float32))
+        assert scores[2] == 0.0 and scores[0] == 0.0
+    scores = policy([], np.zeros(8, dtype=np.float32))
+    assert int(np.argmax(scores)) == 2 and scores[0] == -np.inf
+    # One call per sampled token: the engine counts completion tokens from it
+    assert policy.steps == 4
+
+
+def test_policy_releases_after_token_budget():
+    policy = EosReleasePolicy(eos_token_id=2, eos_bias=-10.0, release_after_tokens=1, tail_tokens=4)
+    assert policy([], np.zeros(4, dtype=np.float32))[2] == -10.0
+    assert policy([], np.zeros(4, dtype=np.float32))[2] == 0.0
+    assert policy.released
@@ -0,0 +1,147 @@
+import dataclasses
+import struct
+
+import pytest
+
+from common.config import reload_settings
+from common.inference import memory
+from common.inference.memory import MemoryBudgetError, ModelShape, plan_memory, read_gguf_metadata
+
+
+def _str(s):
+    b = s.encode("utf-8")
+    return struct.pack("<Q", len(b)) + b
+
+
+def _write_gguf(path, padding=0):
+    kvs = [
+        (_str("general.architecture"), 8, _str("llama")),
+        (_str("llama.block_count"), 4, struct.pack("<I", 32)),
+        (_str("llama.context_length"), 4, struct.pack("<I", 8192)),
+        (_str("llama.embedding_length"), 4, struct.pack("<I", 4096)),
+        (_str("llama.attention.head_count"), 4, struct.pack("<I", 32)),
+        (_str("llama.attention.head_count_kv"), 4, struct.pack("<I", 8)),
+        # Long string array: skipped, only its length is kept
+        (_str("tokenizer.ggml.tokens"), 9, struct.pack("<IQ", 8, 2000) + b"".join(_str(f"t{i}") for i in range(2000))),
+    ]
+    body = b"GGUF" + struct.pack("<IQQ", 3, 0, len(kvs))
+    for key, vtype, value in kvs:
+        body += key + struct.pack("<I", vtype) + value
+    path.write_bytes(body + b"\0" * padding)
+
+
+SHAPE = ModelShape(n_layer=32, n_ctx_train=8192, n_embd=4096, n_head_kv=8, head_k=128, head_v=128, n_vocab=2000)
+MiB = 2**20
+
+
+def test_read_gguf_metadata_and_shape(tmp_path):
+    path = tmp_path / "m.gguf"
+    _write_gguf(path)
+    meta = read_gguf_metadata(str(path))
+    assert meta["general.architecture"] == "llama"
+    assert meta["tokenizer.ggml.tokens"].count == 2000
+    assert ModelShape.from_metadata(meta) == SHAPE
+
+
+def test_plan_prefers_f16_then_quantizes_to_fit_min_ctx():
+    # f16 KV for this shape: 128 KiB per token
+    kw = dict(shape=SHAPE, weights_bytes=1000 * MiB, slots=2, min_ctx=2048, max_ctx=4096, n_batch=512, n_ubatch=512)
+    roomy = plan_memory("m", budget_bytes=4000 * MiB, **kw)
+    assert (roomy.type_k, roomy.ctx_size) == ("f16", 4096)
+    assert roomy.overrides() == {"n_ctx": 4096, "type_k": 1, "type_v": 1}
+
+    tight = plan_memory("m", budget_bytes=1600 * MiB, **kw)
+    assert tight.type_k == "q8_0" and 2048 <= tight.ctx_size < 4096
+    assert tight.estimated_bytes <= 1600 * MiB
+    assert tight.overrides()["flash_attn"] is True
+
+    with pytest.raises(MemoryBudgetError):
+        plan_memory("m", budget_bytes=1100 * MiB, **kw)
+
+
+def test_speculation_budgets_scores_rows_and_the_draft_model():
+    big_vocab = dataclasses.replace(SHAPE, n_vocab=128_000)
+    draft = ModelShape(n_layer=16, n_ctx_train=8192, n_embd=2048, n_head_kv=8, head_k=64, head_v=64, n_vocab=128_000)
+    kw = dict(shape=big_vocab, weights_bytes=1000 * MiB, slots=2, min_ctx=2048, max_ctx=4096, n_batch=512, n_ubatch=512)
+    plain = plan_memory("m", budget_bytes=4000 * MiB, **kw)
+    assert (plain.type_k, plain.ctx_size, plain.speculative_bytes) == ("f16", 4096, 0)
+
+    # logits_all keeps n_ctx * n_vocab float scores per context
+    lookup = plan_memory("m", budget_bytes=4000 * MiB, logits_all=True, **kw)
+    assert (lookup.type_k, lookup.ctx_size) == ("q8_0", 2048)
+    assert lookup.speculative_bytes == 2 * 2048 * 128_000 * 4
+    assert lookup.estimated_bytes <= 4000 * MiB
+
+    # A draft model adds its weights, KV cache and buffers on top
+    spec = dict(logits_all=True, draft_shape=draft, draft_weights_bytes=500 * MiB)
+    with pytest.raises(MemoryBudgetError):
+        plan_memory("m", budget_bytes=4000 * MiB, **spec, **kw)
+    drafted = plan_memory("m", budget_bytes=6000 * MiB, **spec, **kw)
+    assert drafted.speculative_bytes > lookup.speculative_bytes + 500 * MiB
+    assert drafted.estimated_bytes <= 6000 * MiB
+
+
+def test_plan_for_sizes_the_draft_model_from_its_gguf(tmp_path, monkeypatch):
+    path, draft = tmp_path / "m.gguf", tmp_path / "draft.gguf"
+    _write_gguf(path, padding=MiB)
+    _write_gguf(draft, padding=MiB)
+    monkeypatch.setattr(memory, "_plans", {})
+    monkeypatch.setenv("MEMORY_BUDGET_MB", "600")
+    monkeypatch.setenv("POOL_SIZE", "2")
+    monkeypatch.setenv("MEMORY_MIN_CTX", "1024")
+    plain = memory.plan_for(str(path), reload_settings())
+    monkeypatch.setenv("SPECULATIVE", "draft")
+    monkeypatch.setenv("DRAFT_MODEL_PATH", str(draft))
+    drafted = memory.plan_for(str(path), reload_settings())
+    # Same shape again: the KV per token doubles, so the context shrinks
+    assert drafted.speculative_bytes > 0
+    assert drafted.ctx_size < plain.ctx_size or drafted.type_k != plain.type_k
+    assert drafted.estimated_bytes <= 600 * MiB
+    monkeypatch.undo()
+    reload_settings()
+
+
+def test_plan_for_reads_settings_and_feeds_the_report(tmp_path, monkeypatch):
+    path = tmp_path / "m.gguf"
+    _write_gguf(path, padding=MiB)
+    monkeypatch.setattr(memory, "_plans", {})
+    monkeypatch.setenv("MEMORY_BUDGET_MB", "600")
+    monkeypatch.setenv("POOL_SIZE", "2")
+    settings = reload_settings()
+    overrides = memory.llama_overrides(str(path), settings)
+    # f16 cannot fit two 2048-token contexts next to the buffers; q8_0 fits more
+    assert overrides["type_k"] == 8 and 2048 <= overrides["n_ctx"] < 4096
+
+    report = memory.memory_report()
+    assert report["plans"][str(path)]["ctx_size"] == overrides["n_ctx"]
+    assert 0 < report["estimated_bytes"] <= 600 * MiB
+
+    monkeypatch.setenv("MEMORY_BUDGET_MB", "0")
+    assert memory.llama_overrides(str(path), reload_settings()) == {}
+    monkeypatch.undo()
+    reload_settings()
+
+
+def test_budget_that_cannot_fit_fails_startup(tmp_path, monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from common.inference import warmup
+
+    path = tmp_path / "m.gguf"
+    _write_gguf(path, padding=MiB)
+    monkeypatch.setattr(memory, "_plans", {})
+    monkeypatch.setattr(warmup, "_states", {})
+    monkeypatch.setenv("MODEL_PATH", str(path))
+    monkeypatch.setenv("MEMORY_BUDGET_MB", "2")
+    reload_settings()
+    loads = []
+    app = FastAPI()
+    warmup.install_warmup(app, "budget-test", lambda tokens: loads.append(tokens) or {})
+    with pytest.raises(MemoryBudgetError):
+        with TestClient(app):
+            pass
+    # The warm-up never started
+    assert loads == []
+    monkeypatch.undo()
+    reload_settings()
@@ -0,0 +1,33 @@
+from common.metrics import Registry, observe_request, phase_timings, REQUESTS, TRIMMED, LATENCY
+
+
+def test_registry_renders_prometheus_text():
+    reg = Registry()
+    c = reg.counter("x_total", "Things.", ["pattern"])
+    h = reg.histogram("x_seconds", "Time.", [0.1, 1.0], ["pattern"])
+    c.inc(pattern="a")
+    c.inc(2, pattern="a")
+    h.observe(0.05, pattern="a")
+    h.observe(0.5, pattern="a")
+    h.observe(5, pattern="a")
+    reg.register_collector(lambda: [("x_gauge", "gauge", "Live.", [({"q": 'a"b'}, 1.5)])])
+    lines = reg.render().splitlines()
+    assert "# TYPE x_total counter" in lines
+    assert 'x_total{pattern="a"} 3' in lines
+    assert 'x_seconds_bucket{pattern="a",le="0.1"} 1' in lines
+    assert 'x_seconds_bucket{pattern="a",le="1"} 2' in lines
+    assert 'x_seconds_bucket{pattern="a",le="+Inf"} 3' in lines
+    assert 'x_seconds_count{pattern="a"} 3' in lines
+    assert 'x_gauge{q="a\\"b"} 1.5' in lines
+
+
+def test_observe_request_reads_meta():
+    timings = phase_timings(
+        started=0.0, queue_wait_s=0.1, prompt_start=0.1, first_token=0.3, first_text=0.35, finished=1.3, completion_tokens=21
+    )
+    assert timings["prompt_eval_ms"] == 200.0 and timings["decode_tokens_per_s"] == 20.0
+    before = LATENCY.count(pattern="test")
+    observe_request("test", {"timings": timings, "generated_chars": 30, "returned_chars": 20, "min_len": 10})
+    assert LATENCY.count(pattern="test") == before + 1
+    assert REQUESTS.value(pattern="test") >= 1
+    assert TRIMMED.value(pattern="test") >= 1
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from common.inference.pool import LlamaPool, PoolTimeout
+
+
+def test_pool_hands_each_context_to_one_request_at_a_time():
+    created = []
+    pool = LlamaPool(factory=lambda: created.append(object()) or created[-1], size=2, max_queue=8, timeout=5)
+    active = set()
+    clashes = []
+    lock = threading.Lock()
+
+    def worker():
+        with pool.acquire() as llama:
+            with lock:
+                if id(llama) in active:
+                    clashes.append(llama)
+                active.add(id(llama))
+            with lock:
+                active.discard(id(llama))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not clashes
+    assert len(created) <= 2
+    assert pool.stats()["in_use"] == 0
+
+
+def test_pool_times_out_and_rejects_when_queue_is_full():
+    pool = LlamaPool(factory=object, size=1, max_queue=0, timeout=0.01)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()["rejected"] == 1
+
+    pool.max_queue = 1
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+    held.release()
+    pool.acquire().release()
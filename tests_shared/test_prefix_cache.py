@@ -0,0 +1,48 @@
+import numpy as np
+
+from common.inference.prefix_cache import PrefixStateCache
+
+
+class StatefulLlama:
+    # Byte-level tokenizer with a BOS token and a state snapshot API
+    def __init__(self):
+        self.tokens = []
+        self.evaluated = 0
+
+    @property
+    def input_ids(self):
+        return np.array(self.tokens, dtype=np.intc)
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return ([1] if add_bos else []) + list(text)
+
+    def reset(self):
+        self.tokens = []
+
+    def eval(self, tokens):
+        self.evaluated += len(tokens)
+        self.tokens = self.tokens + list(tokens)
+
+    def save_state(self):
+        return list(self.tokens)
+
+    def load_state(self, state):
+        self.tokens = list(state)
+
+
+def test_prefix_cache_restores_snapshot_for_matching_prompt():
+    llama = StatefulLlama()
+    cache = PrefixStateCache()
+    assert cache.warm(llama, "[system]\nS\n\n")
+    # Another prompt evaluated in between leaves unrelated state behind
+    llama.reset()
+    llama.eval(llama.tokenize(b"other"))
+
+    stats = cache.prepare(llama, "[system]\nS\n\n[user]\nhi\n\n[assistant]\n")
+    assert stats["hit"] is True
+    assert stats["tokens_saved"] == cache.prefix_tokens
+    assert llama.tokens[: cache.prefix_tokens] == llama.tokenize(b"[system]\nS\n\n")
+
+    miss = cache.prepare(llama, "[system]\nOther\n\n[user]\nhi\n")
+    assert miss["hit"] is False
+    assert miss["tokens_saved"] < cache.prefix_tokens
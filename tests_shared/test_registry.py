@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from common.inference.pool import LlamaPool, PoolClosed
+from common.inference.registry import ModelNotAllowed, ModelRegistry, model_allowlist
+
+
+class Loader:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.loaded = []
+
+    def pool(self, path):
+        def factory():
+            time.sleep(self.delay)
+            self.loaded.append(path)
+            return object()
+
+        return LlamaPool(factory, size=1)
+
+
+def test_resolve_by_name_or_path_only_from_allowlist():
+    allow = model_allowlist([("small", "/m/small.gguf")], "/m/base.gguf")
+    reg = ModelRegistry(Loader().pool, allow, default="/m/base.gguf")
+    assert reg.resolve(None) == ("default", "/m/base.gguf")
+    assert reg.resolve("small") == ("small", "/m/small.gguf")
+    assert reg.resolve("/m/small.gguf") == ("small", "/m/small.gguf")
+    with pytest.raises(ModelNotAllowed):
+        reg.resolve("/etc/passwd")
+
+
+def test_lru_eviction_skips_models_in_use():
+    loader = Loader()
+    reg = ModelRegistry(loader.pool, [("a", "a"), ("b", "b"), ("c", "c")], default="a", max_models=2)
+    pool_a = reg.get("a")
+    reg.get("b")
+    lease = pool_a.acquire()  # "a" is busy, so "b" goes even though "a" is older
+    reg.get("c")
+    assert set(reg.pools()) == {"a", "c"}
+    lease.release()
+    reg.get("b")  # now "a" is the idle LRU entry
+    assert set(reg.pools()) == {"c", "b"}
+    assert reg.evictions == 2 and loader.loaded == ["a", "b", "c", "b"]
+
+
+def test_memory_budget_counts_model_file_sizes(tmp_path):
+    paths = {}
+    for name, size in (("a", 600), ("b", 600), ("c", 300)):
+        p = tmp_path / f"{name}.gguf"
+        p.write_bytes(b"\0" * size)
+        paths[name] = str(p)
+    reg = ModelRegistry(Loader().pool, list(paths.items()), default="a", max_models=3, memory_budget=1000)
+    reg.get("a")
+    reg.get("c")
+    assert set(reg.pools()) == {"a", "c"}
+    reg.get("b")
+    assert set(reg.pools()) == {"c", "b"}
+
+
+def test_concurrent_requests_share_one_load():
+    loader = Loader(delay=0.05)
+    reg = ModelRegistry(loader.pool, [("a", "a")], default="a")
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(reg.get("a"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert loader.loaded == ["a"]
+    assert len({id(p) for p in pools}) == 1
+    assert reg.stats()[0]["load_s"] >= 0.05
+
+
+def test_concurrent_loads_of_different_models_respect_max_models():
+    loader = Loader(delay=0.05)
+    reg = ModelRegistry(loader.pool, [("a", "a"), ("b", "b")], default="a", max_models=1)
+    threads = [threading.Thread(target=reg.get, args=(name,)) for name in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # The second load saw the first one's reservation and evicted it
+    assert len(reg.pools()) == 1 and reg.evictions == 1
+
+
+def test_pinned_model_is_not_evicted_and_closed_pools_refuse_leases():
+    loader = Loader()
+    reg = ModelRegistry(loader.pool, [("a", "a"), ("b", "b"), ("c", "c")], default="a", max_models=1)
+    lease = reg.acquire("a")
+    stale = reg.get("a")
+    reg.get("b")  # over max_models, but "a" is pinned by the lease
+    assert set(reg.pools()) == {"a", "b"}
+    lease.release()
+    reg.get("c")
+    assert set(reg.pools()) == {"c"}
+    # The evicted pool never hands out a context nobody tracks
+    with pytest.raises(PoolClosed):
+        stale.acquire()
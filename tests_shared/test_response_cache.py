@@ -0,0 +1,98 @@
+import threading
+import time
+
+from common.config import reload_settings
+from common.inference.response_cache import ResponseCache, record, replay, response_key
+
+
+def test_key_only_for_deterministic_requests(monkeypatch):
+    monkeypatch.setenv("TEMPERATURE", "0.7")
+    settings = reload_settings()
+    assert response_key(settings, prompt="p", seed=None) is None
+    assert response_key(settings, prompt="p", seed=1) == response_key(settings, prompt="p", seed=1)
+    assert response_key(settings, prompt="p", seed=1) != response_key(settings, prompt="p", seed=2)
+    monkeypatch.setenv("TEMPERATURE", "0")
+    settings = reload_settings()
+    assert response_key(settings, prompt="p", seed=None) is not None
+    assert response_key(settings, prompt="p", seed=None) != response_key(settings, prompt="q", seed=None)
+
+
+def test_lru_and_ttl():
+    cache = ResponseCache(max_entries=2, ttl_s=60)
+    for k in ("a", "b"):
+        cached, _, flight = cache.acquire(k)
+        assert cached is None and flight.leader
+        flight.complete({"text": k, "meta": {}})
+    assert cache.acquire("a")[1] == "memory"  # "b" is now least recent
+    cache.acquire("c")[2].complete({"text": "c", "meta": {}})
+    cached, _, flight = cache.acquire("b")
+    assert cached is None
+    flight.abandon()
+
+    cache.ttl_s = -1
+    cache.acquire("d")[2].complete({"text": "d", "meta": {}})
+    assert cache.acquire("d")[0] is None
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    first = ResponseCache(ttl_s=60, disk_dir=str(tmp_path))
+    first.acquire("k" * 64)[2].complete({"text": "こんにちは。", "meta": {"n": 1}})
+    second = ResponseCache(ttl_s=60, disk_dir=str(tmp_path))
+    assert second.acquire("k" * 64) == ({"text": "こんにちは。", "meta": {"n": 1}}, "disk", None)
+    assert second.acquire("k" * 64)[1] == "memory"
+
+
+def test_concurrent_identical_requests_run_once():
+    cache = ResponseCache()
+    runs = []
+    results = []
+
+    def request():
+        cached, source, flight = cache.acquire("k")
+        if cached is None:
+            runs.append(1)
+            time.sleep(0.05)
+            events = record(flight, iter([{"event": "done", "text": "x", "meta": {}}]))
+            results.append((list(events)[-1]["meta"]["cache"], None))
+        else:
+            results.append((list(replay(cached, source))[-1]["meta"]["cache"], source))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(runs) == 1
+    assert sorted(s for _, s in results if s) == ["coalesced"] * 3
+    assert cache.stats()["coalesced"] == 3
+
+
+def test_abandoned_leader_hands_over():
+    cache = ResponseCache()
+    events = record(cache.acquire("k")[2], iter([{"event": "delta", "text": "x"}]))
+    next(events)
+    events.close()  # client went away before done
+    cached, _, flight = cache.acquire("k")
+    assert cached is None and flight.leader
+
+
+def test_leader_dropped_before_streaming_hands_over():
+    cache = ResponseCache(wait_s=5)
+    # The leader's client left while it was queued for the pool: its stream
+    # is closed without ever being iterated
+    record(cache.acquire("k")[2], iter([])).close()
+    cached, _, flight = cache.acquire("k")
+    assert cached is None and flight.leader
+
+
+def test_waiters_give_up_on_a_stuck_leader_and_generate():
+    cache = ResponseCache(wait_s=0.05)
+    leader = cache.acquire("k")[2]
+    cached, _, flight = cache.acquire("k")
+    assert cached is None and not flight.leader
+    # The fallback result is cached, but the leader still owns the flight
+    flight.complete({"text": "x", "meta": {}})
+    flight.abandon()
+    assert cache.acquire("k")[1] == "memory"
+    leader.complete({"text": "x", "meta": {}})
+    assert cache.stats()["wait_timeouts"] == 1
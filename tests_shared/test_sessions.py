@@ -0,0 +1,184 @@
+import numpy as np
+import pytest
+
+from common.inference.sessions import SessionStore, UnknownSession, fit_context
+
+
+class State:
+    # The fields of llama_cpp.LlamaState
+    def __init__(self, input_ids, scores, n_tokens, llama_state, llama_state_size, seed=0):
+        self.input_ids = input_ids
+        self.scores = scores
+        self.n_tokens = n_tokens
+        self.llama_state = llama_state
+        self.llama_state_size = llama_state_size
+        self.seed = seed
+
+
+class StatefulLlama:
+    # Byte-level tokenizer with a BOS token and a sized state snapshot
+    def __init__(self, state_size=100):
+        self.tokens = []
+        self.state_size = state_size
+
+    @property
+    def input_ids(self):
+        return np.array(self.tokens, dtype=np.intc)
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return ([1] if add_bos else []) + list(text)
+
+    def eval_prompt(self, prompt):
+        self.tokens = self.tokenize(prompt.encode("utf-8"))
+
+    def save_state(self):
+        data = bytes(self.state_size)
+        return State(self.input_ids, np.zeros((0, 4), dtype=np.float32), len(self.tokens), data, len(data))
+
+    def load_state(self, state):
+        self.tokens = state.input_ids[: state.n_tokens].tolist()
+
+
+SYSTEM = {"role": "system", "content": "S"}
+
+
+def test_conversation_inserts_history_after_system_turn():
+    store = SessionStore(memory_budget=10_000)
+    llama = StatefulLlama()
+    sid = store.create()
+    store.commit(sid, "m", llama, [SYSTEM, {"role": "user", "content": "hi"}], "hello")
+
+    messages = store.conversation(sid, [SYSTEM, {"role": "user", "content": "again"}])
+    assert [m["content"] for m in messages] == ["S", "hi", "hello", "again"]
+    assert store.describe(sid)["turns"] == 1
+
+
+def test_only_issued_ids_are_accepted():
+    store = SessionStore(memory_budget=10_000)
+    sid = store.create()
+    assert len(sid) >= 32 and sid != store.create()
+    assert store.conversation(sid, [SYSTEM]) == [SYSTEM]
+    with pytest.raises(UnknownSession):
+        store.conversation("s1", [SYSTEM])
+
+    # A session deleted mid-turn is not brought back by its commit
+    store.delete(sid)
+    store.commit(sid, "m", StatefulLlama(), [{"role": "user", "content": "hi"}], "ok")
+    assert store.describe(sid) is None
+
+
+def test_restore_loads_state_that_covers_more_of_the_prompt():
+    store = SessionStore(memory_budget=10_000)
+    llama = StatefulLlama()
+    sid = store.create()
+    llama.eval_prompt("[system]\nS\n\n[user]\nhi\n\n[assistant]\nhello")
+    store.commit(sid, "m", llama, [SYSTEM, {"role": "user", "content": "hi"}], "hello")
+    saved = list(llama.tokens)
+
+    # Another conversation ran on this instance in between
+    llama.eval_prompt("[system]\nS\n\n[user]\nother\n")
+    prompt = "[system]\nS\n\n[user]\nhi\n\n[assistant]\nhello\n\n[user]\nagain\n"
+    stats = store.restore(sid, "m", llama, prompt)
+    assert stats["restored"] is True
+    assert stats["source"] == "memory"
+    assert stats["tokens_reused"] == len(saved)
+    assert llama.tokens == saved
+
+    # A different model never gets this session's state
+    assert store.restore(sid, "other", StatefulLlama(), prompt)["restored"] is False
+
+
+def test_states_over_budget_spill_to_disk_and_load_back(tmp_path):
+    store = SessionStore(memory_budget=150, spill_dir=str(tmp_path), state_factory=State)
+    llama = StatefulLlama(state_size=100)
+    a, b = store.create(), store.create()
+    for sid, text in ((a, "a"), (b, "b")):
+        llama.eval_prompt(f"[user]\n{text}\n")
+        store.commit(sid, "m", llama, [{"role": "user", "content": text}], "ok")
+
+    stats = store.stats()
+    assert stats["spills"] == 1
+    assert stats["memory_bytes"] == store.describe(b)["state_bytes"]
+    assert store.describe(a)["location"] == "disk"
+    # Spill files are named by a hash, never by the id itself
+    assert [p.name for p in tmp_path.iterdir()] != [] and all(a not in p.name for p in tmp_path.iterdir())
+
+    llama.eval_prompt("[user]\nb\n")
+    restored = store.restore(a, "m", llama, "[user]\na\n\n[assistant]\nok\n")
+    assert restored["source"] == "disk"
+    assert llama.tokens == llama.tokenize(b"[user]\na\n")
+    # Loading "a" back pushed "b" out in turn
+    assert store.describe(a)["location"] == "memory"
+    assert store.describe(b)["location"] == "disk"
+    assert store.stats()["disk_loads"] == 1
+
+
+def test_spill_files_that_do_not_match_their_header_are_rejected(tmp_path):
+    store = SessionStore(memory_budget=150, spill_dir=str(tmp_path), state_factory=State)
+    llama = StatefulLlama(state_size=100)
+    a, b = store.create(), store.create()
+    for sid in (a, b):
+        llama.eval_prompt("[user]\nx\n")
+        store.commit(sid, "m", llama, [{"role": "user", "content": "x"}], "ok")
+    (path,) = tmp_path.iterdir()
+    path.write_bytes(path.read_bytes()[:-1])
+
+    llama.eval_prompt("[user]\ny\n")
+    assert store.restore(a, "m", llama, "[user]\nx\n\n[assistant]\nok\n")["restored"] is False
+    assert llama.tokens == llama.tokenize(b"[user]\ny\n")
+    assert store.describe(a)["location"] is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_without_spill_dir_states_are_dropped_but_history_kept():
+    store = SessionStore(memory_budget=150, max_sessions=2)
+    llama = StatefulLlama(state_size=100)
+    ids = {}
+    for name in ("a", "b", "c"):
+        ids[name] = store.create()
+        store.commit(ids[name], "m", llama, [{"role": "user", "content": name}], "ok")
+
+    # Each commit pushed the previous state out of the budget; "a" then
+    # fell out on the session count
+    assert store.describe(ids["a"]) is None
+    assert store.describe(ids["b"])["location"] is None
+    assert store.conversation(ids["b"], [])[0]["content"] == "b"
+    assert store.stats()["evictions"] == 3
+
+    assert store.delete(ids["b"]) is True
+    assert store.delete(ids["b"]) is False
+
+
+def test_history_keeps_the_last_max_turns_and_drops_the_stale_snapshot():
+    store = SessionStore(memory_budget=10_000, max_turns=2)
+    llama = StatefulLlama()
+    sid = store.create()
+    messages = [SYSTEM]
+    for turn in ("one", "two", "three"):
+        messages = store.conversation(sid, [SYSTEM, {"role": "user", "content": turn}])
+        llama.eval_prompt(turn)
+        result = store.commit(sid, "m", llama, messages, f"re:{turn}")
+
+    assert result["turns"] == 2 and result["history_trimmed"] is True
+    history = store.conversation(sid, [])
+    assert [m["content"] for m in history] == ["two", "re:two", "three", "re:three"]
+    # The snapshot was of the untrimmed conversation
+    assert store.describe(sid)["location"] is None
+
+
+def test_fit_context_drops_oldest_turns_until_the_prompt_fits():
+    messages = [SYSTEM]
+    for i in range(5):
+        messages += [{"role": "user", "content": f"u{i}" * 10}, {"role": "assistant", "content": f"a{i}" * 10}]
+    messages.append({"role": "user", "content": "new"})
+
+    def count(ms):
+        return sum(len(m["content"]) for m in ms)
+
+    fitted, dropped = fit_context(messages, count, limit=100)
+    assert count(fitted) <= 100 and dropped == 6
+    assert fitted[0] == SYSTEM and fitted[1]["content"] == "u3" * 10 and fitted[-1]["content"] == "new"
+    # The new turn is kept even when nothing fits
+    fitted, _ = fit_context(messages, count, limit=1)
+    assert fitted == [SYSTEM, {"role": "user", "content": "new"}]
+    assert fit_context(messages, count, limit=10_000) == (messages, 0)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from common.config import reload_settings
+from common.inference.speculative import DraftStats, PromptLookupDraft, make_draft_model, speculation_meta
+
+
+def test_prompt_lookup_continues_latest_match():
+    draft = PromptLookupDraft(max_ngram_size=2, num_pred_tokens=3)
+    ids = np.array([5, 6, 7, 8, 9, 5, 6, 1, 2, 5, 6], dtype=np.intc)
+    assert draft(ids).tolist() == [1, 2, 5]  # latest "5 6", not the first
+    # Falls back to a 1-gram, and proposes nothing without any match
+    assert draft(np.array([3, 4, 9, 3], dtype=np.intc)).tolist() == [4, 9, 3]
+    assert draft(np.array([1, 2, 3], dtype=np.intc)).tolist() == []
+
+
+def test_draft_stats_count_accepted_prefix():
+    proposals = iter([[10, 11, 12], [20, 21]])
+    stats = DraftStats(lambda ids: next(proposals), "prompt_lookup")
+    stats(np.array([1, 2], dtype=np.intc))
+    # The model kept 10, 11 and then sampled 13 instead of 12
+    stats(np.array([1, 2, 10, 11, 13], dtype=np.intc))
+    snap = stats.snapshot(completion_tokens=4)
+    assert (snap["drafted"], snap["accepted"]) == (5, 2)
+    assert snap["acceptance_rate"] == round(2 / 3, 4)
+    assert snap["tokens_per_step"] == 2.0
+    stats.reset()
+    assert stats.snapshot(0)["acceptance_rate"] is None
+
+
+def test_make_draft_model_from_settings(monkeypatch):
+    monkeypatch.setenv("SPECULATIVE", "off")
+    assert make_draft_model(reload_settings()) is None
+    assert speculation_meta(object(), 10) is None
+    monkeypatch.setenv("SPECULATIVE", "prompt_lookup")
+    monkeypatch.setenv("SPECULATIVE_TOKENS", "4")
+    draft = make_draft_model(reload_settings())
+    assert isinstance(draft, DraftStats) and draft.inner.num_pred_tokens == 4
+    monkeypatch.setenv("SPECULATIVE", "draft")
+    monkeypatch.setenv("DRAFT_MODEL_PATH", "")
+    with pytest.raises(ValueError):
+        make_draft_model(reload_settings())
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from common.inference.tokenizer import count_chars
+from common.utils.text_sanitize import StreamingSanitizer, auto_close_pairs, remove_phrases, safe_trim
+
+# Terminators, whitespace, pair openers/closers, a combining mark and plain text
+ALPHABET = "。．.!?！？ \n\t()[]{}\"'（）「」『』゙ab日本語"
+BANNED = ["ab", "abab", "日本", "。 "]
+
+
+def _expected(text, max_len, banned=()):
+    out = auto_close_pairs(safe_trim(remove_phrases(text, banned), max_len))
+    return out, count_chars(out)
+
+
+def _pipeline(text, max_len, cuts, banned=()):
+    san = StreamingSanitizer(max_len, banned)
+    pieces, last = [], 0
+    for cut in sorted(cuts) + [len(text)]:
+        pieces.append(san.feed(text[last:cut]))
+        last = cut
+    pieces.append(san.finish())
+    assert "".join(pieces) == san.text
+    return san.text, san.chars
+
+
+def _check(text, max_len, cuts, banned):
+    assert _pipeline(text, max_len, cuts) == _expected(text, max_len)
+    assert _pipeline(text, max_len, cuts, banned) == _expected(text, max_len, banned)
+
+
+def test_pipeline_matches_batch_functions_on_random_splits():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+        cuts = [rng.randint(0, len(text)) for _ in range(rng.randint(0, 6))]
+        banned = rng.sample(BANNED, rng.randint(1, len(BANNED)))
+        _check(text, rng.randint(0, 45), cuts, banned)
+
+
+# Edge cases: (text, max_len, cuts, banned)
+CORPUS = [
+    ("", 0, [], ["ab"]),
+    ("abc。", 0, [1], ["ab"]),
+    ("日本語。日本語。", 4, [2, 5], ["日本"]),
+    ("「ab」。(ab", 5, [1, 3, 6], ["ab"]),
+    ("abab。ab", 10, [1, 2, 3], ["abab", "ab"]),
+    ("a。 b。 c", 3, [2, 3], ["。 "]),
+    ("『日本』「語」", 3, [1, 2, 3, 4, 5], ["日"]),
+    ("ab゙ab゙。", 2, [2, 3], ["b゙"]),
+    ("!?！？.．", 1, [1, 2, 3], ["?！"]),
+    ("(((\n\t)))", 2, [3, 4], ["\n"]),
+    ("{\"'ab'\"}", 4, [0, 0, 9], ["'a", "b'"]),
+]
+
+
+@pytest.mark.parametrize("text,max_len,cuts,banned", CORPUS)
+def test_pipeline_matches_batch_functions_on_edge_cases(text, max_len, cuts, banned):
+    _check(text, max_len, cuts, banned)
+    # Every delta one character long
+    _check(text, max_len, list(range(len(text))), banned)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_pipeline_matches_batch_functions_with_arbitrary_phrases(seed):
+    # Like the random splits above, but banned phrases are any short strings
+    rng = random.Random(seed)
+    for _ in range(100):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 60)))
+        cuts = [rng.randint(0, len(text)) for _ in range(rng.randint(0, 8))]
+        banned = ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 4))]
+        _check(text, rng.randint(0, 70), cuts, banned)
+
+
+def test_banned_phrase_split_across_deltas_is_removed():
+    san = StreamingSanitizer(100, ["絶対に"])
+    assert san.feed("これは絶") == "これは"
+    assert san.feed("対に正しい。") == "正しい。"
+    assert san.finish() == ""
+    assert san.text == "これは正しい。" and san.chars == 7
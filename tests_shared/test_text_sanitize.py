@@ -0,0 +1,35 @@
+from common.utils.text_sanitize import StreamingSanitizer, auto_close_pairs, safe_trim
+
+
+def _stream(text, max_len, step):
+    san = StreamingSanitizer(max_len)
+    out = [san.feed(text[i:i+step]) for i in range(0, len(text), step)]
+    out.append(san.finish())
+    return "".join(out)
+
+
+def test_streaming_sanitizer_matches_batch_functions():
+    samples = [
+        "「こんにちは。今日は(晴れ",
+        "Short text.  ",
+        "Ends mid word and keeps going past the limit",
+        "Sentence one. Sentence two!   trailing",
+        "   ",
+    ]
+    for text in samples:
+        for max_len in (0, 5, 14, 15, 40):
+            for step in (1, 3, 8):
+                assert _stream(text, max_len, step) == auto_close_pairs(safe_trim(text, max_len))
+
+
+def test_early_stop_reason_modes():
+    from common.inference.streaming import early_stop_reason
+
+    s = StreamingSanitizer(10)
+    s.feed("Hi there. ")
+    assert early_stop_reason("max_len", s, 10, 5) is None
+    assert early_stop_reason("sentence", s, 10, 5) == "sentence"
+    assert early_stop_reason("sentence", s, 4, 5) is None
+    s.feed("More")
+    assert early_stop_reason("max_len", s, 14, 5) == "max_len"
+    assert early_stop_reason("off", s, 14, 5) is None
@@ -0,0 +1,21 @@
+from common.inference.tokenizer import StreamingCharCounter, count_chars
+
+
+def _feed_all(pieces):
+    counter = StreamingCharCounter()
+    for p in pieces:
+        counter.feed(p)
+    return counter.count
+
+
+def test_streaming_counter_matches_count_chars():
+    text = "これはテストです。Hello, world!\n" * 3
+    pieces = [text[i:i+3] for i in range(0, len(text), 3)]
+    assert _feed_all(pieces) == count_chars(text)
+
+
+def test_streaming_counter_composes_across_deltas():
+    # "か" + combining dakuten composes to "が"; "e" + U+0301 to "é"
+    assert _feed_all(["か", "゙", "e", "́"]) == count_chars("がé") == 2
+    # Hangul L + V + T jamo compose into one syllable even when split
+    assert _feed_all(["ᄀ", "ᅡ", "ᆨ"]) == 1
@@ -0,0 +1,47 @@
+from common.inference import vocab
+from common.inference.vocab import model_fingerprint, scan_sentence_end_tokens, sentence_end_token_ids
+
+
+class VocabLlama:
+    PIECES = [b"", b"<s>", b"</s>", "です。".encode(), b"Hello", b"end.", "。".encode()[:2], b"\n", b"!?", b"a. b"]
+
+    def __init__(self):
+        self.scans = 0
+
+    def n_vocab(self):
+        self.scans += 1
+        return len(self.PIECES)
+
+    def token_eos(self):
+        return 2
+
+    def detokenize(self, tokens):
+        return b"".join(self.PIECES[t] for t in tokens)
+
+
+def test_scan_finds_tokens_ending_in_terminators():
+    # Partial UTF-8 (6) and tokens with a terminator mid-piece (9) are skipped
+    assert scan_sentence_end_tokens(VocabLlama()) == [3, 5, 7, 8]
+
+
+def test_ids_are_cached_on_disk_by_model_fingerprint(tmp_path, monkeypatch):
+    model = tmp_path / "m.gguf"
+    model.write_bytes(b"GGUF" + b"\0" * 100)
+    cache_dir = tmp_path / "cache"
+    llama = VocabLlama()
+    assert sentence_end_token_ids(llama, str(model), str(cache_dir)) == [3, 5, 7, 8]
+    assert (cache_dir / f"{model_fingerprint(str(model))}.sentence_end.json").exists()
+
+    # A fresh process (empty memo) reads the file instead of rescanning
+    monkeypatch.setattr(vocab, "_memo", {})
+    fresh = VocabLlama()
+    assert sentence_end_token_ids(fresh, str(model), str(cache_dir)) == [3, 5, 7, 8]
+    assert fresh.scans == 0
+
+    model.write_bytes(b"GGUF" + b"\1" * 100)
+    assert sentence_end_token_ids(fresh, str(model), str(cache_dir)) == [3, 5, 7, 8]
+    assert fresh.scans == 1
+
+
+def test_llama_without_vocab_api_returns_none(tmp_path):
+    assert sentence_end_token_ids(object(), str(tmp_path / "missing.gguf"), None) is None